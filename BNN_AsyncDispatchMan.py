@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import asyncio
+import itertools
+import logging
+import aiohttp
+from BitstreamUploadMan import BitstreamUploadMan
+from BNN_FaultDBMan import GoldenMismatchError, NoBoardLeftError
+
+"""
+Fault injection on many boards from a single event loop, one keep-alive connection per board.
+The boards with the job API (/jobs) get the next faults queued while they run, the others one fault at a time.
+"""
+
+
+class BNN_AsyncBoard:
+    """
+    Helper (Man) class for one board server, same protocol as BNN_ServerMan
+    (/fault_inj, /fault_inj_bits, /wait_run, /is_running, /reboot, /jobs) over one persistent connection
+    """
+
+    def __init__(self, server_url: str, upload_man: BitstreamUploadMan,
+                 wait_run_timeout: float = 10, request_timeout: float = 30):
+        """
+        :param server_url: with the port
+        :param wait_run_timeout: run time limit given to /wait_run
+        """
+        self.server_url = server_url
+        self.upload_man = upload_man
+        self.wait_run_timeout = wait_run_timeout
+        self.request_timeout = request_timeout
+        self.session = None
+        # /capabilities of the board, {} for older servers, None if it could not be reached yet
+        self.capabilities = None
+        self.status = "unknown"
+        self.n_runs = 0
+        self.n_failures = 0
+        self.run_time = 0.0
+        self.n_consecutive_failures = 0
+
+    async def open(self):
+        # limit=1: all the requests of the board reuse the same connection
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=1, keepalive_timeout=60),
+                                             timeout=aiohttp.ClientTimeout(total=self.request_timeout))
+        await self.get_capabilities()
+
+    async def get_capabilities(self):
+        try:
+            async with self.session.get(f"{self.server_url}/capabilities") as r:
+                self.capabilities = await r.json() if r.status == 200 else {}
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as exp:
+            self.capabilities = None
+        if self.capabilities is not None:
+            # no negotiation request of upload_man from a worker thread
+            self.upload_man.set_server_encodings(self.server_url, self.capabilities.get('encodings', []))
+        return self.capabilities
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def get_status(self):
+        try:
+            async with self.session.post(f"{self.server_url}/is_running") as r:
+                if r.status != 200:
+                    self.status = "dead"
+                else:
+                    r_json = await r.json()
+                    self.status = "busy" if r_json["running"] in (True, "true") else "idle"
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as exp:
+            self.status = "dead"
+        return self.status
+
+    async def reboot(self):
+        try:
+            async with self.session.post(f"{self.server_url}/reboot") as r:
+                await r.read()
+                self.status = "rebooting" if r.status == 200 else "dead"
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exp:
+            self.status = "dead"
+        return self.status
+
+    async def encode_form(self, data: dict, faulty_bitstream, repair_bitstream=None):
+        """:return: form with data and the (compressed) bitstreams, upload stats"""
+        bitstreams = {
+            'faulty_bitstream': faulty_bitstream
+        }
+        if repair_bitstream is not None:
+            bitstreams['repair_bitstream'] = repair_bitstream
+        encodings = self.upload_man.known_encodings(self.server_url)
+        if encodings is not None and self.upload_man.encoding not in encodings:
+            # raw upload, nothing worth a thread switch
+            files, encoding_data, upload_stats = self.upload_man.encode(self.server_url, bitstreams)
+        else:
+            # compression out of the event loop
+            files, encoding_data, upload_stats = await asyncio.get_running_loop().run_in_executor(
+                None, self.upload_man.encode, self.server_url, bitstreams)
+
+        form = aiohttp.FormData()
+        for field, (fname, payload) in files.items():
+            form.add_field(field, payload, filename=fname, content_type='application/octet-stream')
+        for field, value in dict(data, **encoding_data).items():
+            form.add_field(field, str(value))
+        return form, upload_stats
+
+    async def fault_inj(self, network_name, faulty_bitstream, repair_bitstream=None):
+        """
+        Upload and start a run, see BNN_ServerMan.launch_fault_inj
+        :return: True if the run is started
+        """
+        data = {
+            'network_name': network_name
+        }
+        if repair_bitstream is not None:
+            data['partial'] = '1'
+        form, upload_stats = await self.encode_form(data, faulty_bitstream, repair_bitstream)
+
+        ts_start = time.time()
+        async with self.session.post(f"{self.server_url}/fault_inj", data=form) as r:
+            upload_report = self.upload_man.upload_report(upload_stats, time.time() - ts_start,
+                                                          self.upload_man.server_duration(r.status, await r.read()))
+            logging.getLogger('AsyncDispatchMan').info(f'{self.server_url}: {upload_report}')
+            return r.status == 200
+
+    async def fault_inj_bits(self, network_name, golden_sha256, bits, partial=False):
+        """
+        Start a run with the faulty bitstream generated by the board, see BNN_ServerMan.launch_fault_inj_bits
+        :return: True if the run is started
+        :raise GoldenMismatchError: if the board has another golden bitstream
+        """
+        data = {
+            'network_name': network_name,
+            'golden_sha256': golden_sha256,
+            'bits': '-'.join([str(x) for x in bits])
+        }
+        if partial:
+            data['partial'] = '1'
+        async with self.session.post(f"{self.server_url}/fault_inj_bits", data=data) as r:
+            if r.status == 409:
+                r_json = await r.json()
+                raise GoldenMismatchError(f"{self.server_url}: golden bitstream {r_json['golden_sha256']} "
+                                 f"does not match {golden_sha256}")
+            await r.read()
+            return r.status == 200
+
+    async def wait_run(self):
+        """:return: result of the run ({'index', 'name', 'duration'}), None if no result"""
+        # the board answers within 2 * wait_run_timeout (run, then result pipe)
+        timeout = aiohttp.ClientTimeout(total=2 * self.wait_run_timeout + self.request_timeout)
+        async with self.session.post(f"{self.server_url}/wait_run",
+                                     data={'timeout': str(self.wait_run_timeout)},
+                                     timeout=timeout) as r:
+            if r.status != 200:
+                await r.read()
+                return None
+            return await r.json()
+
+    async def submit_job(self, network_name, fault: dict, golden_sha256=None, timeout=None):
+        """
+        Queue a fault on the board, see BNN_ServerMan.submit_job
+        :param fault: {'bits', 'faulty_bitstream', 'repair_bitstream'}, faulty_bitstream None: generated by the board
+        :return: job id, None if the queue of the board is full
+        :raise GoldenMismatchError: if the board has another golden bitstream
+        """
+        data = {
+            'network_name': network_name,
+            'timeout': self.wait_run_timeout if timeout is None else timeout
+        }
+        if fault.get('repair_bitstream') is not None:
+            data['partial'] = '1'
+        if fault.get('faulty_bitstream') is None:
+            data['golden_sha256'] = golden_sha256
+            data['bits'] = '-'.join([str(x) for x in fault['bits']])
+            form = data
+        else:
+            form, upload_stats = await self.encode_form(data, fault['faulty_bitstream'], fault.get('repair_bitstream'))
+
+        async with self.session.post(f"{self.server_url}/jobs", data=form) as r:
+            r_json = await r.json() if r.content_type == 'application/json' else {}
+            if r.status == 409:
+                raise GoldenMismatchError(f"{self.server_url}: golden bitstream {r_json['golden_sha256']} "
+                                 f"does not match {golden_sha256}")
+            return r_json['job_id'] if r.status == 202 else None
+
+    async def job_results(self, wait: float, ack=()):
+        """
+        Results of the finished jobs, see BNN_ServerMan.job_results
+        :return: results, ids of the jobs queued or running on the board
+        """
+        timeout = aiohttp.ClientTimeout(total=wait + self.request_timeout)
+        async with self.session.post(f"{self.server_url}/jobs/results",
+                                     data={
+                                         'wait': str(wait),
+                                         'ack': ','.join(ack)
+                                     },
+                                     timeout=timeout) as r:
+            if r.status != 200:
+                raise aiohttp.ClientResponseError(r.request_info, r.history, status=r.status)
+            r_json = await r.json()
+            return r_json['results'], r_json['jobs']
+
+    def stats(self):
+        return {
+            'server': self.server_url,
+            'status': self.status,
+            'n_runs': self.n_runs,
+            'n_failures': self.n_failures,
+            'failure_rate': self.n_failures / (self.n_runs + self.n_failures)
+            if self.n_runs + self.n_failures != 0 else 0,
+            'run_duration': self.run_time / self.n_runs if self.n_runs != 0 else None,
+            'throughput': self.n_runs / self.run_time if self.run_time != 0 else 0
+        }
+
+
+class BNN_AsyncDispatchMan:
+    """
+    Helper (Man) class running faults on many boards from one event loop:
+    one worker coroutine per board takes the next fault as soon as its board is free,
+    so the uploads and the /wait_run long-polls of all the boards overlap
+    """
+
+    def __init__(self, servers: list, network_name: str, golden_sha256: str = None,
+                 upload_man: BitstreamUploadMan = None, max_in_flight: int = None, max_attempts: int = 3,
+                 retry_delay: float = 10, max_retry_delay: float = 600, wait_run_timeout: float = 10,
+                 job_depth: int = 2, job_poll_wait: float = 20):
+        """
+        :param servers: server urls, with the port
+        :param golden_sha256: golden bitstream of the boards, for the faults without faulty bitstream
+        :param max_in_flight: faults taken from the iterator and not done yet, job_depth (at least 2) per board
+                              by default
+        :param max_attempts: runs of a fault (on any board) before giving up
+        :param retry_delay: pause of a board after a failure, doubled for each consecutive one up to max_retry_delay
+        :param job_depth: faults queued on the boards with the job API, the running one included
+        :param job_poll_wait: long-poll of the job results
+        """
+        self.upload_man = BitstreamUploadMan() if upload_man is None else upload_man
+        self.boards = [BNN_AsyncBoard(server, self.upload_man, wait_run_timeout) for server in servers]
+        self.network_name = network_name
+        self.golden_sha256 = golden_sha256
+        self.job_depth = job_depth
+        self.job_poll_wait = job_poll_wait
+        self.max_in_flight = max(2, job_depth) * len(self.boards) if max_in_flight is None else max_in_flight
+        self.feed_chunk = max(1, min(16, self.max_in_flight // 2))
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.logger = logging.getLogger('AsyncDispatchMan')
+
+    def run(self, faults, on_result=None):
+        """
+        Run all the faults, blocking
+        :param faults: iterable of {'bits', 'faulty_bitstream'}, iterated in a worker thread (the faulty bitstreams
+                       may be generated on the fly). faulty_bitstream None: generated by the board (golden_sha256)
+        :param on_result: on_result(fault, server_url, fi_result) called from the event loop for each run
+        :return: the faults which failed max_attempts times
+        :raise NoBoardLeftError: if all the boards have another golden bitstream
+        """
+        return asyncio.run(self.dispatch(faults, on_result))
+
+    async def dispatch(self, faults, on_result=None):
+        """Coroutine of run()"""
+        fault_queue = asyncio.Queue()
+        # retries go back to fault_queue without blocking, the in-flight faults are bounded here
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        failed_faults = []
+
+        # the unreachable boards time out together
+        await asyncio.gather(*(board.open() for board in self.boards))
+
+        async def feed():
+            loop = asyncio.get_running_loop()
+            fault_iter = iter(faults)
+            while True:
+                # a few faults per call, the thread switches cost more than the faults
+                faults_chunk = await loop.run_in_executor(None, list, itertools.islice(fault_iter, self.feed_chunk))
+                if len(faults_chunk) == 0:
+                    break
+                for fault in faults_chunk:
+                    await in_flight.acquire()
+                    fault_queue.put_nowait((fault, 0))
+            await fault_queue.join()
+
+        def fault_finished(fault, n_attempts, ok):
+            """:param ok: fault run, or failed: run again until max_attempts"""
+            if ok:
+                in_flight.release()
+            elif n_attempts + 1 < self.max_attempts:
+                fault_queue.put_nowait((fault, n_attempts + 1))
+            else:
+                self.logger.error(f'Fault {fault["bits"]} failed {self.max_attempts} times')
+                failed_faults.append(fault)
+                in_flight.release()
+            fault_queue.task_done()
+
+        def fault_returned(fault, n_attempts):
+            """Not run, for another board"""
+            fault_queue.put_nowait((fault, n_attempts))
+            fault_queue.task_done()
+
+        async def board_worker(board: BNN_AsyncBoard):
+            """One fault at a time, returns if the board gets the job API (restarted server)"""
+            while True:
+                fault, n_attempts = await fault_queue.get()
+                try:
+                    ok = await self.run_fault(board, fault, on_result)
+                except GoldenMismatchError as exp:
+                    # golden bitstream mismatch, the board is not used again
+                    self.logger.error(f'{exp}')
+                    board.status = "mismatch"
+                    fault_returned(fault, n_attempts)
+                    return
+                except Exception as exp:
+                    # unexpected response, the fault is not lost with the worker
+                    self.logger.exception(f'{board.server_url} failed with {exp!r}')
+                    self.board_failed(board)
+                    ok = False
+
+                fault_finished(fault, n_attempts, ok)
+                if not ok:
+                    await self.wait_board(board)
+                    if board.capabilities.get('jobs'):
+                        return
+
+        async def board_job_worker(board: BNN_AsyncBoard):
+            """job_depth faults queued on the board, returns if the board loses the job API (restarted server)"""
+            # job id -> fault, n_attempts of the faults queued on the board
+            board_jobs = {}
+            ack = []
+            job_depth = min(self.job_depth, board.capabilities['jobs'] + 1)
+            while True:
+                try:
+                    # the board starts the next queued fault as soon as a run ends
+                    while len(board_jobs) < job_depth:
+                        if len(board_jobs) == 0:
+                            fault, n_attempts = await fault_queue.get()
+                        elif not fault_queue.empty():
+                            fault, n_attempts = fault_queue.get_nowait()
+                        else:
+                            break
+                        try:
+                            job_id = await board.submit_job(self.network_name, fault, self.golden_sha256)
+                        except Exception:
+                            fault_returned(fault, n_attempts)
+                            raise
+                        if job_id is None:
+                            # board queue full
+                            fault_returned(fault, n_attempts)
+                            break
+                        board_jobs[job_id] = (fault, n_attempts)
+
+                    results, running_jobs = await board.job_results(self.job_poll_wait, ack)
+
+                    ack = [fi_result['job_id'] for fi_result in results]
+                    for fi_result in results:
+                        if fi_result['job_id'] not in board_jobs:
+                            # given up before, or of another dispatch
+                            continue
+                        # in board_jobs until finished, failed with the board if the result is garbled
+                        fault, n_attempts = board_jobs[fi_result['job_id']]
+                        ok = 'error' not in fi_result
+                        if ok:
+                            self.fault_run(board, fault, fi_result, fi_result['run_time'], on_result)
+                        else:
+                            self.logger.error(f'Fault {fault["bits"]} on {board.server_url}: {fi_result["error"]}')
+                            self.board_failed(board)
+                        del board_jobs[fi_result['job_id']]
+                        fault_finished(fault, n_attempts, ok)
+
+                    # lost by the board (restarted)
+                    for job_id in [job_id for job_id in board_jobs if job_id not in running_jobs]:
+                        fault, n_attempts = board_jobs.pop(job_id)
+                        self.logger.error(f'Fault {fault["bits"]} lost by {board.server_url}')
+                        self.board_failed(board)
+                        fault_finished(fault, n_attempts, False)
+                except GoldenMismatchError as exp:
+                    # golden bitstream mismatch, the board is not used again
+                    self.logger.error(f'{exp}')
+                    board.status = "mismatch"
+                    for fault, n_attempts in board_jobs.values():
+                        fault_returned(fault, n_attempts)
+                    return
+                except Exception as exp:
+                    if isinstance(exp, (aiohttp.ClientError, asyncio.TimeoutError, ValueError)):
+                        self.logger.error(f'{board.server_url} failed with {exp!r}')
+                    else:
+                        # unexpected response, the faults are not lost with the worker
+                        self.logger.exception(f'{board.server_url} failed with {exp!r}')
+                    self.board_failed(board)
+                    # may still run on the board, the result is ignored
+                    for fault, n_attempts in board_jobs.values():
+                        fault_finished(fault, n_attempts, False)
+                    board_jobs = {}
+                    ack = []
+                    await self.wait_board(board)
+                    if not board.capabilities.get('jobs'):
+                        return
+
+        async def board_loop(board: BNN_AsyncBoard):
+            if board.capabilities is None:
+                # not reachable at the start
+                board.status = "dead"
+                await self.wait_board(board)
+            while board.status != "mismatch":
+                if board.capabilities.get('jobs'):
+                    await board_job_worker(board)
+                else:
+                    await board_worker(board)
+
+        feeder = asyncio.ensure_future(feed())
+        workers = [asyncio.ensure_future(board_loop(board)) for board in self.boards]
+        try:
+            pending = set(workers) | {feeder}
+            while not feeder.done():
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if feeder not in done and all([w.done() for w in workers]):
+                    raise NoBoardLeftError('No board left to run the faults')
+            feeder.result()
+        finally:
+            for task in workers + [feeder]:
+                task.cancel()
+            await asyncio.gather(*workers, feeder, return_exceptions=True)
+            for board in self.boards:
+                await board.close()
+
+        return failed_faults
+
+    async def run_fault(self, board: BNN_AsyncBoard, fault, on_result=None):
+        """
+        :return: True if the fault was run
+        :raise GoldenMismatchError: if the board has another golden bitstream
+        """
+        faulty_bitstream = fault.get('faulty_bitstream')
+        ts_start = time.time()
+        try:
+            if faulty_bitstream is None:
+                ok = await board.fault_inj_bits(self.network_name, self.golden_sha256, fault['bits'])
+            else:
+                ok = await board.fault_inj(self.network_name, faulty_bitstream, fault.get('repair_bitstream'))
+            fi_result = await board.wait_run() if ok else None
+        except GoldenMismatchError:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as exp:
+            # ValueError: garbled JSON response
+            self.logger.error(f'{board.server_url} failed with {exp!r}')
+            fi_result = None
+
+        if fi_result is None:
+            self.board_failed(board)
+            return False
+
+        self.fault_run(board, fault, fi_result, time.time() - ts_start, on_result)
+        return True
+
+    def board_failed(self, board: BNN_AsyncBoard):
+        board.status = "dead"
+        board.n_failures += 1
+        board.n_consecutive_failures += 1
+
+    def fault_run(self, board: BNN_AsyncBoard, fault, fi_result, run_time, on_result=None):
+        """Result of a fault run on board"""
+        board.status = "idle"
+        board.n_runs += 1
+        board.run_time += run_time
+        board.n_consecutive_failures = 0
+        self.logger.info(f'Fault {fault["bits"]} injection on {board.server_url} returns {fi_result}')
+        if on_result is not None:
+            try:
+                on_result(fault, board.server_url, fi_result)
+            except Exception as exp:
+                # not the board's failure, the result is in the log above
+                self.logger.exception(f'Fault {fault["bits"]}: on_result failed with {exp!r}')
+
+        # Clean up
+        for bitstream in (fault.get('faulty_bitstream'), fault.get('repair_bitstream')):
+            if isinstance(bitstream, str):
+                os.remove(bitstream)
+
+    async def wait_board(self, board: BNN_AsyncBoard):
+        """Pause after a failure, until the board is idle again, its capabilities probed again (restarted server)"""
+        delay = min(self.retry_delay * 2 ** (board.n_consecutive_failures - 1), self.max_retry_delay)
+        while True:
+            await asyncio.sleep(delay)
+            if await board.get_status() == "idle" and await board.get_capabilities() is not None:
+                return
+            delay = min(2 * delay, self.max_retry_delay)
+
+    def stats(self):
+        """:return: per board status, runs, failure rate, mean run duration and throughput (runs/s)"""
+        return [board.stats() for board in self.boards]
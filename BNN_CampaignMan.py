@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import random
+import logging
+from os.path import isfile, isdir
+from BNN_FaultDBMan import BNN_FaultDBMan, FAULT_PENDING, FAULT_LEASED, FAULT_EXECUTED
+
+"""
+Crash-safe fault injection campaigns
+"""
+
+
+class BNN_CampaignMan:
+    """
+    Helper (Man) class for a fault injection campaign that survives a crash of the coordinator.
+    The planned faults are the rows of the fault database (pending, leased or executed), and a JSON checkpoint
+    keeps the random sampler state and the number of faults in the database when the campaign started.
+    On restart, the unexecuted faults are re-queued first (pending_faults), then the sampler continues from the
+    checkpoint. Faults drawn again after the checkpoint are already in the database, plan() skips them, so no
+    work is redone and the budget is kept.
+    """
+
+    def __init__(self, db_man: BNN_FaultDBMan, checkpoint_filename: str, total_faults: int,
+                 seed: int = None, checkpoint_interval: float = 10.0):
+        """
+        :param total_faults: faults to plan in the campaign
+        :param seed: sampler seed of a new campaign, random by default
+        :param checkpoint_interval: seconds between two checkpoints, see plan()
+        """
+        self.db_man = db_man
+        self.checkpoint_filename = checkpoint_filename
+        self.total_faults = total_faults
+        self.checkpoint_interval = checkpoint_interval
+        self.logger = logging.getLogger('CampaignMan')
+        self.db_man.fault_writer.flush()
+
+        if isfile(checkpoint_filename):
+            with open(checkpoint_filename, 'r') as f_checkpoint:
+                checkpoint = json.load(f_checkpoint)
+            self.seed = checkpoint['seed']
+            self.n_faults_base = checkpoint['n_faults_base']
+            self.random = random.Random()
+            version, internal_state, gauss_next = checkpoint['random_state']
+            self.random.setstate((version, tuple(internal_state), gauss_next))
+            self.logger.info(f'Resuming campaign {checkpoint_filename}')
+        else:
+            self.seed = seed if seed is not None else random.SystemRandom().randrange(1 << 32)
+            self.n_faults_base = self.db_man.fault_sets_db_state()[1]
+            self.random = random.Random(self.seed)
+
+        # faults planned by the campaign, the ones written after the checkpoint included
+        self.n_planned = self.db_man.fault_sets_db_state()[1] - self.n_faults_base
+        self.last_checkpoint_ts = 0
+        self.checkpoint()
+
+    def pending_faults(self):
+        """:return: bits of the planned faults not executed yet (pending, or leased by a run that never ended)"""
+        return self.db_man.get_unexecuted_fault_bits()
+
+    def is_done(self):
+        return self.n_planned >= self.total_faults
+
+    def plan(self, bits, frame_addr=None, frame_b_offset=None, props=None):
+        """
+        Record a new fault of the campaign as pending
+        :return: False if the fault is already in the database
+        """
+        if self.db_man.is_fault_scheduled(bits):
+            return False
+
+        self.db_man.update_fault(bits, status=FAULT_PENDING, frame_addr=frame_addr, frame_b_offset=frame_b_offset,
+                                 props=props)
+        self.n_planned += 1
+        if time.time() - self.last_checkpoint_ts >= self.checkpoint_interval:
+            self.checkpoint()
+        return True
+
+    def lease(self, bits):
+        """The fault is dispatched to a board"""
+        self.db_man.update_fault(bits, status=FAULT_LEASED)
+
+    def complete(self, bits, **results):
+        """The result of the fault is in, results are the other update_fault() arguments"""
+        self.db_man.update_fault(bits, status=FAULT_EXECUTED, **results)
+
+    def checkpoint(self):
+        """
+        Save the sampler state, after the faults it planned are in the database (never ahead of it)
+        """
+        self.db_man.save_fault_sets()
+        version, internal_state, gauss_next = self.random.getstate()
+        checkpoint = {
+            'seed': self.seed,
+            'n_faults_base': self.n_faults_base,
+            'total_faults': self.total_faults,
+            'n_planned': self.n_planned,
+            'random_state': [version, list(internal_state), gauss_next],
+            'ts': time.time()
+        }
+        # written aside and renamed, a crash never leaves a partial checkpoint
+        with open(self.checkpoint_filename + '.tmp', 'w') as f_checkpoint:
+            json.dump(checkpoint, f_checkpoint)
+        os.replace(self.checkpoint_filename + '.tmp', self.checkpoint_filename)
+        self.last_checkpoint_ts = time.time()
+
+    @staticmethod
+    def cleanup_orphans(faulty_bitstream_dir: str, prefix: str):
+        """
+        Remove the faulty bitstreams left by a previous run, they are generated again for the re-queued faults
+        :return: number of files removed
+        """
+        if not isdir(faulty_bitstream_dir):
+            return 0
+        n_removed = 0
+        for fname in os.listdir(faulty_bitstream_dir):
+            if fname.startswith(prefix) and fname.endswith('.bit'):
+                os.remove(os.path.join(faulty_bitstream_dir, fname))
+                n_removed += 1
+        return n_removed
+
+    def close(self):
+        self.checkpoint()
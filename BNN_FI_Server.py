@@ -1,24 +1,56 @@
 #!/usr/bin/python3
 
 import bnn
-from pynq import Xlnk
-from BitstreamMan import BitstreamMan
+from pynq import Xlnk, Overlay, Bitstream
+from BitstreamMan import BitstreamMan, file_sha256
+from LogicLocationMan import LogicLocationMan
 import os
 import shutil
 import sys
+import zlib
 import time
 from pprint import pprint
 from flask import Flask, request, jsonify, abort
+from werkzeug.serving import WSGIRequestHandler
 from multiprocessing import Process, Pipe, Event
-from threading import Thread
+from threading import Thread, Condition
+from collections import deque, OrderedDict
 import logging
 
 
 current_fi_run = None
+# False when the PL (or the package bitstream) may hold a faulty configuration
+pl_is_golden = False
+current_fi_run_partial = False
+
+# Job API (/jobs): the submitted faults are run back to back by job_runner from a small local queue
+JOB_QUEUE_SIZE = 4
+# default time limit of a job run, as the timeout of /wait_run
+JOB_RUN_TIMEOUT = 10
+# results kept until acknowledged by the client, the oldest are dropped beyond
+JOB_RESULTS_SIZE = 1000
+# the job ids of two server runs differ
+JOB_ID_PREFIX = f'{int(time.time()):x}'
+jobs_cond = Condition()
+job_queue = deque()
+job_results = OrderedDict()
+n_jobs = 0
+# owner of the current run: None, 'legacy' (/fault_inj, /fault_inj_bits, /do_run then /wait_run) or a job id
+run_owner = None
+# a legacy run ended and not collected by /wait_run within this time (seconds) gives the run slot to the queued jobs
+LEGACY_RUN_GRACE = 30
+# when the legacy run was first seen ended with jobs queued, see reap_legacy_run
+legacy_run_ended = None
+# /wait_run is collecting the legacy run, not to be reaped
+legacy_run_collecting = False
 
 BNN_BISTREAM_DIR = '/usr/local/lib/python3.6/dist-packages/bnn/bitstreams/'
+GOLDEN_BITSTREAM_DIR = '/home/xilinx/PynqSEUInj/bitstreams/'
 PLATFORM = 'pynqZ1-Z2'
 
+# network_name -> {'mtime', 'sha256', 'bman'} of the golden bitstreams, see get_golden_bman
+golden_bmans = {}
+
 xlnk = Xlnk()
 
 server_logger = logging.getLogger('FaultInjServer')
@@ -32,9 +64,14 @@ server_logger.addHandler(fh)
 def workload(p: Pipe,
              network_name: str = 'cnvW1A1',
              classifier_name: str = 'road-signs',
-             image_filename: str = './images/cross.jpg'):
+             image_filename: str = './images/cross.jpg',
+             partial_bitstream: str = None,
+             repair_bitstream: str = None,
+             golden_bitstream: str = None):
     """
         for the fault injection, use only road-signs
+        partial_bitstream is loaded on top of the golden configuration before the classification,
+        and repair_bitstream (golden frames) after it. golden_bitstream is fully loaded first if given.
     """
     # server_Logger_in_wl = logging.getLogger('FaultInjServer')
     bnn_networks = {
@@ -53,9 +90,16 @@ def workload(p: Pipe,
     else: # 'lfc'
         classifier = bnn.LfcClassifier(network_name, classifier_name, bnn.RUNTIME_HW)
 
+    if golden_bitstream is not None:
+        Overlay(golden_bitstream).download()
+    if partial_bitstream is not None:
+        Bitstream(partial_bitstream, partial=True).download()
+
     classifier_result_index = classifier.classify_path(image_filename)
     # classifier_result_name = classifier.class_name(classifier_result_index)
     classifier_duration = classifier.usecPerImage
+    if repair_bitstream is not None:
+        Bitstream(repair_bitstream, partial=True).download()
     p.send({
         'index': classifier_result_index,
         # 'name': classifier_result_name,
@@ -69,35 +113,484 @@ app = Flask(__name__)
 fi_p_parent, fi_run_p_child = Pipe()
 
 
-@app.route('/fault_inj', methods=['POST', ])
-def do_fault_injection():
-    global current_fi_run
-    global fi_run_p_child
-    global server_logger
+def get_golden_bman(network_name: str):
+    """
+    Golden bitstream of network_name from GOLDEN_BITSTREAM_DIR, parsed once and kept in memory.
+    The FAR of the frames, for the partial runs, are read from the Logic Location file next to it if any
+    :return: sha256 of the golden bitstream file, BitstreamMan
+    """
+    global golden_bmans
+    golden_bs_filename = os.path.join(GOLDEN_BITSTREAM_DIR, network_name + '-' + PLATFORM + '.bit')
+    ll_filename = golden_ll_filename(network_name)
+    mtime = (os.path.getmtime(golden_bs_filename),
+             os.path.getmtime(ll_filename) if os.path.isfile(ll_filename) else None)
+    golden = golden_bmans.get(network_name)
+    if golden is None or golden['mtime'] != mtime:
+        server_logger.info(f'Loading golden bitstream {golden_bs_filename}')
+        bman = BitstreamMan(golden_bs_filename, use_mmap=True)
+        if mtime[1] is not None:
+            server_logger.info(f'Loading Logic Location file {ll_filename}')
+            bman.register_frame_addresses(LogicLocationMan(ll_filename))
+        golden = {
+            'mtime': mtime,
+            'sha256': file_sha256(golden_bs_filename),
+            'bman': bman
+        }
+        golden_bmans[network_name] = golden
+    return golden['sha256'], golden['bman']
+
+
+def golden_ll_filename(network_name: str):
+    """:return: Logic Location file of the golden bitstream of network_name, needed by the partial runs of bits"""
+    return os.path.join(GOLDEN_BITSTREAM_DIR, network_name + '-' + PLATFORM + '.ll')
+
+
+def check_partial_bits(bman: BitstreamMan, bits: list):
+    """:raise ValueError: if the FAR of a frame of bits is unknown (no Logic Location file, or not in it)"""
+    for bit in bits:
+        bman.get_frame_far(int(bit / (bman.N_WORDS_IN_FRAME * 32)))
+
+
+def restore_golden_bitstream(network_name: str):
+    """
+    Bring back the golden configuration left faulty by a full or an interrupted run before a partial one
+    :return: golden bitstream file to fully load first, None if the PL is already golden
+    """
+    if pl_is_golden:
+        return None
 
-    network_name = request.form.get('network_name')
-    faulty_bitstream = request.files.get('faulty_bitstream')
+    golden_bs_filename = os.path.join(GOLDEN_BITSTREAM_DIR, network_name + '-' + PLATFORM + '.bit')
+    shutil.copyfile(golden_bs_filename,
+                    os.path.join(BNN_BISTREAM_DIR, PLATFORM, network_name + '-' + PLATFORM + '.bit'))
+    return golden_bs_filename
 
-    server_logger.info(f"New run: {faulty_bitstream}")
 
-    target_bs_filename = os.path.join(BNN_BISTREAM_DIR, PLATFORM,
-                                      network_name + '-' + PLATFORM + '.bit')
+def start_fi_run(network_name: str,
+                 partial_bs_filename: str = None,
+                 repair_bs_filename: str = None,
+                 golden_bs_filename: str = None,
+                 ts_received: float = None):
+    """
+    :param ts_received: when the uploaded bitstreams were received, the time spent from then on is returned
+                        (server_duration) so that the client can tell the transfer time from its request time
+    """
+    launch_fi_run(network_name, partial_bs_filename, repair_bs_filename, golden_bs_filename)
+
+    fi_run_status = {
+        'running': current_fi_run.is_alive()
+    }
+    if ts_received is not None:
+        fi_run_status['server_duration'] = time.time() - ts_received
+    return jsonify(fi_run_status)
+
 
-    faulty_bitstream.save(target_bs_filename)
-    server_logger.info(f"BS saved")
+def launch_fi_run(network_name: str,
+                  partial_bs_filename: str = None,
+                  repair_bs_filename: str = None,
+                  golden_bs_filename: str = None):
+    global current_fi_run, current_fi_run_partial, pl_is_golden
+    global fi_run_p_child
 
+    current_fi_run_partial = partial_bs_filename is not None and repair_bs_filename is not None
+    pl_is_golden = False
     current_fi_run = Process(target=workload, args=(fi_run_p_child,
                                                     network_name,
                                                     'road-signs',
-                                                    '/home/xilinx/PynqSEUInj/images/cross.jpg'))
+                                                    '/home/xilinx/PynqSEUInj/images/cross.jpg',
+                                                    partial_bs_filename,
+                                                    repair_bs_filename,
+                                                    golden_bs_filename))
     current_fi_run.start()
     server_logger.info(f"Run started")
 
+
+def collect_fi_run(timeout: float):
+    """
+    Wait for the current run, terminated if not finished within timeout
+    :return: classification result of the run ({'index', 'duration'}, index -1 if it failed)
+    """
+    global current_fi_run, fi_p_parent, fi_run_p_child, xlnk, server_logger
+    global current_fi_run_partial, pl_is_golden
+
+    try:
+        current_fi_run.join(timeout=timeout)
+        if current_fi_run.exitcode is None:
+            raise TimeoutError()
+
+        server_logger.info(f'wait_run: Run finished successfully')
+        current_fi_run = None
+        if fi_p_parent.poll(timeout=timeout):
+            class_res = fi_p_parent.recv()
+            server_logger.info(f'{class_res}')
+            # the repair bitstream has been loaded at the end of the workload
+            pl_is_golden = current_fi_run_partial
+        else:
+            server_logger.error(f'pipe read timeout for {timeout} secs')
+            server_logger.info(f'recreating pipe for next run')
+            fi_p_parent, fi_run_p_child = Pipe()
+            class_res = {
+                'index': -1,
+                'duration': 0
+            }
+    except TimeoutError as toe:
+        server_logger.warning(f"wait_run: timeout")
+        if current_fi_run is not None:
+            while current_fi_run.is_alive():
+                server_logger.info(f"terminating run")
+                current_fi_run.terminate()
+                time.sleep(1)
+            current_fi_run = None
+        server_logger.info('recreating the pipe for next run')
+        fi_p_parent, fi_run_p_child = Pipe()
+        class_res = {
+            'index': -1,
+            'duration': 0
+        }
+
+    xlnk.xlnk_reset()
+    return class_res
+
+
+# encodings of the uploaded bitstreams, see save_bitstream
+UPLOAD_ENCODINGS = {
+    'zlib': 15,
+    'gzip': 31
+}
+
+
+@app.route('/capabilities', methods=['GET', ])
+def capabilities():
     return jsonify({
-        'running': current_fi_run.is_alive()
+        'encodings': list(UPLOAD_ENCODINGS.keys()),
+        'fault_inj_bits': True,
+        # networks with a Logic Location file, partial=1 with bits is rejected (400) for the others
+        'partial_bits': sorted(fname[:-len('-' + PLATFORM + '.ll')] for fname in os.listdir(GOLDEN_BITSTREAM_DIR)
+                               if fname.endswith('-' + PLATFORM + '.ll')),
+        'jobs': JOB_QUEUE_SIZE
     })
 
 
+def save_bitstream(uploaded_bitstream, bs_filename: str, encoding: str = None):
+    """
+    Save an uploaded bitstream, decompressed chunk by chunk if encoding is given
+    """
+    if encoding is None:
+        uploaded_bitstream.save(bs_filename)
+        return
+
+    decompressor = zlib.decompressobj(UPLOAD_ENCODINGS[encoding])
+    with open(bs_filename, 'wb') as f_bs:
+        for chunk in iter(lambda: uploaded_bitstream.stream.read(1 << 20), b''):
+            f_bs.write(decompressor.decompress(chunk))
+        f_bs.write(decompressor.flush())
+
+
+@app.route('/fault_inj', methods=['POST', ])
+def do_fault_injection():
+    global server_logger
+
+    network_name = request.form.get('network_name')
+    faulty_bitstream = request.files.get('faulty_bitstream')
+    # the whole request body is parsed by now
+    ts_received = time.time()
+    # partial=1: faulty_bitstream only holds the faulty frames, repair_bitstream the golden ones
+    partial = request.form.get('partial') == '1'
+    # compression of the bitstreams, see /capabilities
+    encoding = request.form.get('encoding')
+    if encoding is not None and encoding not in UPLOAD_ENCODINGS:
+        abort(400)
+    if not acquire_run_slot():
+        return jsonify({
+            'error': 'running jobs'
+        }), 503
+
+    server_logger.info(f"New run: {faulty_bitstream} {'(partial)' if partial else ''} {encoding or ''}")
+
+    target_bs_filename = os.path.join(BNN_BISTREAM_DIR, PLATFORM,
+                                      network_name + '-' + PLATFORM + '.bit')
+
+    try:
+        if partial:
+            repair_bitstream = request.files.get('repair_bitstream')
+            partial_bs_filename = os.path.join(FAULTY_BITSTREAM_FOLDER, network_name + '-partial.bit')
+            repair_bs_filename = os.path.join(FAULTY_BITSTREAM_FOLDER, network_name + '-repair.bit')
+            save_bitstream(faulty_bitstream, partial_bs_filename, encoding)
+            if repair_bitstream is not None:
+                save_bitstream(repair_bitstream, repair_bs_filename, encoding)
+            else:
+                repair_bs_filename = None
+            golden_bs_filename = restore_golden_bitstream(network_name)
+        else:
+            save_bitstream(faulty_bitstream, target_bs_filename, encoding)
+            partial_bs_filename = None
+            repair_bs_filename = None
+            golden_bs_filename = None
+        server_logger.info(f"BS saved")
+
+        return start_fi_run(network_name, partial_bs_filename, repair_bs_filename, golden_bs_filename, ts_received)
+    except Exception:
+        # e.g. corrupted compressed upload, no run to wait for
+        release_run_slot()
+        raise
+
+
+@app.route('/fault_inj_bits', methods=['POST', ])
+def do_fault_injection_bits():
+    """
+    Fault injection with the faulty bitstream generated on the board from the golden one.
+    form: network_name, golden_sha256 (of the golden bitstream the bits refer to),
+          bits ('-' separated bit offsets), partial=1 for a partial reconfiguration run
+    409 if the golden bitstream of the board does not match golden_sha256,
+    400 for a partial run if the FAR of a frame is unknown (no Logic Location file, see /capabilities)
+    """
+    global server_logger
+
+    network_name = request.form.get('network_name')
+    golden_sha256 = request.form.get('golden_sha256')
+    bits = [int(x) for x in request.form.get('bits').split('-')]
+    partial = request.form.get('partial') == '1'
+
+    server_logger.info(f"New run: bits {bits} {'(partial)' if partial else ''}")
+
+    board_sha256, bman = get_golden_bman(network_name)
+    if board_sha256 != golden_sha256:
+        server_logger.error(f'Golden bitstream mismatch: {golden_sha256} requested, {board_sha256} on the board')
+        return jsonify({
+            'error': 'golden bitstream mismatch',
+            'golden_sha256': board_sha256
+        }), 409
+    if partial:
+        try:
+            check_partial_bits(bman, bits)
+        except ValueError as ve:
+            # frame address unknown on the board
+            server_logger.error(f'{ve}')
+            return jsonify({
+                'error': f'{ve}'
+            }), 400
+    if not acquire_run_slot():
+        return jsonify({
+            'error': 'running jobs'
+        }), 503
+
+    try:
+        if partial:
+            partial_bs_filename = os.path.join(FAULTY_BITSTREAM_FOLDER, network_name + '-partial.bit')
+            repair_bs_filename = os.path.join(FAULTY_BITSTREAM_FOLDER, network_name + '-repair.bit')
+            bman.dump_partial_bitstream(bits, partial_bs_filename)
+            bman.dump_partial_bitstream([], repair_bs_filename,
+                                        frame_l_addrs=[int(bit / (bman.N_WORDS_IN_FRAME * 32)) for bit in bits])
+            golden_bs_filename = restore_golden_bitstream(network_name)
+        else:
+            bman.dump_faulty_bitstream(bits, os.path.join(BNN_BISTREAM_DIR, PLATFORM,
+                                                          network_name + '-' + PLATFORM + '.bit'))
+            partial_bs_filename = None
+            repair_bs_filename = None
+            golden_bs_filename = None
+        server_logger.info(f"BS generated")
+
+        return start_fi_run(network_name, partial_bs_filename, repair_bs_filename, golden_bs_filename)
+    except Exception:
+        release_run_slot()
+        raise
+
+
+def acquire_run_slot():
+    """:return: True if no job is queued or running, the next runs are started by the legacy endpoints"""
+    global run_owner
+    with jobs_cond:
+        if run_owner not in (None, 'legacy') or len(job_queue) != 0:
+            return False
+        run_owner = 'legacy'
+        return True
+
+
+def release_run_slot():
+    """End of a legacy run, the jobs can run"""
+    global run_owner
+    with jobs_cond:
+        if run_owner == 'legacy':
+            run_owner = None
+            jobs_cond.notify_all()
+
+
+def reap_legacy_run():
+    """
+    Give the run slot to the queued jobs when the legacy run ended and its client did not call /wait_run
+    (disconnected, or the start failed) within LEGACY_RUN_GRACE, called with jobs_cond held
+    """
+    global run_owner, legacy_run_ended
+
+    if run_owner != 'legacy' or legacy_run_collecting or len(job_queue) == 0 or \
+            (current_fi_run is not None and current_fi_run.is_alive()):
+        legacy_run_ended = None
+        return
+
+    if legacy_run_ended is None:
+        legacy_run_ended = time.time()
+    elif time.time() - legacy_run_ended > LEGACY_RUN_GRACE:
+        server_logger.warning(f'Legacy run not collected by /wait_run, run slot released for the jobs')
+        if current_fi_run is not None:
+            # drop its result from the pipe
+            collect_fi_run(0)
+        run_owner = None
+        legacy_run_ended = None
+
+
+def job_filename(job_id: str, kind: str):
+    return os.path.join(FAULTY_BITSTREAM_FOLDER, f'job-{job_id}-{kind}.bit')
+
+
+@app.route('/jobs', methods=['POST', ])
+def submit_job():
+    """
+    Queue a fault injection run, started as soon as the previous one is finished.
+    form: network_name, partial=1 for a partial reconfiguration run, timeout of the run (JOB_RUN_TIMEOUT),
+          and as /fault_inj: faulty_bitstream (repair_bitstream) files and their encoding,
+          or as /fault_inj_bits: bits and golden_sha256, the faulty bitstream generated by the board
+    202 with the job_id, 503 if the queue is full, 409 if the golden bitstream does not match golden_sha256,
+    400 for a partial run of bits if the FAR of a frame is unknown (no Logic Location file, see /capabilities)
+    """
+    global n_jobs
+
+    network_name = request.form.get('network_name')
+    partial = request.form.get('partial') == '1'
+    timeout = float(request.form.get('timeout', JOB_RUN_TIMEOUT))
+    bits = request.form.get('bits')
+    encoding = request.form.get('encoding')
+    if encoding is not None and encoding not in UPLOAD_ENCODINGS:
+        abort(400)
+    if bits is not None:
+        board_sha256, bman = get_golden_bman(network_name)
+        if board_sha256 != request.form.get('golden_sha256'):
+            return jsonify({
+                'error': 'golden bitstream mismatch',
+                'golden_sha256': board_sha256
+            }), 409
+        if partial:
+            try:
+                check_partial_bits(bman, [int(x) for x in bits.split('-')])
+            except ValueError as ve:
+                # frame address unknown on the board
+                return jsonify({
+                    'error': f'{ve}'
+                }), 400
+
+    with jobs_cond:
+        if len(job_queue) >= JOB_QUEUE_SIZE:
+            return jsonify({
+                'error': 'job queue full'
+            }), 503
+        n_jobs += 1
+        job_id = f'{JOB_ID_PREFIX}-{n_jobs}'
+
+    job = {
+        'job_id': job_id,
+        'network_name': network_name,
+        'partial': partial,
+        'timeout': timeout,
+        'bits': None,
+        'faulty_bitstream': job_filename(job_id, 'faulty'),
+        'repair_bitstream': None
+    }
+    if bits is not None:
+        job['bits'] = [int(x) for x in bits.split('-')]
+        if partial:
+            job['repair_bitstream'] = job_filename(job_id, 'repair')
+    else:
+        save_bitstream(request.files.get('faulty_bitstream'), job['faulty_bitstream'], encoding)
+        repair_bitstream = request.files.get('repair_bitstream')
+        if partial and repair_bitstream is not None:
+            job['repair_bitstream'] = job_filename(job_id, 'repair')
+            save_bitstream(repair_bitstream, job['repair_bitstream'], encoding)
+
+    with jobs_cond:
+        job_queue.append(job)
+        jobs_cond.notify_all()
+    server_logger.info(f"Job {job_id} queued: {job['bits'] or ''} {'(partial)' if partial else ''}")
+
+    return jsonify({
+        'job_id': job_id
+    }), 202
+
+
+@app.route('/jobs/results', methods=['POST', 'GET'])
+def get_job_results():
+    """
+    Results of the finished jobs, returned until acknowledged.
+    form: ack (',' separated job ids of the results received), wait for a result (seconds) if there is none
+    :return: results ({'job_id', 'index', 'duration', 'run_time'}, 'error' if the job could not run),
+             jobs queued or running
+    """
+    ack = request.values.get('ack')
+    wait = float(request.values.get('wait', 0))
+    with jobs_cond:
+        for job_id in ack.split(',') if ack else []:
+            job_results.pop(job_id, None)
+        jobs_cond.wait_for(lambda: len(job_results) != 0, timeout=wait)
+
+        return jsonify({
+            'results': list(job_results.values()),
+            'jobs': [job['job_id'] for job in job_queue] + ([run_owner] if run_owner not in (None, 'legacy') else [])
+        })
+
+
+def prepare_job(job: dict):
+    """
+    Faulty bitstream of the job in place, when it is its turn
+    :return: partial, repair and golden bitstream files of launch_fi_run
+    """
+    network_name = job['network_name']
+    target_bs_filename = os.path.join(BNN_BISTREAM_DIR, PLATFORM, network_name + '-' + PLATFORM + '.bit')
+    if job['bits'] is not None:
+        board_sha256, bman = get_golden_bman(network_name)
+        if not job['partial']:
+            bman.dump_faulty_bitstream(job['bits'], target_bs_filename)
+            return None, None, None
+        bman.dump_partial_bitstream(job['bits'], job['faulty_bitstream'])
+        bman.dump_partial_bitstream([], job['repair_bitstream'],
+                                    frame_l_addrs=[int(bit / (bman.N_WORDS_IN_FRAME * 32)) for bit in job['bits']])
+    elif not job['partial']:
+        shutil.move(job['faulty_bitstream'], target_bs_filename)
+        return None, None, None
+
+    return job['faulty_bitstream'], job['repair_bitstream'], restore_golden_bitstream(network_name)
+
+
+def job_runner():
+    global run_owner
+
+    while True:
+        with jobs_cond:
+            while not jobs_cond.wait_for(lambda: len(job_queue) != 0 and run_owner is None, timeout=1):
+                reap_legacy_run()
+            job = job_queue.popleft()
+            run_owner = job['job_id']
+
+        ts_start = time.time()
+        try:
+            launch_fi_run(job['network_name'], *prepare_job(job))
+            class_res = collect_fi_run(job['timeout'])
+        except Exception as exp:
+            # e.g. frame address unknown on the board
+            server_logger.error(f"Job {job['job_id']}: {exp}")
+            class_res = {
+                'error': f'{exp}'
+            }
+        for bs_filename in (job['faulty_bitstream'], job['repair_bitstream']):
+            if bs_filename is not None and os.path.isfile(bs_filename):
+                os.remove(bs_filename)
+
+        class_res = dict(class_res, job_id=job['job_id'], run_time=time.time() - ts_start)
+        server_logger.info(f"Job {job['job_id']}: {class_res}")
+        with jobs_cond:
+            job_results[job['job_id']] = class_res
+            while len(job_results) > JOB_RESULTS_SIZE:
+                job_results.popitem(last=False)
+            run_owner = None
+            jobs_cond.notify_all()
+
+
 @app.route('/is_running', methods=['GET', 'POST'])
 def is_running():
     global current_fi_run
@@ -111,50 +604,27 @@ def is_running():
 
 @app.route('/wait_run', methods=['POST', 'GET'])
 def wait_run():
-    global current_fi_run, fi_p_parent, fi_run_p_child, xlnk, server_logger
+    global current_fi_run, server_logger, legacy_run_collecting
 
     timeout = request.form.get('timeout')
     timeout = float(timeout) if timeout is not None else 5
     server_logger.info(f'wait_run: timeout {timeout} secs')
-    if current_fi_run is None:
+    with jobs_cond:
+        # the runs of the jobs are collected by job_runner
+        collect = current_fi_run is not None and run_owner == 'legacy'
+        legacy_run_collecting = collect
+    if not collect:
         server_logger.warning('wait_run: Not running')
+        release_run_slot()
         abort(204)   # NO Content
-    else:
-        try:
-            current_fi_run.join(timeout=timeout)
-            if current_fi_run.exitcode is None:
-                raise TimeoutError()
 
-            server_logger.info(f'wait_run: Run finished successfully')
-            current_fi_run = None
-            if fi_p_parent.poll(timeout=timeout):
-                class_res = fi_p_parent.recv()
-                server_logger.info(f'{class_res}')
-            else:
-                server_logger.error(f'pipe read timeout for {timeout} secs')
-                server_logger.info(f'recreating pipe for next run')
-                fi_p_parent, fi_run_p_child = Pipe()
-                class_res = {
-                    'index': -1,
-                    'duration': 0
-                }
-        except TimeoutError as toe:
-            server_logger.warning(f"wait_run: timeout")
-            if current_fi_run is not None:
-                while current_fi_run.is_alive():
-                    server_logger.info(f"terminating run")
-                    current_fi_run.terminate()
-                    time.sleep(1)
-                current_fi_run = None
-            server_logger.log('recreating the pipe for next run')
-            fi_p_parent, fi_run_p_child = Pipe()
-            class_res = {
-                'index': -1,
-                'duration': 0
-            }
-
-        xlnk.xlnk_reset()
-        return jsonify(class_res)
+    try:
+        class_res = collect_fi_run(timeout)
+    finally:
+        with jobs_cond:
+            legacy_run_collecting = False
+        release_run_slot()
+    return jsonify(class_res)
 
 
 @app.route('/reboot', methods=['POST', ])
@@ -175,12 +645,20 @@ def do_run():
 
     network_name = request.form.get('network_name')
     server_logger.info(f"New run: NO (NEW) FAULTY BIT")
-
-    current_fi_run = Process(target=workload, args=(fi_run_p_child,
-                                                    network_name,
-                                                    'road-signs',
-                                                    '/home/xilinx/PynqSEUInj/images/cross.jpg'))
-    current_fi_run.start()
+    if not acquire_run_slot():
+        return jsonify({
+            'error': 'running jobs'
+        }), 503
+
+    try:
+        current_fi_run = Process(target=workload, args=(fi_run_p_child,
+                                                        network_name,
+                                                        'road-signs',
+                                                        '/home/xilinx/PynqSEUInj/images/cross.jpg'))
+        current_fi_run.start()
+    except Exception:
+        release_run_slot()
+        raise
     server_logger.info(f"Run started")
 
     return jsonify({
@@ -207,7 +685,10 @@ def safe_reboot():
 
 wd_thread = Thread(target=safe_reboot)
 wd_thread.start()
+Thread(target=job_runner, daemon=True).start()
 
+# HTTP/1.1: the clients keep their connection open between requests (werkzeug < 2.1, later versions close them)
+WSGIRequestHandler.protocol_version = "HTTP/1.1"
 app.run(host='0.0.0.0', port=5200)
 
 wd_thread.join()
@@ -3,12 +3,16 @@
 import sys
 import os
 import time
-from threading import Thread, Lock, Event
+from threading import Thread, Event
 import requests
-from BitstreamMan import BitstreamMan, load_ll_file
-import sqlite3
+from BitstreamMan import BitstreamMan, BITSTREAM_CACHE_DIR
+from LogicLocationMan import LogicLocationMan
+from BitstreamGenMan import BitstreamGenMan
+from BitstreamUploadMan import BitstreamUploadMan
+from BNN_FaultDBMan import BNN_FaultDBMan, FAULT_LEASED
+from BNN_CampaignMan import BNN_CampaignMan
+from PipelineMan import StageQueue, QueueClosed, stats_report
 import shutil
-import random
 
 
 server_lst = ['http://pynq1:5200', 
@@ -20,213 +24,211 @@ server_lst = ['http://pynq1:5200',
 NETWORK_NAME = 'cnvW1A1'
 PLATFORM = 'pynqZ1-Z2'
 
-fault_list = []
-fault_list_lock = Lock()
-
-db_conn = sqlite3.connect('faults_inj_res.db', check_same_thread=False)
-db_conn.execute('''CREATE TABLE IF NOT EXISTS faults (
-bit_offset INT PRIMARY KEY, 
-executed VARCHAR(1), 
-frame_addr INT, 
-frame_b_offset INT,
-props TEXT,
-class_index INT,
-class_name TEXT,
-class_duration INT)''')
-db_conn.commit()
-db_conn_lock = Lock()
-
-
-def is_fault_executed(conn, conn_lock, bit_offset):
-    with conn_lock:
-        c = conn.cursor()
-        c.execute('SELECT * FROM faults where bit_offset=? and executed=?', (bit_offset, 'Y'))
-        r = c.fetchone()
-        conn.commit()
-        if r is None:
-            return False
-        else:
-            return True
-
-
-def update_fault_rec(conn, conn_lock,
-                     bit_offset,
-                     executed = 'Y',
-                     frame_addr = None,
-                     frame_b_offset = None,
-                     bit_props = None,
-                     class_index = None,
-                     class_name = None,
-                     class_duration = None):
-    with conn_lock:
-        c = conn.cursor()
-        c.execute('insert or ignore into faults (bit_offset, executed) values (?, ?)', (bit_offset, "N"))
-        conn.commit()
-        sql_update_command = 'update faults set '
-        temp_lst = []
-        params_lst = []
-        if executed is not None:
-            temp_lst.append('executed=?')
-            params_lst.append(executed)
-        if frame_addr is not None:
-            temp_lst.append('frame_addr=?')
-            params_lst.append(frame_addr)
-        if frame_b_offset is not None:
-            temp_lst.append('frame_b_offset=?')
-            params_lst.append(frame_b_offset)
-        if bit_props is not None:
-            temp_lst.append('props=?')
-            params_lst.append(bit_props)
-        if class_index is not None:
-            temp_lst.append('class_index=?')
-            params_lst.append(class_index)
-        if class_name is not None:
-            temp_lst.append('class_name=?')
-            params_lst.append(class_name)
-        if class_duration is not None:
-            temp_lst.append('class_duration=?')
-            params_lst.append(class_duration)
-
-        sql_update_command += ','.join(temp_lst)
-        sql_update_command += ' where bit_offset=?'
-        params_lst.append(bit_offset)
-
-        c.execute(sql_update_command, params_lst)
-        conn.commit()
-
-
-def client_thread(kill_switch: Event, flist_lock: Lock, server: str, conn, conn_lock):
-    global fault_list
-
-    while kill_switch.is_set():
-        with flist_lock:
-            if len(fault_list) != 0:
-                fault = fault_list.pop(0)
-            else:
-                fault = None
+# Debugging: write the faulty bitstreams to ./FAULTY_BITSTREAMS/ instead of uploading them from memory
+SPILL_FAULTY_BITSTREAMS = False
+
+# generate -> faults -> client_thread (upload, run) -> results -> collect_thread
+fault_queue = StageQueue('faults', 50)
+result_queue = StageQueue('results', 50)
+STATS_INTERVAL = 60
+
+# compressed uploads for the servers supporting it
+upload_man = BitstreamUploadMan()
+
+# faults of the older schema (faults table) are imported with:
+#   python3 BNN_FaultDBMan.py faults_inj_res.db faults_inj_res.db
+db_man = BNN_FaultDBMan('faults_inj_res.db')
+
+
+def is_fault_executed(bit_offset):
+    return db_man.is_fault_executed([bit_offset])
+
+
+def update_fault_rec(bit_offset,
+                     executed='Y',
+                     frame_addr=None,
+                     frame_b_offset=None,
+                     bit_props=None,
+                     class_index=None,
+                     class_name=None,
+                     class_duration=None):
+    """Written behind by db_man, None leaves the column unchanged"""
+    db_man.update_fault([bit_offset],
+                        status=executed,
+                        frame_addr=frame_addr,
+                        frame_b_offset=frame_b_offset,
+                        props=bit_props,
+                        class_index=class_index,
+                        class_name=class_name,
+                        class_duration=class_duration)
+
+
+def client_thread(kill_switch: Event, server: str):
+    """Takes faults from fault_queue until it is closed and drained or kill_switch is set"""
+    # keep-alive connection to the server
+    session = requests.Session()
+    while not kill_switch.is_set():
+        try:
+            fault = fault_queue.get()
+        except QueueClosed:
+            break
+
+        faulty_bitstream = fault['faulty_bitstream']
+        network_name = fault['network_name']
+        faulty_bit = fault['bit_offset']
+        # re-queued on restart if the coordinator dies before the result is in
+        db_man.update_fault([faulty_bit], status=FAULT_LEASED)
+
+        print(f'{server}: Launching fault injection with bitstream {faulty_bitstream} x {faulty_bit} ')
+
+        try:
+            files, data, upload_stats = upload_man.encode(server, {
+                'faulty_bitstream': faulty_bitstream
+            }, session)
+            data['network_name'] = network_name
+            ts_start = time.time()
+            r = session.post(server + '/fault_inj',
+                             files=files,
+                             data=data)
+            upload_report = upload_man.upload_report(upload_stats, time.time() - ts_start,
+                                                     upload_man.server_duration(r.status_code, r.content))
+            print(f'{server}: {upload_report}')
+
+            if r.status_code != 200:
+                print(f'{server}: Failed to launch fault injection on server {server}')
+                kill_switch.wait(10)
+                continue
 
-        if fault is None:
-            time.sleep(1)
-        else:
-            faulty_bitstream = fault['faulty_bitstream']
-            network_name = fault['network_name']
-            faulty_bit = fault['bit_offset']
-
-            print(f'{server}: Launching fault injection with bitstream {faulty_bitstream} x {faulty_bit} ')
-
-            try:
-                r = requests.post(server + '/fault_inj',
-                                  files={
-                                    'faulty_bitstream': open(faulty_bitstream, 'rb')
-                                  },
-                                  data={
-                                      'network_name': network_name,
-                                  })
-
-                if r.status_code != 200:
-                    print(f'{server}: Failed to launch fault injection on server {server}')
-                    time.sleep(10)
-                    continue
-
-                r = requests.post(server + '/wait_run',
-                                  data={
-                                      'timeout': 10
-                                  })
-
-                if r.status_code != 200:
-                    print(f'{server}: Failed to retrieve fault injection results')
-                    time.sleep(10)
-                    continue
-            except Exception as exp:
-                print(f'***********[ERROR]{server} Failed {exp}')
-                time.sleep(30)
+            r = session.post(server + '/wait_run',
+                             data={
+                                 'timeout': 10
+                             })
+
+            if r.status_code != 200:
+                print(f'{server}: Failed to retrieve fault injection results')
+                kill_switch.wait(10)
                 continue
+        except Exception as exp:
+            print(f'***********[ERROR]{server} Failed {exp}')
+            kill_switch.wait(30)
+            continue
+
+        fi_result = r.json()
+        class_index = fi_result['index']
+        class_name = fi_result['name']
+        class_duration = fi_result['duration']
+
+        print(f'{server}: FI = {class_index}, {class_name}, {class_duration}')
+
+        result_queue.put({
+            'faulty_bitstream': faulty_bitstream,
+            'bit_offset': faulty_bit,
+            'class_index': class_index,
+            'class_name': class_name,
+            'class_duration': class_duration
+        })
+
+
+def collect_thread():
+    """Records the results of result_queue until it is closed and drained"""
+    while True:
+        try:
+            result = result_queue.get()
+        except QueueClosed:
+            break
 
-            fi_result = r.json()
-            class_index = fi_result['index']
-            class_name = fi_result['name']
-            class_duration = fi_result['duration']
+        update_fault_rec(bit_offset=result['bit_offset'],
+                         executed='Y',
+                         class_index=result['class_index'],
+                         class_name=result['class_name'],
+                         class_duration=result['class_duration'])
 
-            print(f'{server}: FI = {class_index}, {class_name}, {class_duration}')
+        # Clean up
+        if isinstance(result['faulty_bitstream'], str):
+            os.remove(result['faulty_bitstream'])
 
-            update_fault_rec(conn, conn_lock, bit_offset=faulty_bit,
-                             executed='Y',
-                             class_index=class_index,
-                             class_name=class_name,
-                             class_duration=class_duration)
 
-            # Clean up
-            os.remove(faulty_bitstream)
+def stats_thread(stop: Event):
+    while not stop.wait(STATS_INTERVAL):
+        print(stats_report([fault_queue, result_queue]))
 
 
-def genrate_faults(flist_lock: Lock,
-                   original_bs_file: str,
+def genrate_faults(original_bs_file: str,
                    original_ll_file: str):
-    global fault_list, NETWORK_NAME, PLATFORM
-    global db_conn, db_conn_lock
+    global NETWORK_NAME, PLATFORM
 
-    bman = BitstreamMan(original_bs_file)
+    bman = BitstreamMan(original_bs_file, use_mmap=True, cache_dir=BITSTREAM_CACHE_DIR)
 
     # Load LL file
     print(f"Loading Logic Location file {original_ll_file} ...")
-    ll_list = load_ll_file(original_ll_file)
-    total_faults = len(ll_list)
+    llman = LogicLocationMan(original_ll_file, cache_dir=BITSTREAM_CACHE_DIR)
+    total_faults = len(llman)
     print(f"Done ... total faults {total_faults}")
 
-    ll_bitoffset = [bit_dict['bit_offset'] for bit_dict in ll_list]
-
-    index = 1
     total_faults = 10000
-    while index < total_faults:
-        bit_offset = random.randint(0, bman.N_WORDS_IN_FRAME * bman.n_frames * 32)
-        if bit_offset in ll_bitoffset or is_fault_executed(db_conn, db_conn_lock, bit_offset):
-            continue
+    # sampler state and progress survive a crash, see BNN_CampaignMan
+    campaign = BNN_CampaignMan(db_man, f'./campaign-{NETWORK_NAME}-{PLATFORM}.json', total_faults)
+    BNN_CampaignMan.cleanup_orphans('./FAULTY_BITSTREAMS/', f'{NETWORK_NAME}-{PLATFORM}-F')
+
+    def schedule_faults():
+        # faults planned by a previous run first
+        for bits in campaign.pending_faults():
+            print(f"Re-scheduling F @{bits[0]}")
+            yield bits
+
+        while not campaign.is_done():
+            bit_offset = campaign.random.randint(0, bman.N_WORDS_IN_FRAME * bman.n_frames * 32)
+            if bit_offset in llman or is_fault_executed(bit_offset):
+                continue
+            else:
+                frame_addr = int(bit_offset / (bman.N_WORDS_IN_FRAME*32))
+                frame_b_offset = bit_offset % (bman.N_WORDS_IN_FRAME*32)
+                bit_props = 'RANDOM'
+                if campaign.plan([bit_offset],
+                                 frame_addr=frame_addr,
+                                 frame_b_offset=frame_b_offset,
+                                 props=bit_props):
+                    print(f"Scheduling F {campaign.n_planned}/{total_faults} @{bit_offset}")
+                    yield [bit_offset]
+
+    def faulty_bitstreams():
+        if SPILL_FAULTY_BITSTREAMS:
+            with BitstreamGenMan(bman) as gen_man:
+                try:
+                    yield from gen_man.generate(
+                        schedule_faults(),
+                        out_fname_fn=lambda bits: f'./FAULTY_BITSTREAMS/{NETWORK_NAME}-{PLATFORM}-F{bits[0]}.bit')
+                finally:
+                    print(gen_man.report())
         else:
-            print(f"Scheduling F {index}/{total_faults} @{bit_offset}")
-            frame_addr = hex(int(bit_offset / (bman.N_WORDS_IN_FRAME*32)))
-            frame_b_offset = bit_offset % (bman.N_WORDS_IN_FRAME*32)
-            bit_props = 'RANDOM'
-            update_fault_rec(db_conn, db_conn_lock, bit_offset=bit_offset,
-                             executed='N',
-                             frame_addr=frame_addr,
-                             frame_b_offset=frame_b_offset,
-                             bit_props=bit_props)
-
-            bit_value = bman.get_bit(bit_offset)
-            bit_value_f = 0 if bit_value == 1 else 1
-            bman.set_bit(bit_offset, bit_value_f)
-            faulty_bitstream_file = f'./FAULTY_BITSTREAMS/{NETWORK_NAME}-{PLATFORM}-F{bit_offset}.bit'
-            bman.dump_bitstream(faulty_bitstream_file)
-            bman.set_bit(bit_offset, bit_value)
-
-            while True:
-                with flist_lock:
-                    if len(fault_list) >= 50:
-                        pass
-                    else:
-                        fault_list.append({
-                            'faulty_bitstream': faulty_bitstream_file,
-                            'network_name': NETWORK_NAME,
-                            'bit_offset': bit_offset
-                        })
-                        index += 1
-                        break
-
-                time.sleep(1)
+            for bits in schedule_faults():
+                yield bits, bman.faulty_variant(bits)
+
+    try:
+        for bits, faulty_bitstream in faulty_bitstreams():
+            # blocks while the clients are 50 faults behind
+            fault_queue.put({
+                'faulty_bitstream': faulty_bitstream,
+                'network_name': NETWORK_NAME,
+                'bit_offset': bits[0]
+            })
+    except QueueClosed:
+        # aborted, the faults not run yet are left pending in the DB
+        pass
 
     # for bit_dict in ll_list:
     #     bit_offset = bit_dict['bit_offset']
     #     frame_addr = bit_dict['frame_addr']
     #     frame_b_offset = bit_dict['frame_b_offset']
     #     bit_props = bit_dict['props']
-    #     if is_fault_executed(db_conn, db_conn_lock, bit_offset):
+    #     if is_fault_executed(bit_offset):
     #         print(f"F {index}/{total_faults} @{bit_offset} has already been executed")
     #         index += 1
     #         continue
     #     else:
     #         print(f"Scheduling F {index}/{total_faults} @{bit_offset}")
     #         index += 1
-    #         update_fault_rec(db_conn, db_conn_lock, bit_offset=bit_offset,
+    #         update_fault_rec(bit_offset=bit_offset,
     #                          executed='N',
     #                          frame_addr=frame_addr,
     #                          frame_b_offset=frame_b_offset,
@@ -253,14 +255,7 @@ def genrate_faults(flist_lock: Lock,
     #
     #             time.sleep(1)
 
-    while True:
-        with flist_lock:
-            if len(fault_list) != 0:
-                pass
-            else:
-                break
-
-        time.sleep(1)
+    campaign.close()
 
 
 thread_kill_switchs = []
@@ -268,20 +263,32 @@ threads = []
 
 for s in server_lst:
     kill_s = Event()
-    kill_s.set()
-    t = Thread(target=client_thread, args=(kill_s, fault_list_lock, s, db_conn, db_conn_lock))
+    t = Thread(target=client_thread, args=(kill_s, s))
     t.start()
     thread_kill_switchs.append(kill_s)
     threads.append(t)
 
-genrate_faults(fault_list_lock, original_bs_file=f"./bitstreams/{NETWORK_NAME}-{PLATFORM}.bit",
-               original_ll_file=f"./bitstreams/{NETWORK_NAME}-{PLATFORM}.ll")
-
-
-for kill_s in thread_kill_switchs:
-    kill_s.clear()
-
-for t in threads:
-    t.join()
-
-db_conn.close()
+collector = Thread(target=collect_thread)
+collector.start()
+stats_stop = Event()
+Thread(target=stats_thread, args=(stats_stop, ), daemon=True).start()
+
+try:
+    genrate_faults(original_bs_file=f"./bitstreams/{NETWORK_NAME}-{PLATFORM}.bit",
+                   original_ll_file=f"./bitstreams/{NETWORK_NAME}-{PLATFORM}.ll")
+except KeyboardInterrupt:
+    print('Stopping, the faults not run yet are left pending in the DB')
+    for kill_s in thread_kill_switchs:
+        kill_s.set()
+    fault_queue.abort()
+finally:
+    # the clients run what is left in the queue, then stop
+    fault_queue.close()
+    for t in threads:
+        t.join()
+    result_queue.close()
+    collector.join()
+    stats_stop.set()
+    print(stats_report([fault_queue, result_queue]))
+
+    db_man.close()
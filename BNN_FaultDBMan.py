@@ -1,14 +1,120 @@
 #!/usr/bin/env python3
 
 import sqlite3
-from threading import Lock
+from threading import Lock, Condition, Event, Thread
+from collections import deque
 import logging
-from BitstreamMan import BitstreamMan
-from BitstreamMan import load_ll_file
+from BitstreamMan import BitstreamMan, bitstream_payload
+from BitstreamMan import file_sha256, BITSTREAM_CACHE_DIR
+from LogicLocationMan import LogicLocationMan
+from BitstreamGenMan import BitstreamGenMan
+from BitstreamUploadMan import BitstreamUploadMan
+from DBWriterMan import DBWriterMan
 import requests
 import os
 import time
 import random
+import sys
+import struct
+from os.path import isfile
+import numpy as np
+
+
+# status of the faults in fault_results
+FAULT_PENDING = 0
+FAULT_EXECUTED = 1
+# dispatched to a board, result not recorded yet
+FAULT_LEASED = 2
+# status letters of the older databases ('E' in faults(bits), 'Y'/'N' in the executed column of the FI scripts)
+FAULT_STATUS_LEGACY = {
+    'N': FAULT_PENDING,
+    'E': FAULT_EXECUTED,
+    'Y': FAULT_EXECUTED
+}
+
+
+def pack_fault_bits(bits):
+    """
+    Canonical encoding of the bits of a fault: sorted, unique bit offsets as little-endian uint32
+    :param bits: list of bit offsets, or '-' separated bit offsets
+    :return: bytes
+    """
+    if isinstance(bits, str):
+        bits = bits.split('-')
+    bits = sorted(set(int(x) for x in bits))
+    return struct.pack(f'<{len(bits)}I', *bits)
+
+
+def unpack_fault_bits(packed_bits: bytes):
+    """:return: list of bit offsets, see pack_fault_bits"""
+    return np.frombuffer(packed_bits, dtype='<u4').tolist()
+
+
+class GoldenMismatchError(ValueError):
+    """The golden bitstream of the board is not the one the faults refer to (409), the board cannot run them"""
+    pass
+
+
+class NoBoardLeftError(ValueError):
+    """All the boards of the cluster have been retired for golden mismatch, no fault can run anymore"""
+    pass
+
+
+class FaultSet:
+    """
+    Set of faults, by canonical encoding (pack_fault_bits):
+    a packed bitmap of the single-bit faults, growing with the largest bit offset, and a hash set of the others
+    """
+
+    def __init__(self, n_bits: int = 0):
+        self.bitmap = np.zeros((n_bits + 7) // 8, dtype=np.uint8)
+        self.multi_bits = set()
+
+    def add(self, packed_bits: bytes):
+        if len(packed_bits) != 4:
+            self.multi_bits.add(packed_bits)
+            return
+        bit = int.from_bytes(packed_bits, 'little')
+        if (bit >> 3) >= len(self.bitmap):
+            bitmap = np.zeros(max(2 * len(self.bitmap), (bit >> 3) + 1), dtype=np.uint8)
+            bitmap[:len(self.bitmap)] = self.bitmap
+            self.bitmap = bitmap
+        self.bitmap[bit >> 3] |= 1 << (bit & 7)
+
+    def discard(self, packed_bits: bytes):
+        if len(packed_bits) != 4:
+            self.multi_bits.discard(packed_bits)
+            return
+        bit = int.from_bytes(packed_bits, 'little')
+        if (bit >> 3) < len(self.bitmap):
+            self.bitmap[bit >> 3] &= ~np.uint8(1 << (bit & 7))
+
+    def __contains__(self, packed_bits: bytes):
+        if len(packed_bits) != 4:
+            return packed_bits in self.multi_bits
+        bit = int.from_bytes(packed_bits, 'little')
+        bitmap = self.bitmap
+        return (bit >> 3) < len(bitmap) and bool((bitmap[bit >> 3] >> (bit & 7)) & 1)
+
+    def __len__(self):
+        return int(np.unpackbits(self.bitmap).sum()) + len(self.multi_bits)
+
+    def to_arrays(self, prefix: str):
+        multi_bits = sorted(self.multi_bits)
+        return {
+            f'{prefix}_bitmap': self.bitmap,
+            f'{prefix}_multi_bits': np.frombuffer(b''.join(multi_bits), dtype=np.uint8),
+            f'{prefix}_multi_bits_len': np.array([len(x) for x in multi_bits], dtype=np.int64)
+        }
+
+    @staticmethod
+    def from_arrays(arrays, prefix: str):
+        fault_set = FaultSet()
+        fault_set.bitmap = np.array(arrays[f'{prefix}_bitmap'], dtype=np.uint8)
+        multi_bits = arrays[f'{prefix}_multi_bits'].tobytes()
+        ends = np.cumsum(arrays[f'{prefix}_multi_bits_len']).tolist()
+        fault_set.multi_bits = set(multi_bits[start:end] for start, end in zip([0] + ends[:-1], ends))
+        return fault_set
 
 
 class BNN_FaultDBMan:
@@ -17,100 +123,275 @@ class BNN_FaultDBMan:
     """
 
     def __init__(self, db_filename):
+        self.db_filename = db_filename
         self.db_conn = sqlite3.connect(db_filename, check_same_thread=False)
         self.db_cursor = self.db_conn.cursor()
-        self.db_cursor.execute('''CREATE TABLE IF NOT EXISTS faults (
-            bits TEXT PRIMARY KEY, 
-            status VARCHAR(1), 
-            frame_addr INT, 
+        # bits: pack_fault_bits, frame_addr: linear frame index of the first bit, status: FAULT_PENDING, ...
+        self.db_cursor.execute('''CREATE TABLE IF NOT EXISTS fault_results (
+            fault_id INTEGER PRIMARY KEY,
+            bits BLOB NOT NULL UNIQUE,
+            n_bits INT,
+            status INT NOT NULL DEFAULT 0,
+            frame_addr INT,
             frame_b_offset INT,
-            props TEXT,
+            props_id INT,
             class_index INT,
-            class_duration INT)''')
+            class_name TEXT,
+            class_duration REAL)''')
+        self.db_cursor.execute('CREATE INDEX IF NOT EXISTS fault_results_status ON fault_results (status)')
+        self.db_cursor.execute('CREATE INDEX IF NOT EXISTS fault_results_frame ON fault_results (frame_addr)')
+        # props strings are shared by most faults ('RANDOM', ...)
+        self.db_cursor.execute('''CREATE TABLE IF NOT EXISTS fault_props (
+            props_id INTEGER PRIMARY KEY,
+            props TEXT NOT NULL UNIQUE)''')
+        # Upsets found in readbacks (frame_addr is the FAR as in the .ll files, NULL if unknown)
+        self.db_cursor.execute('''CREATE TABLE IF NOT EXISTS readbacks (
+            rb_file TEXT PRIMARY KEY,
+            n_upsets INT,
+            ts REAL)''')
+        self.db_cursor.execute('''CREATE TABLE IF NOT EXISTS readback_upsets (
+            rb_file TEXT,
+            bit_offset INT,
+            frame_addr INT,
+            frame_b_offset INT,
+            PRIMARY KEY (rb_file, bit_offset))''')
         self.db_conn.commit()
         self.db_conn_lock = Lock()
-
-    def is_fault_executed(self, bits: str):
+        self.props_ids = dict(self.db_cursor.execute('SELECT props, props_id FROM fault_props').fetchall())
+        # fault updates are written behind, in batches, see DBWriterMan
+        self.fault_writer = DBWriterMan(db_filename, 'fault_results', 'bits',
+                                        ('n_bits', 'status', 'frame_addr', 'frame_b_offset', 'props_id',
+                                         'class_index', 'class_name', 'class_duration'),
+                                        insert_defaults={'status': str(FAULT_PENDING)})
+        # all the faults of fault_results, and the executed ones, kept in step with update_fault()
+        self.fault_sets_lock = Lock()
+        self.load_fault_sets()
+
+    def fault_sets_snapshot_filename(self):
+        return self.db_filename + '.faultsets.npz'
+
+    def fault_sets_db_state(self):
+        """:return: max fault_id, number of faults and of executed faults in fault_results"""
         with self.db_conn_lock:
-            self.db_cursor.execute('SELECT * FROM faults where bits=? and status=?', (bits, 'E'))
-            r = self.db_cursor.fetchone()
-            self.db_conn.commit()
-            if r is None:
-                return False
-            else:
-                return True
+            max_fault_id, n_faults = self.db_conn.execute('SELECT MAX(fault_id), COUNT(*) '
+                                                          'FROM fault_results').fetchone()
+            n_executed = self.db_conn.execute('SELECT COUNT(*) FROM fault_results WHERE status=?',
+                                              (FAULT_EXECUTED,)).fetchone()[0]
+        return [max_fault_id if max_fault_id is not None else 0, n_faults, n_executed]
+
+    def load_fault_sets(self):
+        """
+        scheduled_faults and executed_faults from the snapshot if it matches the database, from the database otherwise
+        """
+        db_state = self.fault_sets_db_state()
+        snapshot_filename = self.fault_sets_snapshot_filename()
+        if isfile(snapshot_filename):
+            with np.load(snapshot_filename) as arrays:
+                if arrays['db_state'].tolist() == db_state:
+                    self.scheduled_faults = FaultSet.from_arrays(arrays, 'scheduled')
+                    self.executed_faults = FaultSet.from_arrays(arrays, 'executed')
+                    return
+
+        self.scheduled_faults = FaultSet()
+        self.executed_faults = FaultSet()
+        with self.db_conn_lock:
+            for packed_bits, status in self.db_conn.execute('SELECT bits, status FROM fault_results'):
+                self.scheduled_faults.add(packed_bits)
+                if status == FAULT_EXECUTED:
+                    self.executed_faults.add(packed_bits)
+
+    def save_fault_sets(self):
+        """Snapshot of scheduled_faults and executed_faults, with the database state it matches"""
+        with self.fault_sets_lock:
+            self.fault_writer.flush()
+            arrays = {'db_state': np.array(self.fault_sets_db_state(), dtype=np.int64)}
+            arrays.update(self.scheduled_faults.to_arrays('scheduled'))
+            arrays.update(self.executed_faults.to_arrays('executed'))
+        # written aside and renamed, a crash never leaves a partial snapshot
+        snapshot_filename = self.fault_sets_snapshot_filename()
+        with open(snapshot_filename + '.tmp', 'wb') as f_snapshot:
+            np.savez(f_snapshot, **arrays)
+        os.replace(snapshot_filename + '.tmp', snapshot_filename)
+
+    def get_props_id(self, props: str):
+        with self.db_conn_lock:
+            props_id = self.props_ids.get(props)
+            if props_id is None:
+                with self.db_conn:
+                    self.db_cursor.execute('INSERT OR IGNORE INTO fault_props (props) VALUES (?)', (props,))
+                    self.db_cursor.execute('SELECT props_id FROM fault_props WHERE props=?', (props,))
+                    props_id = self.db_cursor.fetchone()[0]
+                self.props_ids[props] = props_id
+            return props_id
+
+    def is_fault_executed(self, bits):
+        """:param bits: list of bit offsets, or '-' separated bit offsets"""
+        return pack_fault_bits(bits) in self.executed_faults
+
+    def is_fault_scheduled(self, bits):
+        """:return: True if the fault is in the database, executed or not"""
+        return pack_fault_bits(bits) in self.scheduled_faults
 
     def update_fault(self, bits, status=None, frame_addr=None, frame_b_offset=None,
-                     props=None, class_index=None, class_duration=None):
+                     props=None, class_index=None, class_duration=None, class_name=None):
+        """
+        Written behind, see DBWriterMan. None leaves the column unchanged
+        :param bits: list of bit offsets, or '-' separated bit offsets
+        :param status: FAULT_PENDING, FAULT_EXECUTED, FAULT_LEASED, or a letter of FAULT_STATUS_LEGACY
+        :param frame_addr: linear frame index (int, or hex string)
+        """
+        packed_bits = pack_fault_bits(bits)
+        status = FAULT_STATUS_LEGACY.get(status, status)
+        props_id = self.get_props_id(props) if props is not None else None
+        with self.fault_sets_lock:
+            self.scheduled_faults.add(packed_bits)
+            if status == FAULT_EXECUTED:
+                self.executed_faults.add(packed_bits)
+            elif status is not None:
+                self.executed_faults.discard(packed_bits)
+            self.fault_writer.put(packed_bits,
+                                  n_bits=len(packed_bits) // 4,
+                                  status=status,
+                                  frame_addr=int(frame_addr, 16) if isinstance(frame_addr, str) else frame_addr,
+                                  frame_b_offset=frame_b_offset,
+                                  props_id=props_id,
+                                  class_index=class_index,
+                                  class_name=class_name,
+                                  class_duration=class_duration)
+
+    def select_faults(self, where: str = '', params: tuple = ()):
+        """:return: list of dict, the faults (bits as list of bit offsets, props as string)"""
+        self.fault_writer.flush()
         with self.db_conn_lock:
-            self.db_cursor.execute('insert or ignore into faults (bits) values (?)', (bits,))
-            self.db_conn.commit()
-            sql_update_command = 'update faults set '
-            temp_lst = []
-            params_lst = []
-            if status is not None:
-                temp_lst.append('status=?')
-                params_lst.append(status)
-            if frame_addr is not None:
-                temp_lst.append('frame_addr=?')
-                params_lst.append(frame_addr)
-            if frame_b_offset is not None:
-                temp_lst.append('frame_b_offset=?')
-                params_lst.append(frame_b_offset)
-            if props is not None:
-                temp_lst.append('props=?')
-                params_lst.append(props)
-            if class_index is not None:
-                temp_lst.append('class_index=?')
-                params_lst.append(class_index)
-            if class_duration is not None:
-                temp_lst.append('class_duration=?')
-                params_lst.append(class_duration)
-
-            sql_update_command += ','.join(temp_lst)
-            sql_update_command += ' where bits=?'
-            params_lst.append(bits)
-
-            self.db_cursor.execute(sql_update_command, params_lst)
-            self.db_conn.commit()
+            self.db_cursor.execute('SELECT fault_id, bits, status, frame_addr, frame_b_offset, props, '
+                                   'class_index, class_name, class_duration '
+                                   'FROM fault_results LEFT JOIN fault_props USING (props_id) ' + where, params)
+            rows = self.db_cursor.fetchall()
+        columns = ('fault_id', 'bits', 'status', 'frame_addr', 'frame_b_offset', 'props',
+                   'class_index', 'class_name', 'class_duration')
+        faults = [dict(zip(columns, row)) for row in rows]
+        for fault in faults:
+            fault['bits'] = unpack_fault_bits(fault['bits'])
+        return faults
 
     def get_fault(self, bits):
-        with self.db_conn_lock:
-            self.db_cursor.execute('select * from faults where bits=?', (bits,))
-            r = self.db_cursor.fetchall()
-            return r
+        return self.select_faults('WHERE bits=?', (pack_fault_bits(bits),))
 
     def get_all_faults(self):
+        return self.select_faults()
+
+    def get_pending_faults(self):
+        return self.select_faults('WHERE status=?', (FAULT_PENDING,))
+
+    def get_unexecuted_fault_bits(self):
+        """:return: list of the bits (list of bit offsets) of the pending and leased faults, in fault_id order"""
+        self.fault_writer.flush()
+        with self.db_conn_lock:
+            rows = self.db_conn.execute('SELECT bits FROM fault_results WHERE status IN (?, ?) ORDER BY fault_id',
+                                        (FAULT_PENDING, FAULT_LEASED)).fetchall()
+        return [list(struct.unpack(f'<{len(row[0]) // 4}I', row[0])) for row in rows]
+
+    def get_faults_by_frame(self, frame_addr: int):
+        return self.select_faults('WHERE frame_addr=?', (frame_addr,))
+
+    def import_legacy_db(self, legacy_db_filename: str):
+        """
+        Import the faults of an older database:
+            faults (bits TEXT, status 'E') of the previous BNN_FaultDBMan,
+            faults (bit_offset INT, executed 'Y'/'N') of BNN_FI_TestMan/BNN_FI_Man,
+            semu_faults (bits TEXT, executed 'Y'/'N') of BNN_FI_SEMUTestMan
+        frame_addr stored as hex strings are converted to int.
+        :return: number of faults imported
+        """
+        legacy_conn = sqlite3.connect(legacy_db_filename)
+        tables = [x[0] for x in legacy_conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        n_faults = 0
+        for table in ('faults', 'semu_faults'):
+            if table not in tables:
+                continue
+            columns = [x[1] for x in legacy_conn.execute(f'PRAGMA table_info({table})')]
+            key = 'bits' if 'bits' in columns else 'bit_offset'
+            status = 'status' if 'status' in columns else 'executed'
+            class_name = 'class_name' if 'class_name' in columns else 'NULL'
+            for bits, fault_status, frame_addr, frame_b_offset, props, class_index, class_name_v, class_duration \
+                    in legacy_conn.execute(f'SELECT {key}, {status}, frame_addr, frame_b_offset, props, '
+                                           f'class_index, {class_name}, class_duration FROM {table}'):
+                self.update_fault(str(bits),
+                                  status=FAULT_STATUS_LEGACY.get(fault_status, FAULT_PENDING),
+                                  frame_addr=frame_addr,
+                                  frame_b_offset=frame_b_offset,
+                                  props=props,
+                                  class_index=class_index,
+                                  class_name=class_name_v,
+                                  class_duration=class_duration)
+                n_faults += 1
+        legacy_conn.close()
+        self.fault_writer.flush()
+        return n_faults
+
+    def close(self):
+        """Write the pending fault updates, snapshot the fault sets and close the database"""
+        self.save_fault_sets()
+        self.fault_writer.close()
         with self.db_conn_lock:
-            self.db_cursor.execute('select * from faults')
-            r = self.db_cursor.fetchall()
-            return r
+            self.db_conn.close()
+
+    def get_processed_readbacks(self):
+        with self.db_conn_lock:
+            self.db_cursor.execute('select rb_file from readbacks')
+            return set(x[0] for x in self.db_cursor.fetchall())
+
+    def add_readback_upsets(self, rb_file, bit_offsets, frame_addrs, frame_b_offsets):
+        """Record the upsets of one readback, and the readback as processed, in a single transaction"""
+        with self.db_conn_lock:
+            with self.db_conn:
+                self.db_cursor.execute('delete from readback_upsets where rb_file=?', (rb_file,))
+                self.db_cursor.executemany('insert into readback_upsets '
+                                           '(rb_file, bit_offset, frame_addr, frame_b_offset) values (?, ?, ?, ?)',
+                                           zip([rb_file] * len(bit_offsets),
+                                               [int(x) for x in bit_offsets],
+                                               [int(x) if x is not None else None for x in frame_addrs],
+                                               [int(x) for x in frame_b_offsets]))
+                self.db_cursor.execute('insert or replace into readbacks (rb_file, n_upsets, ts) values (?, ?, ?)',
+                                       (rb_file, len(bit_offsets), time.time()))
+
+    def get_readback_upsets(self, rb_file):
+        with self.db_conn_lock:
+            self.db_cursor.execute('select bit_offset, frame_addr, frame_b_offset from readback_upsets '
+                                   'where rb_file=? order by bit_offset', (rb_file,))
+            return self.db_cursor.fetchall()
 
 
 class BNN_ServerMan:
-    def __init__(self, server_url: str, port: int = 5200):
+    def __init__(self, server_url: str, port: int = 5200, upload_man: BitstreamUploadMan = None):
+        """:param port: None if server_url has the port already"""
         self.server_url = server_url
         self.port = port
-        self.server_request_url = f"{self.server_url}:{self.port}"
+        self.server_request_url = self.server_url if self.port is None else f"{self.server_url}:{self.port}"
+        self.upload_man = BitstreamUploadMan() if upload_man is None else upload_man
+        # keep-alive connection to the board, reused by all the requests
+        self.session = requests.Session()
+        self.logger = logging.getLogger('ServerMan')
         self.status = "unknown"
         self.get_status()
 
     def get_status(self):
         try:
-            r = requests.post(f"{self.server_request_url}/is_running", timeout=3)
+            r = self.session.post(f"{self.server_request_url}/is_running", timeout=3)
             if r.status_code != 200:
                 self.status = "dead"
             else:
                 r_json = r.json()
-                self.status = "idle" if r_json["running"] == "false" else "busy"
-        except requests.Timeout as toe:
+                # a JSON boolean, "true"/"false" from older servers
+                self.status = "busy" if r_json["running"] in (True, "true") else "idle"
+        except requests.RequestException as exp:
             self.status = "dead"
 
         return self.status
 
     def reboot(self):
         try:
-            r = requests.post(f"{self.server_request_url}/reboot", timeout=3)
+            r = self.session.post(f"{self.server_request_url}/reboot", timeout=3)
             if r.status_code == 200:
                 self.status = "rebooting"
             else:
@@ -118,53 +399,366 @@ class BNN_ServerMan:
         except requests.Timeout as toe:
             self.status = "dead"
 
-    def launch_fault_inj(self, network_name, faulty_bitstream):
+    def launch_fault_inj(self, network_name, faulty_bitstream, repair_bitstream=None):
+        """
+        :param faulty_bitstream: full faulty bitstream, or partial one if repair_bitstream is given.
+                                 FaultyBitstream/bytes are uploaded from memory, a file name is read and removed
+        :param repair_bitstream: partial bitstream with the golden frames, loaded back after the run
+        """
         if self.get_status() != "idle":
             return None
 
         try:
             self.status = "busy"
-            r = requests.post(f"{self.server_request_url}/fault_inj",
-                              files={
-                                  'faulty_bitstream': open(faulty_bitstream, 'rb')
-                              },
-                              data={
-                                  'network_name': network_name
-                              }, timeout=5)
+            bitstreams = {
+                'faulty_bitstream': faulty_bitstream
+            }
+            if repair_bitstream is not None:
+                bitstreams['repair_bitstream'] = repair_bitstream
+            files, data, upload_stats = self.upload_man.encode(self.server_request_url, bitstreams, self.session)
+            data['network_name'] = network_name
+            if repair_bitstream is not None:
+                data['partial'] = '1'
+            ts_start = time.time()
+            r = self.session.post(f"{self.server_request_url}/fault_inj",
+                                  files=files,
+                                  data=data, timeout=5)
+            upload_report = self.upload_man.upload_report(upload_stats, time.time() - ts_start,
+                                                          self.upload_man.server_duration(r.status_code, r.content))
+            self.logger.info(f'{self.server_request_url}: {upload_report}')
             if r.status_code != 200:
                 self.status = "dead"
                 return None
 
-            r = requests.post(f"{self.server_request_url}/wait_run", data={"timeout": 10},
-                              timeout=10)
-            if r.status_code == 204: # No content
-                self.status = self.get_status()
-                return None
-            elif r.status_code == 200:
+            fi_result = self.wait_run()
+            if fi_result is not None:
+                for bitstream in (faulty_bitstream, repair_bitstream):
+                    if isinstance(bitstream, str):
+                        os.remove(bitstream)
+            return fi_result
+        except requests.Timeout as toe:
+            self.status = "dead"
+            return None
+
+    def launch_fault_inj_bits(self, network_name, golden_sha256, bits, partial=False):
+        """
+        Fault injection with the faulty bitstream generated by the board from its golden bitstream
+        :param golden_sha256: sha256 of the golden bitstream the bits refer to
+        :param bits: bit offsets to flip
+        :param partial: partial reconfiguration run (the board must know the frame addresses)
+        """
+        if self.get_status() != "idle":
+            return None
+
+        try:
+            self.status = "busy"
+            data = {
+                'network_name': network_name,
+                'golden_sha256': golden_sha256,
+                'bits': '-'.join([str(x) for x in bits])
+            }
+            if partial:
+                data['partial'] = '1'
+            r = self.session.post(f"{self.server_request_url}/fault_inj_bits",
+                                  data=data, timeout=5)
+            if r.status_code == 409:
                 self.status = self.get_status()
-                r_json = r.json()
-                class_index = r_json['index']
-                class_duration = r_json['duration']
-                os.remove(faulty_bitstream)
-                return class_index, class_duration
-            else:
+                raise GoldenMismatchError(f"{self.server_url}: golden bitstream {r.json()['golden_sha256']} "
+                                 f"does not match {golden_sha256}")
+            elif r.status_code != 200:
                 self.status = "dead"
                 return None
+
+            return self.wait_run()
         except requests.Timeout as toe:
             self.status = "dead"
             return None
 
+    def submit_job(self, network_name, faulty_bitstream=None, repair_bitstream=None,
+                   golden_sha256=None, bits=None, partial=False, timeout=None):
+        """
+        Queue a run on the board (/jobs), started by the board as soon as the previous one is finished
+        :param faulty_bitstream: as launch_fault_inj, or None with
+        :param golden_sha256, bits: as launch_fault_inj_bits, the faulty bitstream generated by the board
+        :param timeout: time limit of the run
+        :return: job id, None if the queue of the board is full or the request failed
+        :raise GoldenMismatchError: if the board has another golden bitstream
+        """
+        data = {
+            'network_name': network_name
+        }
+        files = None
+        if bits is not None:
+            data['golden_sha256'] = golden_sha256
+            data['bits'] = '-'.join([str(x) for x in bits])
+        else:
+            bitstreams = {
+                'faulty_bitstream': faulty_bitstream
+            }
+            if repair_bitstream is not None:
+                bitstreams['repair_bitstream'] = repair_bitstream
+            files, encoding_data, upload_stats = self.upload_man.encode(self.server_request_url, bitstreams,
+                                                                        self.session)
+            data.update(encoding_data)
+        if partial:
+            data['partial'] = '1'
+        if timeout is not None:
+            data['timeout'] = timeout
+
+        try:
+            r = self.session.post(f"{self.server_request_url}/jobs", files=files, data=data, timeout=30)
+        except requests.RequestException as exp:
+            self.status = "dead"
+            return None
+        if r.status_code == 409:
+            raise GoldenMismatchError(f"{self.server_url}: golden bitstream {r.json()['golden_sha256']} "
+                             f"does not match {golden_sha256}")
+        elif r.status_code != 202:
+            return None
+
+        # on the board now
+        for bitstream in (faulty_bitstream, repair_bitstream):
+            if isinstance(bitstream, str):
+                os.remove(bitstream)
+        return r.json()['job_id']
+
+    def job_results(self, wait=10, ack=()):
+        """
+        Results of the jobs finished on the board, long-polled
+        :param wait: seconds to wait for a result if there is none yet
+        :param ack: job ids of the results already received, not returned again
+        :return: results ({'job_id', 'index', 'duration', 'run_time'}, 'error' if the job could not run)
+                 and ids of the jobs queued or running on the board, None if the request failed
+        """
+        try:
+            r = self.session.post(f"{self.server_request_url}/jobs/results",
+                                  data={
+                                      'wait': wait,
+                                      'ack': ','.join(ack)
+                                  }, timeout=wait + 10)
+        except requests.RequestException as exp:
+            self.status = "dead"
+            return None
+        if r.status_code != 200:
+            return None
+        r_json = r.json()
+        return r_json['results'], r_json['jobs']
+
+    def wait_run(self):
+        """:return: class_index, class_duration of the run, None if no result"""
+        r = self.session.post(f"{self.server_request_url}/wait_run", data={"timeout": 10},
+                              timeout=10)
+        if r.status_code == 204: # No content
+            self.status = self.get_status()
+            return None
+        elif r.status_code == 200:
+            self.status = self.get_status()
+            r_json = r.json()
+            class_index = r_json['index']
+            class_duration = r_json['duration']
+            return class_index, class_duration
+        else:
+            self.status = "dead"
+            return None
+
 
 class BNN_ClusterMan:
-    """ Helper (Man) class for managing multiple servers for BNN FI"""
+    """
+    Helper (Man) class for managing multiple servers for BNN FI:
+    runs dispatched to the idle boards as soon as one is released, per board throughput and failure rate,
+    and quarantine of the boards failing repeatedly (flapping)
+    """
 
-    def __init__(self, servers: list):
-        self.servers = [BNN_ServerMan(server, 5200) for server in servers]
-        self.servers_lock = Lock()
+    def __init__(self, servers: list, port: int = 5200,
+                 flap_failures: int = 3, flap_window: float = 600,
+                 quarantine_time: float = 60, max_quarantine_time: float = 3600,
+                 probe_interval: float = 10):
+        """
+        :param servers: server urls
+        :param port: port of the servers, None if in the urls
+        :param flap_failures: failures within flap_window seconds to quarantine a board
+        :param quarantine_time: first quarantine of a board, doubled for each new one up to max_quarantine_time
+        :param probe_interval: period of the status probe of the dead and quarantined boards
+        """
+        self.upload_man = BitstreamUploadMan()
+        self.flap_failures = flap_failures
+        self.flap_window = flap_window
+        self.quarantine_time = quarantine_time
+        self.max_quarantine_time = max_quarantine_time
+        self.probe_interval = probe_interval
+        self.logger = logging.getLogger('ClusterMan')
+
+        # server_request_url -> board state, only bookkeeping under boards_cond (no requests)
+        self.boards = {}
+        self.boards_cond = Condition()
+        for server in servers:
+            self.add_server(server, port)
+
+        self.probe_stop = Event()
+        self.probe_thread = Thread(target=self.probe_loop, daemon=True)
+        self.probe_thread.start()
+
+    def add_server(self, server_url, port=5200):
+        server = BNN_ServerMan(server_url, port, self.upload_man)
+        with self.boards_cond:
+            self.boards[server.server_request_url] = {
+                'server': server,
+                # idle, busy, dead, quarantined or mismatch (other golden bitstream, never used again)
+                'state': 'idle' if server.status == 'idle' else 'dead',
+                'last_ts': 0,
+                'n_runs': 0,
+                'n_failures': 0,
+                'run_time': 0.0,
+                'failure_ts': deque(),
+                'last_failure_ts': 0,
+                'n_quarantines': 0,
+                'quarantine_until': 0
+            }
+            self.boards_cond.notify_all()
+        return server
+
+    def any_board_ready(self):
+        """:return: True if a board is idle, or if none will ever be (all mismatch), False without boards yet"""
+        boards = self.boards.values()
+        if len(boards) == 0:
+            return False
+        return any(b['state'] == 'idle' for b in boards) or all(b['state'] == 'mismatch' for b in boards)
+
+    def acquire_server(self, timeout=None):
+        """
+        Wait for an idle board and mark it busy, to be given back with release_server()
+        The boards with the shortest runs are picked first (the ones not measured yet before), then the least recent
+        An empty cluster waits for add_server()
+        :return: BNN_ServerMan, None on timeout
+        :raise NoBoardLeftError: if all the boards have another golden bitstream
+        """
+        with self.boards_cond:
+            if not self.boards_cond.wait_for(self.any_board_ready, timeout):
+                return None
+            idle_boards = [b for b in self.boards.values() if b['state'] == 'idle']
+            if len(idle_boards) == 0:
+                raise NoBoardLeftError('No board left to run the faults')
+
+            board = min(idle_boards,
+                        key=lambda b: (b['run_time'] / b['n_runs'] if b['n_runs'] != 0 else 0, b['last_ts']))
+            board['state'] = 'busy'
+            board['last_ts'] = time.time()
+            return board['server']
+
+    def release_server(self, server: BNN_ServerMan, ok: bool, run_duration: float = None, mismatch: bool = False):
+        """
+        :param ok: the run succeeded, the board is idle again
+        :param run_duration: of the successful run
+        :param mismatch: the board has another golden bitstream
+        """
+        with self.boards_cond:
+            board = self.boards[server.server_request_url]
+            now = time.time()
+            if mismatch:
+                board['state'] = 'mismatch'
+            elif ok:
+                board['state'] = 'idle'
+                board['n_runs'] += 1
+                board['run_time'] += run_duration if run_duration is not None else now - board['last_ts']
+                if now - board['last_failure_ts'] > self.flap_window:
+                    # stable again, the next quarantine starts over
+                    board['n_quarantines'] = 0
+            else:
+                board['n_failures'] += 1
+                board['last_failure_ts'] = now
+                board['failure_ts'].append(now)
+                while now - board['failure_ts'][0] > self.flap_window:
+                    board['failure_ts'].popleft()
+
+                if len(board['failure_ts']) >= self.flap_failures:
+                    q_time = min(self.quarantine_time * 2 ** board['n_quarantines'], self.max_quarantine_time)
+                    board['n_quarantines'] += 1
+                    board['quarantine_until'] = now + q_time
+                    board['failure_ts'].clear()
+                    board['state'] = 'quarantined'
+                    self.logger.warning(f'{server.server_request_url}: {self.flap_failures} failures '
+                                        f'in {self.flap_window}s, quarantined for {q_time:.0f}s')
+                else:
+                    # back when the probe finds it idle
+                    board['state'] = 'dead'
+            self.boards_cond.notify_all()
+
+    def probe_loop(self):
+        """Puts back the dead boards, and the quarantined ones at the end of their quarantine, once idle"""
+        while not self.probe_stop.wait(self.probe_interval):
+            with self.boards_cond:
+                now = time.time()
+                probe_boards = [b for b in self.boards.values()
+                                if b['state'] in ('dead', 'quarantined') and b['quarantine_until'] <= now]
+
+            for board in probe_boards:
+                if board['server'].get_status() == 'idle':
+                    with self.boards_cond:
+                        if board['state'] in ('dead', 'quarantined'):
+                            board['state'] = 'idle'
+                            self.boards_cond.notify_all()
+                    self.logger.info(f'{board["server"].server_request_url} is back')
+
+    def run_on_board(self, run_fn, timeout=None):
+        """
+        :param run_fn: run_fn(server) runs on the acquired board, returns the result or None if it failed
+        :return: result of run_fn, None if it failed or if no board was idle within timeout
+        """
+        server = self.acquire_server(timeout)
+        if server is None:
+            return None
 
-    def launch_fault_inj(self, network_name, faulty_bitstream):
-        with self.servers_lock:
-            pass # TODO
+        ts_start = time.time()
+        mismatch = False
+        try:
+            fi_result = run_fn(server)
+        except GoldenMismatchError as exp:
+            self.logger.error(f'{exp}')
+            fi_result = None
+            mismatch = True
+        except Exception as exp:
+            self.logger.error(f'{server.server_request_url} failed with {exp}')
+            fi_result = None
+
+        self.release_server(server, fi_result is not None, time.time() - ts_start, mismatch)
+        return fi_result
+
+    def launch_fault_inj(self, network_name, faulty_bitstream, repair_bitstream=None, timeout=None):
+        """
+        BNN_ServerMan.launch_fault_inj() on the next idle board
+        :return: class_index, class_duration, None if the run failed or no board was idle within timeout
+        """
+        return self.run_on_board(lambda server: server.launch_fault_inj(network_name,
+                                                                        faulty_bitstream,
+                                                                        repair_bitstream),
+                                 timeout)
+
+    def launch_fault_inj_bits(self, network_name, golden_sha256, bits, partial=False, timeout=None):
+        """BNN_ServerMan.launch_fault_inj_bits() on the next idle board, see launch_fault_inj()"""
+        return self.run_on_board(lambda server: server.launch_fault_inj_bits(network_name,
+                                                                             golden_sha256,
+                                                                             bits,
+                                                                             partial),
+                                 timeout)
+
+    def stats(self):
+        """:return: per board state, runs, failure rate, mean run duration and throughput (runs/s)"""
+        with self.boards_cond:
+            return [{
+                'server': server_request_url,
+                'state': b['state'],
+                'n_runs': b['n_runs'],
+                'n_failures': b['n_failures'],
+                'failure_rate': b['n_failures'] / (b['n_runs'] + b['n_failures'])
+                if b['n_runs'] + b['n_failures'] != 0 else 0,
+                'run_duration': b['run_time'] / b['n_runs'] if b['n_runs'] != 0 else None,
+                'throughput': b['n_runs'] / b['run_time'] if b['run_time'] != 0 else 0,
+                'n_quarantines': b['n_quarantines']
+            } for server_request_url, b in self.boards.items()]
+
+    def close(self):
+        self.probe_stop.set()
+        self.probe_thread.join()
 
 
 class BNN_FaultInjMan:
@@ -175,12 +769,27 @@ class BNN_FaultInjMan:
     fault generation, faulty bitstream generation,
     and fault injection launch in the server (Pynq) board
     """
-    def __init__(self, golden_bitstream, logic_location_filename):
+    def __init__(self, golden_bitstream, logic_location_filename, cache_dir=BITSTREAM_CACHE_DIR,
+                 spill_faulty_bs=False, board_side_faults=False, partial_bitstreams=False):
+        """
+        :param spill_faulty_bs: write the faulty bitstreams to ./FAULTY_BITSTREAM/ (debugging)
+                                instead of uploading them from memory
+        :param board_side_faults: only send the bit offsets, the boards generate the faulty bitstreams
+                                  from their copy of the golden bitstream (/fault_inj_bits)
+        :param partial_bitstreams: partial reconfiguration runs, only the faulty frames are loaded then repaired
+                                   (see generate_faulty_partial_bs). The FAR of the frames come from
+                                   logic_location_filename, the boards need it too with board_side_faults
+        """
         self.db_man = BNN_FaultDBMan('bnn_faults.db')
         self.fault_list = []
-        self.server_list = []
-        self.server_list_lock = Lock()
+        # servers added with add_server()
+        self.cluster_man = BNN_ClusterMan([])
         self.golden_bs = golden_bitstream
+        self.spill_faulty_bs = spill_faulty_bs
+        self.board_side_faults = board_side_faults
+        self.partial_bitstreams = partial_bitstreams
+        self.golden_sha256 = file_sha256(golden_bitstream)
+        self.upload_man = self.cluster_man.upload_man
 
         # set up the logger
         self.logger = logging.getLogger('FaultInjMan')
@@ -196,133 +805,114 @@ class BNN_FaultInjMan:
         self.logger.addHandler(sh)
 
         self.logger.info(f'Loading Bitstream {self.golden_bs}')
-        self.bman = BitstreamMan(self.golden_bs)
+        self.bman = BitstreamMan(self.golden_bs, use_mmap=True, cache_dir=cache_dir)
         self.logger.info(f'Done')
 
         self.logger.info(f'Loading Logic Location file {logic_location_filename}')
-        self.ll_lst = load_ll_file(logic_location_filename)
-        self.logger.info(f'{len(self.ll_lst)} bits loaded')
+        self.llman = LogicLocationMan(logic_location_filename, cache_dir=cache_dir)
+        self.logger.info(f'{len(self.llman)} bits loaded')
+        # FAR of the frames for partial bitstreams
+        self.bman.register_frame_addresses(self.llman)
+        # process pool for generate_faulty_bs_batch, started on first use
+        self.gen_man = None
+        # set when no board is left to run the faults, the remaining faults are left pending in the DB
+        self.stopped = Event()
 
     def add_server(self, server_url):
-        with self.server_list_lock:
-            self.server_list.append({
-                'url' : server_url,
-                'status': 'idle',
-                'last_ts': 0
-            })
-
-    def pick_server(self):
-        with self.server_list_lock:
-            idle_servers = [x for x in self.server_list if x['status'] == 'idle']
-            if len(idle_servers) == 0:
-                return None
-            else:
-                pick_server = sorted(idle_servers, key = lambda x : x['last_ts'])[0]
-                pick_server['status'] = 'busy'
-                pick_server['last_ts'] = time.time()
-                return pick_server['url']
-
-    def set_server_status(self, server_url, status):
-        with self.server_list_lock:
-            s = [x for x in self.server_list if x['url'] == server_url]
-            if len(s) == 0:
-                # no such server
-                return False
-            else:
-                s = s[0]
-                s['status'] = status
-                return True
-
-    def refresh_dead_servers(self):
-        with self.server_list_lock:
-            dead_servers = [x for x in self.server_list if x['status']=='dead']
-            for s in dead_servers:
-                try:
-                    r = requests.get(s['url'] + '/is_running')
-                    if r.status_code == 200:
-                        s['status'] = 'idle' if not r.json()['running'] else 'busy'
-                except Exception as exp:
-                    pass # remain dead
-
-    def any_dead_server(self):
-        with self.server_list_lock:
-            dead_servers = [x for x in self.server_list if x['status'] == 'dead']
-            return True if len(dead_servers) != 0 else False
+        """:param server_url: with the port"""
+        self.cluster_man.add_server(server_url, port=None)
 
     def generate_faulty_bs(self, bits, faulty_bs_filename):
-        """Not thread-safe, should be called when generating fault"""
-        # Flip the bits
-        for bit in bits:
-            bit_value = self.bman.get_bit(bit)
-            bit_value_f = 0 if bit_value == 1 else 1
-            self.bman.set_bit(bit, bit_value_f)
-
-        self.bman.dump_bitstream(faulty_bs_filename)
-        # Flip the bits back
-        for bit in bits:
-            bit_value = self.bman.get_bit(bit)
-            bit_value_f = 0 if bit_value == 1 else 1
-            self.bman.set_bit(bit, bit_value_f)
-
-    def launch_fault_in_server(self, fault, server_url):
-        faulty_bits = fault['bits']
-        network_name = BNN_FaultInjMan.NETWORK_NAME
-        faulty_bits_str = '-'.join([str(x) for x in faulty_bits])
-        faulty_bitstream_fname = fault['faulty_bitstream']
-
-        # Generating faulty bitstream
-        # faulty_bitstream_fname = './FAULTY_BITSTREAM/' + \
-        #                   BNN_FaultInjMan.NETWORK_NAME + \
-        #                   BNN_FaultInjMan.PLATFORM_NAME + \
-        #                   faulty_bits_str + '.bit'
-        # self.generate_faulty_bs(faulty_bits, faulty_bitstream_fname)
-
-        self.logger.info(f'Launching {fault} to {server_url}')
-
+        """Thread-safe, the golden bitstream is not modified"""
+        self.bman.dump_faulty_bitstream(bits, faulty_bs_filename)
+
+    def generate_faulty_bs_batch(self, bits_lst):
+        """
+        Generate the faulty bitstreams of many faults, written to disk in a process pool if spill_faulty_bs
+        :param bits_lst: iterable of bit offset lists
+        :return: iterator of faults ({'bits', 'faulty_bitstream'}), in completion order
+        """
+        if self.partial_bitstreams and not self.board_side_faults:
+            # a few frames per fault, nothing worth a process pool
+            for bits in bits_lst:
+                yield self.partial_fault(bits)
+            return
+
+        if not self.spill_faulty_bs:
+            for bits in bits_lst:
+                yield {
+                    'bits': bits,
+                    'faulty_bitstream': None if self.board_side_faults else self.bman.faulty_variant(bits)
+                }
+            return
+
+        if self.gen_man is None:
+            self.gen_man = BitstreamGenMan(self.bman)
+
+        for bits, faulty_bs_fname in self.gen_man.generate(bits_lst, out_fname_fn=self.faulty_bs_fname):
+            yield {
+                'bits': bits,
+                'faulty_bitstream': faulty_bs_fname
+            }
+        self.logger.info(f'Faulty bitstream generation: {self.gen_man.report()}')
+
+    @staticmethod
+    def faulty_bs_fname(bits):
+        return './FAULTY_BITSTREAM/' + \
+               BNN_FaultInjMan.NETWORK_NAME + \
+               BNN_FaultInjMan.PLATFORM_NAME + \
+               '-'.join([str(x) for x in bits]) + '.bit'
+
+    def close(self):
+        if self.gen_man is not None:
+            self.gen_man.close()
+            self.gen_man = None
+        for board_stats in self.cluster_man.stats():
+            self.logger.info(f'{board_stats}')
+        self.cluster_man.close()
+        self.db_man.close()
+
+    def generate_faulty_partial_bs(self, bits, faulty_bs_filename, repair_bs_filename):
+        """Partial bitstreams with the faulty frames and with the same frames from the golden bitstream"""
+        self.bman.dump_partial_bitstream(bits, faulty_bs_filename)
+        self.bman.dump_partial_bitstream([], repair_bs_filename,
+                                         frame_l_addrs=[int(bit / (self.bman.N_WORDS_IN_FRAME * 32))
+                                                        for bit in bits])
+
+    def partial_fault(self, bits):
+        """
+        generate_faulty_partial_bs() in memory, or to ./FAULTY_BITSTREAM/ if spill_faulty_bs.
+        The faults in a frame of unknown FAR (not in the Logic Location file) get a full faulty bitstream
+        :return: fault ({'bits', 'faulty_bitstream', 'repair_bitstream'})
+        """
+        frame_l_addrs = [int(bit / (self.bman.N_WORDS_IN_FRAME * 32)) for bit in bits]
         try:
-            r = requests.post(server_url + '/fault_inj',
-                              files={
-                                  'faulty_bitstream': open(faulty_bitstream_fname, 'rb')
-                              },
-                              data={
-                                  'network_name': network_name,
-                              })
-
-            if r.status_code != 200:
-                self.set_server_status(server_url, 'dead')
-                self.logger.error(f'{server_url} failed to execute')
-                return False
-
-            r = requests.post(server_url + '/wait_run',
-                              data={
-                                  'timeout': 10
-                              })
-
-            if r.status_code != 200:
-                self.set_server_status(server_url, 'dead')
-                self.logger.error(f'{server_url} failed to respond to wait_run')
-                return False
-        except Exception as exp:
-            self.set_server_status(server_url, 'dead')
-            self.logger.error(f'{server_url} failed with {exp}')
-            return False
-
-        # Successful run
-        fi_result = r.json()
-        class_index = fi_result['index']
-        class_duration = fi_result['duration']
-
-        self.logger.info(f'Fault {fault} injection on {server_url} returns {fi_result}')
-
-        self.db_man.update_fault(bits=faulty_bits_str,
-                                 status='E',
-                                 class_index=class_index,
-                                 class_duration=class_duration)
-
-        # Clean up
-        os.remove(faulty_bitstream_fname)
-        self.set_server_status(server_url, 'idle')
-        return True
+            for frame_l_addr in frame_l_addrs:
+                self.bman.get_frame_far(frame_l_addr)
+        except ValueError as ve:
+            self.logger.warning(f'{ve}, full bitstream for fault {bits}')
+            if self.spill_faulty_bs:
+                faulty_bs = self.faulty_bs_fname(bits)
+                self.generate_faulty_bs(bits, faulty_bs)
+            else:
+                faulty_bs = self.bman.faulty_variant(bits)
+            return {
+                'bits': bits,
+                'faulty_bitstream': faulty_bs
+            }
+
+        if self.spill_faulty_bs:
+            faulty_bs = self.faulty_bs_fname(bits)
+            repair_bs = faulty_bs[:-len('.bit')] + '-repair.bit'
+            self.generate_faulty_partial_bs(bits, faulty_bs, repair_bs)
+        else:
+            faulty_bs = self.bman.generate_partial_bitstream(bits)
+            repair_bs = self.bman.generate_partial_bitstream([], frame_l_addrs=frame_l_addrs)
+        return {
+            'bits': bits,
+            'faulty_bitstream': faulty_bs,
+            'repair_bitstream': repair_bs
+        }
 
     def generate_fault_inj_camp_seu_random(self, n_faults):
         bit = random.randint(0, self.bman.N_WORDS_IN_FRAME * self.bman.n_frames * 32)
@@ -340,27 +930,75 @@ class BNN_FaultInjMan:
             pass
 
     def fault_work_thread(self, bits):
-        faulty_bits_str = '-'.join([str(x) for x in bits])
-        faulty_bs_fname = './FAULTY_BITSTREAM/' + \
-                          BNN_FaultInjMan.NETWORK_NAME + \
-                          BNN_FaultInjMan.PLATFORM_NAME + \
-                          faulty_bits_str + '.bit'
-        self.generate_faulty_bs(bits, faulty_bs_fname)
+        if self.partial_bitstreams and not self.board_side_faults:
+            self.launch_fault(self.partial_fault(bits))
+            return
+
+        if self.board_side_faults:
+            faulty_bs = None
+        elif self.spill_faulty_bs:
+            faulty_bs = self.faulty_bs_fname(bits)
+            self.generate_faulty_bs(bits, faulty_bs)
+        else:
+            faulty_bs = self.bman.faulty_variant(bits)
         fault = {
             'bits': bits,
-            'faulty_bitstream': faulty_bs_fname
+            'faulty_bitstream': faulty_bs
         }
-        while True:
-            server_url = self.pick_server()
-            if server_url is None:
-                # no free server now
-                time.sleep(5)
-                continue
-            else:
-                self.launch_fault_in_server(fault, server_url)
+        self.launch_fault(fault)
+
+    def fault_batch_work_thread(self, bits_lst):
+        """fault_work_thread() for many faults, the bitstreams are generated in parallel"""
+        for fault in self.generate_faulty_bs_batch(bits_lst):
+            if not self.launch_fault(fault) and self.stopped.is_set():
                 break
 
+    def launch_fault(self, fault, max_attempts=3):
+        """
+        Run the fault on the next idle board, on another one if the run fails
+        :return: True if the fault was executed, False if it failed max_attempts times
+                 or if no board is left (stopped is set), the fault is then left pending in the DB
+        """
+        faulty_bits = fault['bits']
+        network_name = BNN_FaultInjMan.NETWORK_NAME
+
+        fi_result = None
+        try:
+            for attempt in range(max_attempts):
+                if self.stopped.is_set():
+                    break
+                self.logger.info(f'Launching {faulty_bits}')
+                if self.board_side_faults:
+                    fi_result = self.cluster_man.launch_fault_inj_bits(network_name, self.golden_sha256, faulty_bits,
+                                                                       self.partial_bitstreams)
+                else:
+                    fi_result = self.cluster_man.launch_fault_inj(network_name, fault['faulty_bitstream'],
+                                                                  fault.get('repair_bitstream'))
+                if fi_result is not None:
+                    break
+            else:
+                self.logger.error(f'Fault {faulty_bits} failed {max_attempts} times')
+        except NoBoardLeftError as exp:
+            self.logger.error(f'{exp}, stopping the fault injection')
+            self.stopped.set()
+        if fi_result is None:
+            self.db_man.update_fault(bits=faulty_bits, status=FAULT_PENDING)
+            return False
 
+        # Successful run, the spilled faulty bitstream is removed by BNN_ServerMan
+        class_index, class_duration = fi_result
+        self.logger.info(f'Fault {faulty_bits} injection returns {fi_result}')
 
+        self.db_man.update_fault(bits=faulty_bits,
+                                 status=FAULT_EXECUTED,
+                                 class_index=class_index,
+                                 class_duration=class_duration)
+        return True
 
 
+if __name__ == '__main__':
+    # Import older fault databases: BNN_FaultDBMan.py new.db legacy.db [legacy.db ...]
+    db_man = BNN_FaultDBMan(sys.argv[1])
+    for legacy_db_filename in sys.argv[2:]:
+        print(f'{legacy_db_filename}: {db_man.import_legacy_db(legacy_db_filename)} faults imported')
+    db_man.close()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import os
+import time
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
+import numpy as np
+from BitstreamMan import BitstreamMan, FaultyBitstream, patch_template_words
+
+"""
+Batch generation of faulty bitstreams in a process pool sharing the golden template
+"""
+
+
+# shared golden template of the worker process, see init_gen_worker
+worker_shm = None
+worker_template = None
+worker_template_frame_offsets = None
+
+
+def init_gen_worker(shm_name: str, template_len: int, template_frame_offsets: np.ndarray):
+    global worker_shm, worker_template, worker_template_frame_offsets
+    worker_shm = shared_memory.SharedMemory(name=shm_name)
+    worker_template = worker_shm.buf[:template_len]
+    worker_template_frame_offsets = template_frame_offsets
+
+
+def gen_worker(bit_offsets, out_fname: str = None):
+    """
+    :return: out_fname once written, or the faulty bitstream bytes if out_fname is None,
+             and the time spent building and writing it
+    """
+    ts_start = time.perf_counter()
+    faulty_bs = FaultyBitstream(worker_template,
+                                patch_template_words(worker_template, worker_template_frame_offsets, bit_offsets),
+                                bit_offsets)
+    if out_fname is None:
+        return faulty_bs.tobytes(), time.perf_counter() - ts_start
+
+    with open(out_fname, 'wb') as f_bs_out:
+        faulty_bs.write(f_bs_out)
+    return out_fname, time.perf_counter() - ts_start
+
+
+class BitstreamGenMan:
+    """
+    Helper (Man) class generating batches of faulty bitstreams in a process pool.
+    The golden template is copied once into shared memory and attached by every worker.
+    """
+
+    def __init__(self, bman: BitstreamMan, n_workers: int = None):
+        template, template_frame_offsets = bman.get_bitstream_template()
+        self.n_workers = os.cpu_count() if n_workers is None else n_workers
+        self.shm = shared_memory.SharedMemory(create=True, size=len(template))
+        self.shm.buf[:len(template)] = template
+        self.executor = ProcessPoolExecutor(max_workers=self.n_workers,
+                                            initializer=init_gen_worker,
+                                            initargs=(self.shm.name, len(template), template_frame_offsets))
+        self.n_generated = 0
+        # time spent by the workers building and writing the variants, not waiting for the consumer
+        self.gen_duration = 0
+        # variants per second the pool would generate with all workers busy, estimated from gen_duration
+        self.throughput = 0
+
+    def generate(self, fault_bit_sets, out_fname_fn=None):
+        """
+        Generate the faulty bitstreams, at most 2 * n_workers in flight.
+        fault_bit_sets is consumed lazily, so a slow consumer of the results also slows down its producer
+        :param fault_bit_sets: iterable of bit offset lists
+        :param out_fname_fn: bit offsets -> file name to write the bitstream to, None to get the bitstreams as bytes
+        :return: iterator of (bit offsets, file name or bytes), in completion order
+        """
+        pending = {}
+        for bit_offsets in fault_bit_sets:
+            out_fname = out_fname_fn(bit_offsets) if out_fname_fn is not None else None
+            if len(pending) >= 2 * self.n_workers:
+                done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), self.record_done(future)
+            pending[self.executor.submit(gen_worker, bit_offsets, out_fname)] = bit_offsets
+
+        for future in as_completed(list(pending.keys())):
+            yield pending.pop(future), self.record_done(future)
+
+    def record_done(self, future):
+        """:return: result of the gen_worker future, its build time accounted"""
+        faulty_bs, duration = future.result()
+        self.n_generated += 1
+        self.gen_duration += duration
+        self.throughput = self.n_generated * self.n_workers / self.gen_duration if self.gen_duration > 0 else 0
+        return faulty_bs
+
+    def report(self):
+        return f'{self.n_generated} faulty bitstreams generated in {self.gen_duration:.2f}s of worker time, ' \
+               f'~{self.throughput:.1f} variants/s estimated for {self.n_workers} workers'
+
+    def close(self):
+        self.executor.shutdown()
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
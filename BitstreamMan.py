@@ -1,20 +1,34 @@
 #!/usr/bin/env python3
 
 import os
-from os.path import isfile
+from os.path import isfile, isdir
+import mmap
 import struct
 import sys
-import re
+import json
+import hashlib
+import tempfile
+import shutil
+from threading import RLock
+import numpy as np
 
 """
 WARNING: This is only intended for 7Series Xilinx FPGA
 """
 
 
-def decode_far_reg(word: int):
+# Decoded FAR, see decode_far_regs
+FAR_DTYPE = np.dtype([('block_type', np.uint8),
+                      ('top_bottom', np.uint8),
+                      ('row_addr', np.uint8),
+                      ('col_addr', np.uint16),
+                      ('minor_addr', np.uint8)])
+
+
+def decode_far_regs(words):
     """
-    :param word: FAR register value
-    :return: tuple for each field
+    :param words: array of FAR register values
+    :return: FAR_DTYPE array, one record per word
     """
     # 00 0000 0000 0000 0000 0000 0000
     # 11 1                              => 0x0380_0000
@@ -22,41 +36,103 @@ def decode_far_reg(word: int):
     # 00 0011 1110                      => 0x003E_0000
     # 00 0000 0001 1111 1111 10         => 0x0001_FF80
     # 00 0000 0000 0000 0000 0111 1111  => 0x0000_007F
-    block_type = (0x0380_0000 & word) >> 23
-    top_bottom = (0x0040_0000 & word) >> 22
-    row_addr = (0x003E_0000 & word) >> 17
-    col_addr = (0x0001_FF80 & word) >> 7
-    minor_addr = (0x0000_007F & word)
+    words = np.asarray(words, dtype=np.uint32)
+    fars = np.empty(words.shape, dtype=FAR_DTYPE)
+    fars['block_type'] = (0x0380_0000 & words) >> 23
+    fars['top_bottom'] = (0x0040_0000 & words) >> 22
+    fars['row_addr'] = (0x003E_0000 & words) >> 17
+    fars['col_addr'] = (0x0001_FF80 & words) >> 7
+    fars['minor_addr'] = (0x0000_007F & words)
+    return fars
+
+
+def decode_far_reg(word: int):
+    """
+    :param word: FAR register value
+    :return: tuple for each field
+    """
+    far = decode_far_regs(word)
 
-    if block_type == 0x0:
+    if far['block_type'] == 0x0:
         block_type_str = "CLB,I/O,CLK"
-    elif block_type == 0x1:
+    elif far['block_type'] == 0x1:
         block_type_str = "BRAM"
-    elif block_type == 0x2:
+    elif far['block_type'] == 0x2:
         block_type_str = "CFG_CLB"
     else:
         block_type_str = "--"
 
-    if top_bottom == 0x0:
+    if far['top_bottom'] == 0x0:
         half = "TOP"
     else:
         half = "BOTTOM"
 
     return {'b_type': block_type_str,
             'half': half,
-            'row_addr': row_addr,
-            'col_addr': col_addr,
-            'minor_addr': minor_addr
+            'row_addr': int(far['row_addr']),
+            'col_addr': int(far['col_addr']),
+            'minor_addr': int(far['minor_addr'])
             }
 
+
+def encode_far_reg(b_type: str, half: str, row_addr: int, col_addr: int, minor_addr: int):
+    """
+    Inverse of decode_far_reg, encode_far_reg(**decode_far_reg(word)) == word for the known block types
+    :return: FAR register value
+    """
+    block_type = {"CLB,I/O,CLK": 0x0, "BRAM": 0x1, "CFG_CLB": 0x2}[b_type]
+    top_bottom = 0x0 if half == "TOP" else 0x1
+
+    return (block_type << 23) | (top_bottom << 22) | ((row_addr & 0x1F) << 17) | \
+        ((col_addr & 0x3FF) << 7) | (minor_addr & 0x7F)
+
+
+REG_ADDR_DICT = {
+    0x00: ("CRC", "RW", "CRC Register"),
+    0x01: ("FAR", "RW", "Frame Address Register"),
+    0x02: ("FDRI", "W", "Frame Data Register, Input Register (write configuration data)"),
+    0x03: ("FDRO", "R", "Frame Data Register, Output Register (read configuration data)"),
+    0x04: ("CMD", "RW", "Command Register"),
+    0x05: ("CTL0", "RW", "Control Register 0"),
+    0x06: ("MASK", "RW", "Masking Register for CTL0 and CTL1"),
+    0x07: ("STAT", "R", "Status Register"),
+    0x08: ("LOUT", "W", "Legacy Output Register for daisy chain"),
+    0x09: ("COR0", "RW", "Configuration Option Register 0"),
+    0x0A: ("MFWR", "W", "Multiple Frame Write Register"),
+    0x0B: ("CBC", "W", "Initial CBC Value Register"),
+    0x0C: ("IDCODE", "RW", "Device ID Register"),
+    0x0D: ("AXSS", "RW", "User Access Register"),
+    0x0E: ("COR1", "RW", "Configuration Option Register 1"),
+    0x10: ("WBSTAR", "RW", "Warm Boot Start Address Register"),
+    0x11: ("TIMER", "RW", "Watchdog Timer Register"),
+    0x13: ("CRC?", "RW", "CRC Register??"),
+    0x16: ("BOOTSTS", "R", "Boot History Status Register "),
+    0x18: ("CTL1", "RW", "Control Register 1"),
+    0x1F: ("BSPI", "RW", "BPI/SPI Configuration Options Register")
+}
+
+# Packet index record, see BitstreamMan.index_bitstream
+PACKET_DTYPE = np.dtype([('offset', np.uint32),
+                         ('header_type', np.uint8),
+                         ('op_code', np.uint8),
+                         ('reg', np.uint16),
+                         ('wc', np.uint32)])
+
 # TODO: COMMAND DICT
 
 
-def decode_bs_word(word: int):
+# Decoded bitstream word, see decode_bs_words
+BS_WORD_DTYPE = np.dtype([('header_type', np.uint8),
+                          ('op_code', np.uint8),
+                          ('reg', np.uint16),
+                          ('wc', np.uint32)])
+
+
+def decode_bs_words(words):
     """
-    decode word in the bistream file
-    :param word: word
-    :return: meaning
+    decode words in the bistream file, as if each of them was a packet header
+    :param words: array of words
+    :return: BS_WORD_DTYPE array, wc is the PT1 or PT2 word count, 0 for other header types
     """
     # 001 xx RRRRRRRRRxxxxx RR xxxxxxxxxxx
     # 111
@@ -64,62 +140,46 @@ def decode_bs_word(word: int):
     # 000 00 11111111111111 0
     # 000 00 00000000000000 11 00000000000
     # 000 00 00000000000000 00 11111111111
-    header_type = (0xE000_0000 & word) >> 29
-    op_code = (0x1800_0000 & word) >> 27
-    reg_addr = (0x07FF_E000 & word) >> 13
-    wc_pt1 = (0x3FF & word)
-    wc_pt2 = (0x07FF_FFFF & word)
-
-    reg_addr_dict = {
-        0x00: ("CRC", "RW", "CRC Register"),
-        0x01: ("FAR", "RW", "Frame Address Register"),
-        0x02: ("FDRI", "W", "Frame Data Register, Input Register (write configuration data)"),
-        0x03: ("FDRO", "R", "Frame Data Register, Output Register (read configuration data)"),
-        0x04: ("CMD", "RW", "Command Register"),
-        0x05: ("CTL0", "RW", "Control Register 0"),
-        0x06: ("MASK", "RW", "Masking Register for CTL0 and CTL1"),
-        0x07: ("STAT", "R", "Status Register"),
-        0x08: ("LOUT", "W", "Legacy Output Register for daisy chain"),
-        0x09: ("COR0", "RW", "Configuration Option Register 0"),
-        0x0A: ("MFWR", "W", "Multiple Frame Write Register"),
-        0x0B: ("CBC", "W", "Initial CBC Value Register"),
-        0x0C: ("IDCODE", "RW", "Device ID Register"),
-        0x0D: ("AXSS", "RW", "User Access Register"),
-        0x0E: ("COR1", "RW", "Configuration Option Register 1"),
-        0x10: ("WBSTAR", "RW", "Warm Boot Start Address Register"),
-        0x11: ("TIMER", "RW", "Watchdog Timer Register"),
-        0x13: ("CRC?", "RW", "CRC Register??"),
-        0x16: ("BOOTSTS", "R", "Boot History Status Register "),
-        0x18: ("CTL1", "RW", "Control Register 1"),
-        0x1F: ("BSPI", "RW", "BPI/SPI Configuration Options Register")
-    }
-
-    if header_type == 0x1:
+    words = np.asarray(words, dtype=np.uint32)
+    decoded = np.empty(words.shape, dtype=BS_WORD_DTYPE)
+    header_type = (0xE000_0000 & words) >> 29
+    decoded['header_type'] = header_type
+    decoded['op_code'] = (0x1800_0000 & words) >> 27
+    decoded['reg'] = (0x07FF_E000 & words) >> 13
+    decoded['wc'] = np.where(header_type == 0x1, 0x7FF & words,
+                             np.where(header_type == 0x2, 0x07FF_FFFF & words, 0))
+    return decoded
+
+
+def decode_bs_word(word: int):
+    """
+    decode word in the bistream file
+    :param word: word
+    :return: meaning
+    """
+    decoded = decode_bs_words(word)
+    wc = int(decoded['wc'])
+
+    if decoded['header_type'] == 0x1:
         header_type_str = "PT1"
-        if op_code == 0x0:
+        if decoded['op_code'] == 0x0:
             op_code_str = "NOP"
-        elif op_code == 0x1:
+        elif decoded['op_code'] == 0x1:
             op_code_str = "R"
-        elif op_code == 0x2:
+        elif decoded['op_code'] == 0x2:
             op_code_str = "W"
         else:
             op_code_str = "--"
 
-        if reg_addr in reg_addr_dict.keys():
-            reg = reg_addr_dict[reg_addr]
-        else:
-            reg = None
-
-        wc = wc_pt1
+        reg = REG_ADDR_DICT.get(int(decoded['reg']))
 
         return {'header_type':header_type_str,
                 'op_code': op_code_str,
                 'reg': reg,
                 'wc': wc
                 }
-    elif header_type == 0x2:
+    elif decoded['header_type'] == 0x2:
         header_type_str = "PT2"
-        wc = wc_pt2
 
         return {'header_type':header_type_str,
                 'wc': wc
@@ -159,6 +219,269 @@ def compare_words_32(a, b, mask):
     return diffs
 
 
+# Parsed bitstreams and Logic Location files, see cache_entry_dir
+BITSTREAM_CACHE_DIR = './BITSTREAM_CACHE/'
+# Bump when the content of the cache entries changes
+CACHE_VERSION = 1
+
+
+def file_sha256(filename: str):
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def cache_entry_dir(cache_dir: str, kind: str, source_file: str):
+    """
+    Cache entry of source_file, keyed by its content: a modified file gets a new entry
+    :param kind: 'bit', 'll', ...
+    :return: directory of the entry, which may not exist yet
+    """
+    return os.path.join(cache_dir, f'{kind}-{file_sha256(source_file)}-v{CACHE_VERSION}')
+
+
+def save_cache_entry(entry_dir: str, meta: dict, arrays: dict):
+    """
+    Write meta (meta.json) and arrays (<name>.npy) in a temporary directory renamed to entry_dir,
+    so that other processes never see a partial entry
+    """
+    cache_dir = os.path.dirname(entry_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=cache_dir)
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f_meta:
+        json.dump(meta, f_meta)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, name + '.npy'), array)
+
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # entry written by another process meanwhile
+        shutil.rmtree(tmp_dir)
+
+
+def load_cache_entry(entry_dir: str, mmap_mode: str = 'r'):
+    """
+    :param mmap_mode: see numpy.load, 'c' for copy-on-write arrays, None to read them in memory
+    :return: meta, {name: array}
+    """
+    with open(os.path.join(entry_dir, 'meta.json'), 'r') as f_meta:
+        meta = json.load(f_meta)
+    arrays = {}
+    for fname in os.listdir(entry_dir):
+        if fname.endswith('.npy'):
+            arrays[fname[:-4]] = np.load(os.path.join(entry_dir, fname), mmap_mode=mmap_mode)
+    return meta, arrays
+
+
+# FAR of the pad frames and of the frames without known address in a FrameMap
+FRAME_MAP_UNKNOWN = 0xFFFF_FFFF
+
+# configuration bus name in a device description -> FAR block type
+DEVICE_BLOCK_TYPES = {'CLB_IO_CLK': 0x0, 'BLOCK_RAM': 0x1, 'CFG_CLB': 0x2}
+
+
+def load_device_description(device_filename: str):
+    """
+    Load a device description in the Project X-Ray part.json format:
+        {"global_clock_regions": {"top"|"bottom": {"rows": {"<row>": {"configuration_buses":
+            {"CLB_IO_CLK"|"BLOCK_RAM"|"CFG_CLB": {"configuration_columns": {"<col>": {"frame_count": n}}}}}}}}}
+    :param device_filename: .json (or .yaml if PyYAML is installed)
+    :return: dict
+    """
+    with open(device_filename, 'r') as f_device:
+        if device_filename.endswith('.yaml'):
+            import yaml
+            return yaml.safe_load(f_device)
+        else:
+            return json.load(f_device)
+
+
+def device_frame_order(device: dict):
+    """
+    FAR of every frame in the order of a full bitstream FDRI burst: block type, top then bottom half, row,
+    column, minor, with the two pad frames at the end of each row as FRAME_MAP_UNKNOWN
+    :param device: see load_device_description
+    :return: uint32 array
+    """
+    regions = device['global_clock_regions']
+    fars = []
+    for bus_name, block_type in sorted(DEVICE_BLOCK_TYPES.items(), key=lambda x: x[1]):
+        for top_bottom, half in ((0x0, 'top'), (0x1, 'bottom')):
+            rows = regions.get(half, {}).get('rows', {})
+            for row_addr in sorted(rows.keys(), key=int):
+                columns = rows[row_addr].get('configuration_buses', {}).get(bus_name, {}).get(
+                    'configuration_columns', {})
+                if len(columns) == 0:
+                    continue
+                for col_addr in sorted(columns.keys(), key=int):
+                    far_col = (block_type << 23) | (top_bottom << 22) | (int(row_addr) << 17) | (int(col_addr) << 7)
+                    fars += range(far_col, far_col + int(columns[col_addr]['frame_count']))
+                fars += [FRAME_MAP_UNKNOWN, FRAME_MAP_UNKNOWN]
+
+    return np.array(fars, dtype=np.uint32)
+
+
+class FrameMap:
+    """
+    Linear frame index (as returned by bit_offset_to_frame_bit_addr) <-> FAR, as compact arrays:
+        far: FAR of each frame, FRAME_MAP_UNKNOWN for the pad frames and the frames of unknown address
+        block_type, top_bottom, row_addr, col_addr, minor_addr: FAR fields of each frame (see decode_far_reg)
+    """
+
+    def __init__(self, far: np.ndarray):
+        self.far = np.asarray(far, dtype=np.uint32)
+        self.known = self.far != FRAME_MAP_UNKNOWN
+        fars = decode_far_regs(self.far)
+        self.block_type = fars['block_type']
+        self.top_bottom = fars['top_bottom']
+        self.row_addr = fars['row_addr']
+        self.col_addr = fars['col_addr']
+        self.minor_addr = fars['minor_addr']
+        # reverse lookup, known frames sorted by FAR
+        known_frames = np.flatnonzero(self.known)
+        far_order = np.argsort(self.far[known_frames], kind='stable')
+        self.sorted_far = self.far[known_frames][far_order]
+        self.sorted_frames = known_frames[far_order]
+
+    def __len__(self):
+        return len(self.far)
+
+    def frame_to_far(self, frame_l_addrs):
+        """:return: FAR of each frame, FRAME_MAP_UNKNOWN if not known"""
+        return self.far[frame_l_addrs]
+
+    def far_to_frame(self, fars):
+        """:return: linear frame index of each FAR, -1 if the FAR is not in the map"""
+        fars = np.asarray(fars, dtype=np.uint32)
+        frames = np.full(fars.shape, -1, dtype=np.int64)
+        pos = np.searchsorted(self.sorted_far, fars)
+        found = pos < len(self.sorted_far)
+        found[found] = self.sorted_far[pos[found]] == fars[found]
+        frames[found] = self.sorted_frames[pos[found]]
+        return frames
+
+    def save(self, frame_map_filename: str):
+        np.save(frame_map_filename, self.far)
+
+    @staticmethod
+    def load(frame_map_filename: str):
+        return FrameMap(np.load(frame_map_filename))
+
+    @staticmethod
+    def from_bitstream(bman, device: dict = None):
+        """
+        Frame map from the FAR written before each FDRI burst. Without device description only the first frame
+        of each burst is known (exact for bitstreams written with per-frame FARs), with it the following frames
+        of the burst take the addresses after the burst FAR in device_frame_order.
+        FARs set on bman (set_frame_far/register_frame_addresses) fill the frames left unknown.
+        :param bman: BitstreamMan
+        :param device: see load_device_description
+        :return: FrameMap
+        """
+        far = np.full(bman.n_frames, FRAME_MAP_UNKNOWN, dtype=np.uint32)
+        device_order = device_frame_order(device) if device is not None else None
+        frame_l_addr = 0
+        for burst_word_index, burst_n_frames, burst_far in bman.fdri_bursts:
+            if burst_far is not None:
+                if device_order is None:
+                    far[frame_l_addr] = burst_far
+                else:
+                    order_index = np.flatnonzero(device_order == burst_far)
+                    if len(order_index) == 0:
+                        raise ValueError(f"FAR {burst_far:08X} is not in the device description")
+                    burst_fars = device_order[order_index[0]:order_index[0] + burst_n_frames]
+                    if len(burst_fars) != burst_n_frames:
+                        raise ValueError(f"FDRI burst of {burst_n_frames} frames from FAR {burst_far:08X} "
+                                         f"does not fit the device description")
+                    far[frame_l_addr:frame_l_addr + burst_n_frames] = burst_fars
+            frame_l_addr += burst_n_frames
+
+        for frame_far_l_addr, frame_far in bman.frame_fars.items():
+            if far[frame_far_l_addr] == FRAME_MAP_UNKNOWN:
+                far[frame_far_l_addr] = frame_far
+
+        return FrameMap(far)
+
+
+def patch_template_words(template, template_frame_offsets, bit_offsets):
+    """
+    Words of a bitstream template with the given bits flipped
+    :param template: bitstream file bytes (bytes, memoryview, ...)
+    :param template_frame_offsets: byte offset of each frame in template
+    :param bit_offsets: bit offsets (as used by BitstreamMan.get_bit/set_bit) to flip
+    :return: byte offset in template -> 4 bytes of the flipped word
+    """
+    n_frame_bits = BitstreamMan.N_WORDS_IN_FRAME * 32
+    patched_words = {}
+    for bit_offset in bit_offsets:
+        frame_l_addr = int(bit_offset / n_frame_bits)
+        frame_w_index = int((bit_offset % n_frame_bits) / 32)
+        frame_w_b_offset = bit_offset % 32
+        word_byte_offset = int(template_frame_offsets[frame_l_addr]) + frame_w_index * 4
+        word = patched_words.get(word_byte_offset, template[word_byte_offset:word_byte_offset + 4])
+        patched_words[word_byte_offset] = (int.from_bytes(word, 'big') ^ (1 << frame_w_b_offset)).to_bytes(4, 'big')
+
+    return patched_words
+
+
+class FaultyBitstream:
+    """
+    Immutable faulty variant of a bitstream template (see BitstreamMan.faulty_variant): the template bytes are
+    shared with the golden BitstreamMan and the other variants, only the patched words are held by the variant
+    """
+
+    def __init__(self, template: bytes, patched_words: dict, bit_offsets):
+        """
+        :param template: bitstream file bytes
+        :param patched_words: byte offset in template -> 4 bytes replacing the word there
+        :param bit_offsets: flipped bits
+        """
+        self.template = template
+        self.patched_words = tuple(sorted(patched_words.items()))
+        self.bit_offsets = tuple(bit_offsets)
+
+    def __len__(self):
+        return len(self.template)
+
+    def iter_chunks(self):
+        """Bitstream file as consecutive memoryview/bytes chunks, the template is not copied"""
+        template_view = memoryview(self.template)
+        chunk_start = 0
+        for word_byte_offset, word_bytes in self.patched_words:
+            yield template_view[chunk_start:word_byte_offset]
+            yield word_bytes
+            chunk_start = word_byte_offset + 4
+        yield template_view[chunk_start:]
+
+    def write(self, f):
+        for chunk in self.iter_chunks():
+            f.write(chunk)
+
+    def tobytes(self):
+        return b''.join(self.iter_chunks())
+
+    def __bytes__(self):
+        return self.tobytes()
+
+    def __repr__(self):
+        return f'FaultyBitstream({self.bit_offsets}, {len(self)} bytes)'
+
+
+def bitstream_payload(bitstream):
+    """
+    Bytes of a bitstream to upload
+    :param bitstream: file name, FaultyBitstream or bytes-like
+    :return: bytes
+    """
+    if isinstance(bitstream, str):
+        with open(bitstream, 'rb') as f_bs:
+            return f_bs.read()
+    return bytes(bitstream)
+
+
 class BitstreamMan:
     """
     Class for manipulating bitstream for
@@ -167,16 +490,68 @@ class BitstreamMan:
 
     N_WORDS_IN_FRAME = 101
 
-    def __init__(self, bitstream_file: str, mask_file: str = None):
+    def __init__(self, bitstream_file: str, mask_file: str = None, use_mmap: bool = False, cache_dir: str = None):
+        """
+        :param bitstream_file: golden bitstream (.bit)
+        :param mask_file: mask bitstream (.msk/.bit), loaded on first use of mask_bm
+        :param use_mmap: map the file copy-on-write instead of reading it, frame data is paged in
+                         when touched and shared with other processes through the page cache
+        :param cache_dir: keep the parsed bitstream (and mask) there, see cache_entry_dir
+        """
         if isfile(bitstream_file):
             self.bs_file = bitstream_file
         else:
             raise ValueError(f"{bitstream_file} is not a valid file")
 
-        self.bs_words = []
+        if mask_file is not None and not isfile(mask_file):
+            raise ValueError(f"{mask_file} is not a valid file")
+
+        self.mask_file = mask_file
+        self.use_mmap = use_mmap
+        self.cache_dir = cache_dir
+        self._mask_bm = None
+
+        self.bs_words = None
         self.bs_bin = None
+        self.bs_mmap = None
+
+        self.n_frames = 0
+        self.frame_words = None
+        self.frame_words_in_bs = True
+        self.frame_word0_index = 0
+        self.frame_word_lindex = 0
+        self.packets = None
+        self.fdri_bursts = []
+        self.frame_offsets = None
+        self.idcode = None
+        # linear frame index -> FAR, for the frames whose address is known
+        self.frame_fars = {}
+        # see build_frame_map
+        self.frame_map = None
+
+        self._bs_template = None
+        self._bs_template_frame_offsets = None
+        # template and frames are read/modified under this lock, see faulty_variant
+        self._bs_template_lock = RLock()
+
+        cache_entry = cache_entry_dir(cache_dir, 'bit', self.bs_file) if cache_dir is not None else None
+        if cache_entry is not None and isdir(cache_entry):
+            self.load_cache(cache_entry)
+        else:
+            self.read_bitstream_file()
+            self.decode_bitstream(f_debug_out=None)
+            if cache_entry is not None:
+                self.save_cache(cache_entry)
+
+    def read_bitstream_file(self):
+        with open(self.bs_file, "rb") as f_bs_file:
+            if self.use_mmap:
+                # ACCESS_COPY: pages stay shared until set_bit/set_word writes to them
+                self.bs_mmap = mmap.mmap(f_bs_file.fileno(), 0, access=mmap.ACCESS_COPY)
+                f_bs = self.bs_mmap
+            else:
+                f_bs = f_bs_file
 
-        with open(self.bs_file, "rb") as f_bs:
             # https://blog.aeste.my/2013/09/30/detailed-look-at-bitstreams-and-a-taste-of-base64-and-sd-card-crc/
             # strip the bitstream file header
             field_len = read_int16_from_file(f_bs)
@@ -215,28 +590,56 @@ class BitstreamMan:
                 elif field_token_value == 0x65:
                     # bitstream bin
                     field_len = read_int32_from_file(f_bs)
-                    field_data = f_bs.read(field_len)
-                    self.bs_bin = field_data
+                    if self.use_mmap:
+                        # Only the packet headers are touched by decode_bitstream
+                        bs_bin_offset = f_bs.tell()
+                        self.bs_bin = memoryview(self.bs_mmap)[bs_bin_offset:bs_bin_offset + field_len]
+                        f_bs.seek(bs_bin_offset + field_len)
+                    else:
+                        # bytearray keeps the word view below writable (set_bit/set_word)
+                        self.bs_bin = bytearray(f_bs.read(field_len))
                 else:
                     raise ValueError(f"{field_token} UNKNOWN")
 
         assert(self.bs_bin is not None)
 
-        for i in range(0, len(self.bs_bin), 4):
-            self.bs_words.append(struct.unpack('>I', self.bs_bin[i:i+4])[0])
-
-        self.n_frames = 0
-        self.frame_words = []
-        self.frame_word0_index = 0
-        self.frame_word_lindex = 0
-        self.decode_bitstream(f_debug_out=None)
-
-        if mask_file is not None:
-            self.mask_bm = BitstreamMan(mask_file)
-        else:
-            self.mask_bm = None
-
-    def generate_bitstream_header(self):
+        # Big-endian word view over the raw payload, no copy
+        self.bs_words = np.frombuffer(self.bs_bin, dtype='>u4', count=len(self.bs_bin) // 4)
+
+    def save_cache(self, cache_entry: str):
+        save_cache_entry(cache_entry,
+                         {'data_word': self.data_word.hex(),
+                          'design_name': self.design_name,
+                          'part_name': self.part_name,
+                          'design_date': self.design_date,
+                          'design_time': self.design_time,
+                          'idcode': self.idcode,
+                          'fdri_bursts': self.fdri_bursts},
+                         {'words': self.bs_words,
+                          'packets': self.packets})
+
+    def load_cache(self, cache_entry: str):
+        meta, arrays = load_cache_entry(cache_entry, mmap_mode='c' if self.use_mmap else None)
+        self.data_word = bytes.fromhex(meta['data_word'])
+        self.design_name = meta['design_name']
+        self.part_name = meta['part_name']
+        self.design_date = meta['design_date']
+        self.design_time = meta['design_time']
+        self.idcode = meta['idcode']
+        self.bs_words = arrays['words']
+        self.bs_bin = self.bs_words.view(np.uint8)
+        self.packets = arrays['packets']
+        self.fdri_bursts = [tuple(fdri_burst) for fdri_burst in meta['fdri_bursts']]
+        self.index_frames()
+
+    @property
+    def mask_bm(self):
+        """Mask bitstream, parsed on first access"""
+        if self._mask_bm is None and self.mask_file is not None:
+            self._mask_bm = BitstreamMan(self.mask_file, use_mmap=self.use_mmap, cache_dir=self.cache_dir)
+        return self._mask_bm
+
+    def generate_bitstream_header(self, bs_bin_len: int = None):
         bitstream_header = struct.pack('>H', len(self.data_word))
         bitstream_header += self.data_word
         bitstream_header += struct.pack('>H', 1) # data length
@@ -257,94 +660,192 @@ class BitstreamMan:
         bitstream_header += self.design_time.encode('utf-8')
 
         bitstream_header += bytes([0x65])  # Bitstream
-        bitstream_header += struct.pack('>I', len(self.bs_bin))
+        bitstream_header += struct.pack('>I', len(self.bs_bin) if bs_bin_len is None else bs_bin_len)
 
         return bitstream_header
 
-    def decode_bitstream(self, f_debug_out=None):
+    def index_bitstream(self):
+        """
+        One pass over the packet headers of bs_words, packet payloads are skipped:
+            self.packets: PACKET_DTYPE record per packet (a DUMMY word is a header_type 0 record),
+                          a PT2 record carries the register of the PT1 before it
+            self.fdri_bursts: (word index, n_frames, FAR) of every FDRI payload, FAR is None if not written
+                              since the previous burst
+            self.frame_offsets: word index in bs_words of each frame
+        Frames are numbered in the order of the FDRI bursts. Frames written by MFWR (compressed bitstreams)
+        are not in the frame table.
+        """
+        packets = []
+        fdri_bursts = []
+        n_words = len(self.bs_words)
         word_index = 0
         previous_reg = None
-        while word_index < len(self.bs_words):
-            word = self.bs_words[word_index]
-            decode_res = decode_bs_word(word)
-
-            if decode_res['header_type'] == '--':
-                if f_debug_out is not None:
-                    print(f"{hex(word)[2:].zfill(8)} => DUMMY", file=f_debug_out)
-                word_index += 1
-                previous_reg = None
-            elif decode_res['header_type'] == "PT1":
-                op_code_str = decode_res['op_code']
-                reg_name, reg_perm, reg_descr = decode_res['reg']
-                wc = decode_res['wc']
-                if op_code_str == "NOP":
-                    if f_debug_out is not None:
-                        print(f"{hex(word)[2:].zfill(8)} => NOP", file=f_debug_out)
+        previous_far = None
+        while word_index < n_words:
+            word = int(self.bs_words[word_index])
+            header_type = (0xE000_0000 & word) >> 29
+            op_code = (0x1800_0000 & word) >> 27
+            if header_type == 0x1:
+                reg_addr = (0x07FF_E000 & word) >> 13
+                wc = (0x7FF & word)
+                if op_code == 0x0:
+                    # NOP
                     assert(wc == 0x0)
                     previous_reg = None
-                elif op_code_str == "R" or op_code_str == "W":
-                    previous_reg = decode_res['reg']
-                    if f_debug_out is not None:
-                        print(f"{hex(word)[2:].zfill(8)} => {op_code_str} {reg_name} {reg_perm} x{wc}", file=f_debug_out)
-                        for word_index_i in range(1, wc+1):
-                            print(f"\t{hex(self.bs_words[word_index+word_index_i])[2:].zfill(8)}", file=f_debug_out)
+                elif op_code == 0x1 or op_code == 0x2:
+                    previous_reg = reg_addr
+                    if op_code == 0x2 and wc == 1:
+                        if reg_addr == 0x0C:
+                            # IDCODE
+                            self.idcode = int(self.bs_words[word_index + 1])
+                        elif reg_addr == 0x01:
+                            # FAR
+                            previous_far = int(self.bs_words[word_index + 1])
+                    if op_code == 0x2 and reg_addr == 0x02 and wc != 0:
+                        fdri_bursts.append((word_index + 1, wc, previous_far))
+                        # the FAR auto-increments past the burst, unknown until written again
+                        previous_far = None
                 else:
-                    # previous_reg = None
-                    raise ValueError(f"{hex(word)[2:].zfill(8)} => {op_code_str} : UNKNOWN")
-
-                word_index += wc + 1
-            elif decode_res['header_type'] == "PT2":
-                wc = decode_res['wc']
+                    raise ValueError(f"{hex(word)[2:].zfill(8)} => {op_code} : UNKNOWN")
+                packets.append((word_index, header_type, op_code, reg_addr, wc))
+            elif header_type == 0x2:
                 assert(previous_reg is not None)
-                if previous_reg[0] == 'FDRI':
-                    # FIXME: This is only for the bit file
-                    self.n_frames = int(wc / self.N_WORDS_IN_FRAME)
-                    assert(self.n_frames * self.N_WORDS_IN_FRAME == wc)
-                    self.frame_word0_index = word_index+1
-                    self.frame_word_lindex = word_index+wc
-                    self.frame_words = self.bs_words[self.frame_word0_index:self.frame_word_lindex+1]
-                if f_debug_out is not None:
-                    print(f"PT2 {wc} {previous_reg}", file=f_debug_out)
-                    for word_index_i in range(1, wc + 1):
-                        print(f"\t@{hex(word_index_i)[2:].zfill(8)} "
-                              f"{hex(self.bs_words[word_index + word_index_i])[2:].zfill(8)}",
-                              file=f_debug_out)
-                word_index += wc + 1
+                wc = (0x07FF_FFFF & word)
+                if previous_reg == 0x02:
+                    fdri_bursts.append((word_index + 1, wc, previous_far))
+                    previous_far = None
+                packets.append((word_index, header_type, op_code, previous_reg, wc))
             else:
-                raise ValueError(f"{decode_res} UNKNOWN")
+                # DUMMY
+                wc = 0
+                previous_reg = None
+                packets.append((word_index, 0x0, 0x0, 0x0, wc))
+            word_index += wc + 1
+
+        self.packets = np.array(packets, dtype=PACKET_DTYPE)
+        self.fdri_bursts = []
+        for burst_word_index, burst_wc, burst_far in fdri_bursts:
+            burst_n_frames = int(burst_wc / self.N_WORDS_IN_FRAME)
+            assert(burst_n_frames * self.N_WORDS_IN_FRAME == burst_wc)
+            self.fdri_bursts.append((burst_word_index, burst_n_frames, burst_far))
+
+        self.index_frames()
+
+    def index_frames(self):
+        """Frame table (frame_offsets, frame_words, ...) from self.fdri_bursts"""
+        frame_offsets = []
+        for burst_word_index, burst_n_frames, burst_far in self.fdri_bursts:
+            if burst_far is not None:
+                self.frame_fars[len(frame_offsets)] = burst_far
+            frame_offsets += range(burst_word_index, burst_word_index + burst_n_frames * self.N_WORDS_IN_FRAME,
+                                   self.N_WORDS_IN_FRAME)
+
+        self.frame_offsets = np.array(frame_offsets, dtype=np.int64)
+        self.n_frames = len(frame_offsets)
+        if len(self.fdri_bursts) != 0:
+            self.frame_word0_index = self.fdri_bursts[0][0]
+            self.frame_word_lindex = self.fdri_bursts[-1][0] + self.fdri_bursts[-1][1] * self.N_WORDS_IN_FRAME - 1
+
+        if len(self.fdri_bursts) == 1:
+            # (n_frames, N_WORDS_IN_FRAME) view on bs_words, writes go through to bs_bin
+            self.frame_words = self.bs_words[self.frame_word0_index:self.frame_word_lindex+1].reshape(
+                self.n_frames, self.N_WORDS_IN_FRAME)
+            self.frame_words_in_bs = True
+        else:
+            # Split FDRI: gathered copy, scattered back by generate_bitstream_template
+            self.frame_words = self.bs_words[self.frame_offsets[:, None] + np.arange(self.N_WORDS_IN_FRAME)]
+            self.frame_words_in_bs = False
 
-    def corrupt_bit(self, frame_index: int, bit_offset_in_frame: int, out_bitstream: str):
-        with open(out_bitstream, 'wb') as f_bs_out:
-            previous_word_crc = False
-
-            f_bs_out.write(self.generate_bitstream_header())
-            # FIXME: if FDRI is splitted, this is not working
-            # All the commands before frame RAW data
-            for word_index in range(0, self.frame_word0_index):
-                write_int32_to_file(f_bs_out, self.bs_words[word_index])
-            corrupt_word_index = frame_index * self.N_WORDS_IN_FRAME + int(bit_offset_in_frame / 32)
-            corrupt_word_bit_index = bit_offset_in_frame % 32
-            for i in range(0, self.n_frames * self.N_WORDS_IN_FRAME):
-                if i == corrupt_word_index:
-                    word = self.frame_words[i] ^ (1 << corrupt_word_bit_index)
-                else:
-                    word = self.frame_words[i]
-                write_int32_to_file(f_bs_out, word)
-            # All the commands after the frame RAW data
-            for word_index in range(self.frame_word_lindex+1, len(self.bs_words)):
-                word = self.bs_words[word_index]
-                decode_res = decode_bs_word(word)
-                if decode_res['header_type'] == 'PT1' and decode_res['op_code'] == 'W' and \
-                        decode_res['reg'][0].startswith('CRC'):
-                    previous_word_crc = True
-                    write_int32_to_file(f_bs_out, 0x2000_0000)  # NOP
+    def decode_bitstream(self, f_debug_out=None):
+        self.index_bitstream()
+        if f_debug_out is None:
+            return
+
+        for packet in self.packets:
+            word_index = int(packet['offset'])
+            word = int(self.bs_words[word_index])
+            wc = int(packet['wc'])
+            if packet['header_type'] == 0x1:
+                if packet['op_code'] == 0x0:
+                    print(f"{hex(word)[2:].zfill(8)} => NOP", file=f_debug_out)
                     continue
-                else:
-                    if previous_word_crc:
-                        write_int32_to_file(f_bs_out, 0x2000_0000)  # NOP
-                    else:
-                        write_int32_to_file(f_bs_out, self.bs_words[word_index])
-                    previous_word_crc = False
+                decode_res = decode_bs_word(word)
+                reg_name, reg_perm, reg_descr = decode_res['reg']
+                print(f"{hex(word)[2:].zfill(8)} => {decode_res['op_code']} {reg_name} {reg_perm} x{wc}",
+                      file=f_debug_out)
+                for word_index_i in range(1, wc+1):
+                    print(f"\t{hex(self.bs_words[word_index+word_index_i])[2:].zfill(8)}", file=f_debug_out)
+            elif packet['header_type'] == 0x2:
+                print(f"PT2 {wc} {REG_ADDR_DICT.get(int(packet['reg']))}", file=f_debug_out)
+                for word_index_i in range(1, wc + 1):
+                    print(f"\t@{hex(word_index_i)[2:].zfill(8)} "
+                          f"{hex(self.bs_words[word_index + word_index_i])[2:].zfill(8)}",
+                          file=f_debug_out)
+            else:
+                print(f"{hex(word)[2:].zfill(8)} => DUMMY", file=f_debug_out)
+
+    def generate_bitstream_template(self):
+        """
+        Bytes of the whole (NO CRC WRITE) bitstream file: header and bitstream words, with the frames from
+        frame_words and the CRC writes after the frame RAW data replaced by NOP.
+        Built once and kept until set_bit/set_word modify the frames.
+        :return: bytes
+        """
+        with self._bs_template_lock:
+            if self._bs_template is None:
+                bs_words = self.bs_words.copy()
+                packets = self.packets
+                crc_packets = packets[(packets['header_type'] == 0x1) & (packets['op_code'] == 0x2) &
+                                      ((packets['reg'] == 0x00) | (packets['reg'] == 0x13)) &
+                                      (packets['offset'] > self.frame_word0_index)]
+                for packet in crc_packets:
+                    bs_words[packet['offset']:packet['offset'] + packet['wc'] + 1] = 0x2000_0000  # NOP
+                if not self.frame_words_in_bs:
+                    bs_words[self.frame_offsets[:, None] + np.arange(self.N_WORDS_IN_FRAME)] = self.frame_words
+
+                bitstream_header = self.generate_bitstream_header()
+                self._bs_template_frame_offsets = len(bitstream_header) + self.frame_offsets * 4
+                self._bs_template = bitstream_header + bs_words.tobytes()
+            return self._bs_template
+
+    def faulty_variant(self, bit_offsets):
+        """
+        Faulty variant of the bitstream with the given bits flipped. Thread-safe: the frames are not modified and
+        only the words holding the bits are computed, the variant shares the template bytes.
+        :param bit_offsets: bit offsets (as used by get_bit/set_bit) to flip
+        :return: FaultyBitstream
+        """
+        template, template_frame_offsets = self.get_bitstream_template()
+        return FaultyBitstream(template, patch_template_words(template, template_frame_offsets, bit_offsets),
+                               bit_offsets)
+
+    def get_bitstream_template(self):
+        """:return: generate_bitstream_template(), byte offset of each frame in it"""
+        with self._bs_template_lock:
+            return self.generate_bitstream_template(), self._bs_template_frame_offsets
+
+    def generate_faulty_bitstream(self, bit_offsets):
+        """
+        Copy of the bitstream template with the given bits flipped, the frames are not modified
+        :param bit_offsets: bit offsets (as used by get_bit/set_bit) to flip
+        :return: bytearray
+        """
+        return bytearray(self.faulty_variant(bit_offsets).tobytes())
+
+    def dump_faulty_bitstream(self, bit_offsets, out_bitstream: str):
+        """
+        NO CRC WRITE, bits in bit_offsets flipped
+        :param bit_offsets:
+        :param out_bitstream:
+        :return:
+        """
+        faulty_bs = self.faulty_variant(bit_offsets)
+        with open(out_bitstream, 'wb') as f_bs_out:
+            faulty_bs.write(f_bs_out)
+
+    def corrupt_bit(self, frame_index: int, bit_offset_in_frame: int, out_bitstream: str):
+        self.dump_faulty_bitstream([frame_index * self.N_WORDS_IN_FRAME * 32 + bit_offset_in_frame],
+                                   out_bitstream)
 
     def dump_bitstream(self, out_bitstream: str):
         """
@@ -353,32 +854,104 @@ class BitstreamMan:
         :return:
         """
         with open(out_bitstream, 'wb') as f_bs_out:
-            previous_word_crc = False
-            f_bs_out.write(self.generate_bitstream_header())
-
-            # FIXME: if FDRI is splitted, this is not working
-            # All the commands before frame RAW data
-            for word_index in range(0, self.frame_word0_index):
-                write_int32_to_file(f_bs_out, self.bs_words[word_index])
-            for i in range(0, self.n_frames * self.N_WORDS_IN_FRAME):
-                word = self.frame_words[i]
-                write_int32_to_file(f_bs_out, word)
-
-            # All the commands after the frame RAW data
-            for word_index in range(self.frame_word_lindex + 1, len(self.bs_words)):
-                word = self.bs_words[word_index]
-                decode_res = decode_bs_word(word)
-                if decode_res['header_type'] == 'PT1' and decode_res['op_code'] == 'W' and \
-                        decode_res['reg'][0].startswith('CRC'):
-                    previous_word_crc = True
-                    write_int32_to_file(f_bs_out, 0x2000_0000)  # NOP
-                    continue
-                else:
-                    if previous_word_crc:
-                        write_int32_to_file(f_bs_out, 0x2000_0000)  # NOP
-                    else:
-                        write_int32_to_file(f_bs_out, self.bs_words[word_index])
-                    previous_word_crc = False
+            f_bs_out.write(self.generate_bitstream_template())
+
+    def set_frame_far(self, frame_l_addr: int, far: int):
+        self.frame_fars[frame_l_addr] = far
+
+    def get_frame_far(self, frame_l_addr: int):
+        if self.frame_map is not None and self.frame_map.known[frame_l_addr]:
+            return int(self.frame_map.far[frame_l_addr])
+        if frame_l_addr not in self.frame_fars:
+            raise ValueError(f"FAR of frame {frame_l_addr} is unknown")
+        return self.frame_fars[frame_l_addr]
+
+    def build_frame_map(self, device_filename: str = None, frame_map_filename: str = None):
+        """
+        Build self.frame_map (see FrameMap.from_bitstream), or load it from frame_map_filename (.npy) if it exists.
+        A frame map built is saved to frame_map_filename.
+        :param device_filename: device description, see load_device_description
+        :param frame_map_filename: cache of the frame map
+        :return: FrameMap
+        """
+        if frame_map_filename is not None and isfile(frame_map_filename):
+            frame_map = FrameMap.load(frame_map_filename)
+            if len(frame_map) == self.n_frames:
+                self.frame_map = frame_map
+                return self.frame_map
+
+        device = load_device_description(device_filename) if device_filename is not None else None
+        self.frame_map = FrameMap.from_bitstream(self, device)
+        if frame_map_filename is not None:
+            self.frame_map.save(frame_map_filename)
+        return self.frame_map
+
+    def register_frame_addresses(self, ll_lst):
+        """
+        Learn the FAR of the frames covered by a Logic Location file
+        :param ll_lst: LogicLocationMan, or list of dict (see load_ll_file)
+        :return:
+        """
+        if not isinstance(ll_lst, list):
+            self.frame_fars.update(ll_lst.frame_fars(self.N_WORDS_IN_FRAME))
+            return
+
+        for bit_dict in ll_lst:
+            self.frame_fars[int(bit_dict['bit_offset'] / (self.N_WORDS_IN_FRAME*32))] = bit_dict['frame_addr']
+
+    def generate_partial_bitstream(self, bit_offsets, frame_l_addrs=None):
+        """
+        Partial bitstream writing only the frames touched by bit_offsets, with those bits flipped.
+        Each frame is written at its FAR (see get_frame_far) followed by a pad frame to flush the frame buffer.
+        With empty bit_offsets and frame_l_addrs, this gives the golden frames (to repair a partial injection).
+        :param bit_offsets: bit offsets (as used by get_bit/set_bit) to flip
+        :param frame_l_addrs: frames to write, by default the ones containing bit_offsets
+        :return: bytes, the partial bitstream with .bit file header
+        """
+        frame_bits = self.N_WORDS_IN_FRAME * 32
+        if frame_l_addrs is None:
+            frame_l_addrs = [int(bit_offset / frame_bits) for bit_offset in bit_offsets]
+        frame_l_addrs = sorted(set(frame_l_addrs))
+
+        assert(self.idcode is not None)
+        partial_words = [0xFFFF_FFFF] * 8 + [
+            0x0000_00BB,  # Bus width detect
+            0x1122_0044,
+            0xFFFF_FFFF,
+            0xFFFF_FFFF,
+            0xAA99_5566,  # SYNC
+            0x2000_0000,  # NOP
+            0x3000_8001, 0x0000_0007,  # CMD RCRC
+            0x2000_0000,  # NOP
+            0x2000_0000,  # NOP
+            0x3001_8001, self.idcode,  # IDCODE
+        ]
+        pad_frame = [0x0000_0000] * self.N_WORDS_IN_FRAME
+        for frame_l_addr in frame_l_addrs:
+            frame_words = [int(word) for word in self.frame_words[frame_l_addr]]
+            for bit_offset in bit_offsets:
+                if int(bit_offset / frame_bits) == frame_l_addr:
+                    _, frame_w_index, frame_w_b_offset = self.bit_offset_to_frame_bit_addr(bit_offset)
+                    frame_words[frame_w_index] ^= 1 << frame_w_b_offset
+
+            partial_words += [
+                0x3000_2001, self.get_frame_far(frame_l_addr),  # FAR
+                0x3000_8001, 0x0000_0001,  # CMD WCFG
+                0x2000_0000,  # NOP
+                0x3000_4000,  # FDRI
+                0x5000_0000 | (2 * self.N_WORDS_IN_FRAME),  # PT2 frame + pad frame
+            ] + frame_words + pad_frame
+
+        partial_words += [
+            0x3000_8001, 0x0000_000D,  # CMD DESYNC
+        ] + [0x2000_0000] * 16  # NOP
+
+        partial_bin = np.array(partial_words, dtype='>u4').tobytes()
+        return self.generate_bitstream_header(bs_bin_len=len(partial_bin)) + partial_bin
+
+    def dump_partial_bitstream(self, bit_offsets, out_bitstream: str, frame_l_addrs=None):
+        with open(out_bitstream, 'wb') as f_bs_out:
+            f_bs_out.write(self.generate_partial_bitstream(bit_offsets, frame_l_addrs))
 
     def frame_bit_addr_to_bit_offset(self, frame_l_addr, frame_w_index, frame_w_b_offset):
         return frame_l_addr * self.N_WORDS_IN_FRAME * 32 + frame_w_index * 32 + frame_w_b_offset
@@ -391,7 +964,7 @@ class BitstreamMan:
 
     def get_bit(self, bit_offset):
         frame_l_addr, frame_w_index, frame_w_b_offset = self.bit_offset_to_frame_bit_addr(bit_offset)
-        frame_word = self.frame_words[frame_l_addr*self.N_WORDS_IN_FRAME + frame_w_index]
+        frame_word = int(self.frame_words[frame_l_addr, frame_w_index])
         if frame_word & (1 << frame_w_b_offset) != 0x0:
             return 1
         else:
@@ -399,82 +972,63 @@ class BitstreamMan:
 
     def set_bit(self, bit_offset, value):
         frame_l_addr, frame_w_index, frame_w_b_offset = self.bit_offset_to_frame_bit_addr(bit_offset)
-        frame_word = self.frame_words[frame_l_addr*self.N_WORDS_IN_FRAME + frame_w_index]
-        if value == 1:
-            frame_word = frame_word | (1 << frame_w_b_offset)
-        else:
-            frame_word = frame_word & (~(1 << frame_w_b_offset))
-        self.frame_words[frame_l_addr*self.N_WORDS_IN_FRAME + frame_w_index] = frame_word
+        with self._bs_template_lock:
+            frame_word = int(self.frame_words[frame_l_addr, frame_w_index])
+            if value == 1:
+                frame_word = frame_word | (1 << frame_w_b_offset)
+            else:
+                frame_word = frame_word & (~(1 << frame_w_b_offset))
+            self.frame_words[frame_l_addr, frame_w_index] = frame_word
+            self._bs_template = None
         return frame_word
 
     def get_word(self, frame_l_addr, frame_w_index):
-        return self.frame_words[frame_l_addr*self.N_WORDS_IN_FRAME + frame_w_index]
+        return int(self.frame_words[frame_l_addr, frame_w_index])
 
     def set_word(self, frame_l_addr, frame_w_index, word_new):
-        self.frame_words[frame_l_addr * self.N_WORDS_IN_FRAME + frame_w_index] = word_new
-
-    def compare_readback_binfile(self, rb_bin_fname: str, b_with_mask: bool = True):
-        with open(rb_bin_fname, "rb") as f_rb_bin:
-            frame_word_index = 0
-            diffs = []
-            # Remove padding frame
-            f_rb_bin.read(4*BitstreamMan.N_WORDS_IN_FRAME)
-
-            for word in self.frame_words:
-                rb_word = read_int32_from_file(f_rb_bin)
-                if b_with_mask and self.mask_bm is not None:
-                    mask_word = self.mask_bm.frame_words[frame_word_index]
-                else:
-                    mask_word = None
-
-                if word != rb_word:
-                    word_diffs = compare_words_32(word, rb_word, mask_word)
-                    if len(word_diffs) != 0:
-                        diffs.append([(frame_word_index, i) for i in word_diffs])
+        with self._bs_template_lock:
+            self.frame_words[frame_l_addr, frame_w_index] = word_new
+            self._bs_template = None
 
-                frame_word_index += 1
-
-            return diffs
-
-
-def load_ll_file(ll_filename: str):
-    assert(isfile(ll_filename))
-    ll_lst = []
-    with open(ll_filename, 'r') as f_ll:
-        for line in f_ll:
-            if not line.startswith("Bit "):
-                continue
-            else:
-                line_parts = [x for x in re.split(" |\t|\n", line) if x != '']
-                bit_offset = int(line_parts[1])
-                frame_addr = int(line_parts[2], 16)
-                frame_b_offset = int(line_parts[3])
-                bit_dict = {
-                    "bit_offset": bit_offset,
-                    "frame_addr": frame_addr,
-                    "frame_b_offset": frame_b_offset
-                }
-
-                bit_props = ','.join(line_parts[4:])
-                bit_dict['props'] = bit_props
-
-                #for i in range(4, len(line_parts)):
-                #    line_part = line_parts[i]
-                #    key, value = re.split("=",  line_part)
-                #    bit_dict[key] = value
-                ll_lst.append(bit_dict)
-
-    return ll_lst
+    def compare_readback_binfile(self, rb_bin_fname: str, b_with_mask: bool = True, b_frame_counts: bool = False):
+        """
+        Compare a readback (.bin, see vivado_readback.tcl) with the frames, bits set in the mask frames are ignored
+        :param rb_bin_fname: readback file, padding frame first
+        :param b_with_mask: ignore the bits masked by mask_bm
+        :param b_frame_counts: also return the number of flipped bits per frame
+        :return: sorted array of the flipped bit offsets (as used by get_bit/set_bit),
+                 (bit offsets, counts per frame) if b_frame_counts
+        """
+        n_frame_words = self.n_frames * self.N_WORDS_IN_FRAME
+        rb_words = np.fromfile(rb_bin_fname, dtype='>u4')
+        if len(rb_words) < self.N_WORDS_IN_FRAME + n_frame_words:
+            raise ValueError(f"{rb_bin_fname} is too short for {self.n_frames} frames")
+
+        # Remove padding frame
+        diff_words = self.frame_words.ravel().astype(np.uint32) ^ \
+            rb_words[self.N_WORDS_IN_FRAME:self.N_WORDS_IN_FRAME + n_frame_words]
+        if b_with_mask and self.mask_bm is not None:
+            diff_words &= ~self.mask_bm.frame_words.ravel()
+
+        diff_word_indices = np.flatnonzero(diff_words)
+        diff_bits = (diff_words[diff_word_indices, None] >> np.arange(32, dtype=np.uint32)) & 0x1
+        word_i, bit_i = np.nonzero(diff_bits)
+        bit_offsets = diff_word_indices[word_i] * 32 + bit_i
+
+        if b_frame_counts:
+            return bit_offsets, np.bincount(bit_offsets // (self.N_WORDS_IN_FRAME * 32), minlength=self.n_frames)
+        else:
+            return bit_offsets
 
 
 if __name__ == '__main__':
-    bman = BitstreamMan(sys.argv[1], sys.argv[2])
+    bman = BitstreamMan(sys.argv[1], sys.argv[2], use_mmap=True, cache_dir=BITSTREAM_CACHE_DIR)
     with open('bit_frame_words.txt', 'w') as f_bit_frame_words:
-        for word in bman.frame_words:
+        for word in bman.frame_words.ravel():
             print(f"{word:08X}", file=f_bit_frame_words)
 
     with open('mask_frame_words.txt', 'w') as f_mask_frame_words:
-        for word in bman.mask_bm.frame_words:
+        for word in bman.mask_bm.frame_words.ravel():
             print(f"{word:08X}", file=f_mask_frame_words)
 
     rbd_diffs = bman.compare_readback_binfile(sys.argv[3])
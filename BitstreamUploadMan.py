@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+import time
+import zlib
+import json
+from threading import Lock
+import requests
+from BitstreamMan import bitstream_payload
+
+"""
+Compressed bitstream uploads to the fault injection servers (BNN_FI_Server)
+"""
+
+
+class BitstreamUploadMan:
+    """
+    Helper (Man) class compressing the bitstream uploads for the servers supporting it.
+    The encodings of a server are read once from its /capabilities, older servers without it get raw uploads.
+    """
+
+    def __init__(self, encoding: str = 'zlib', level: int = 1):
+        """
+        :param encoding: 'zlib' or 'gzip'
+        :param level: compression level, the frames are mostly zeros so 1 already compresses well
+        """
+        assert encoding in ('zlib', 'gzip')
+        self.encoding = encoding
+        self.level = level
+        self.server_encodings_dict = {}
+        self.server_encodings_lock = Lock()
+
+    def server_encodings(self, server_url: str, session: requests.Session = None, timeout: float = 5):
+        """
+        :param session: of the caller, requests.get if None
+        :return: encodings accepted by the /fault_inj of server_url, [] for older servers
+        """
+        with self.server_encodings_lock:
+            if server_url in self.server_encodings_dict:
+                return self.server_encodings_dict[server_url]
+
+        try:
+            r = (requests if session is None else session).get(server_url + '/capabilities', timeout=timeout)
+            if r.status_code == 200:
+                encodings = r.json().get('encodings', [])
+            elif r.status_code == 404:
+                encodings = []
+            else:
+                # ask again on the next upload
+                return []
+        except requests.RequestException:
+            return []
+
+        with self.server_encodings_lock:
+            self.server_encodings_dict[server_url] = encodings
+        return encodings
+
+    def set_server_encodings(self, server_url: str, encodings: list):
+        """Encodings of server_url read by the caller from its /capabilities"""
+        with self.server_encodings_lock:
+            self.server_encodings_dict[server_url] = encodings
+
+    def known_encodings(self, server_url: str):
+        """:return: encodings of server_url if already negotiated, None otherwise (no request)"""
+        with self.server_encodings_lock:
+            return self.server_encodings_dict.get(server_url)
+
+    def forget_server(self, server_url: str):
+        """Negotiate again with server_url, e.g. after it was updated or rebooted"""
+        with self.server_encodings_lock:
+            self.server_encodings_dict.pop(server_url, None)
+
+    def encode(self, server_url: str, bitstreams: dict, session: requests.Session = None, timeout: float = 5):
+        """
+        :param bitstreams: form field -> bitstream (file name, FaultyBitstream or bytes-like)
+        :param session, timeout: for the /capabilities request, see server_encodings
+        :return: files and data for requests.post(server_url + '/fault_inj'), upload stats for upload_report()
+        """
+        encoding = self.encoding if self.encoding in self.server_encodings(server_url, session, timeout) else None
+        files = {}
+        data = {}
+        stats = {
+            'encoding': encoding,
+            'raw_bytes': 0,
+            'sent_bytes': 0,
+            'encode_duration': 0
+        }
+        for field, bitstream in bitstreams.items():
+            payload = bitstream_payload(bitstream)
+            stats['raw_bytes'] += len(payload)
+            if encoding is not None:
+                ts_start = time.time()
+                compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+                payload = compressor.compress(payload) + compressor.flush()
+                stats['encode_duration'] += time.time() - ts_start
+            stats['sent_bytes'] += len(payload)
+            files[field] = (field + '.bit', payload)
+
+        if encoding is not None:
+            data['encoding'] = encoding
+        return files, data, stats
+
+    @staticmethod
+    def upload_report(stats: dict, upload_duration: float, server_duration: float = None):
+        """
+        :param upload_duration: duration of the request with the encoded bitstreams
+        :param server_duration: time spent by the server after receiving them (decoding, run start), from its reply;
+                                the rest of the request is the transfer
+        :return: report of the bytes saved by the encoding, and of the time saved: the bytes saved at the measured
+                 transfer throughput, minus the encoding time (not estimated without server_duration)
+        """
+        raw_bytes = stats['raw_bytes']
+        sent_bytes = stats['sent_bytes']
+        if stats['encoding'] is None or sent_bytes == 0:
+            return f'upload {raw_bytes} bytes (raw) in {upload_duration:.3f}s'
+
+        report = f'upload {raw_bytes} -> {sent_bytes} bytes ({stats["encoding"]}, {raw_bytes - sent_bytes} saved) ' \
+                 f'in {upload_duration:.3f}s + {stats["encode_duration"]:.3f}s encoding'
+        transfer_duration = upload_duration - server_duration if server_duration is not None else 0
+        if transfer_duration > 0:
+            throughput = sent_bytes / transfer_duration
+            time_saved = (raw_bytes - sent_bytes) / throughput - stats['encode_duration']
+            report += f', {transfer_duration:.3f}s transfer ({throughput / 1e6:.1f} MB/s), ~{time_saved:.3f}s saved'
+        return report
+
+    @staticmethod
+    def server_duration(status_code: int, body: bytes):
+        """:return: server_duration of a /fault_inj reply (see upload_report), None for older servers or errors"""
+        if status_code != 200:
+            return None
+        try:
+            return json.loads(body).get('server_duration')
+        except (ValueError, AttributeError):
+            return None
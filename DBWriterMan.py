@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+import sqlite3
+import time
+import logging
+from threading import Thread, Lock, Condition
+
+"""
+Write-behind updates of the sqlite3 fault injection result tables
+"""
+
+
+class DBWriterMan:
+    """
+    Helper (Man) class for write-behind updates of a sqlite3 table with a primary key.
+    put() only merges the record in memory. A writer thread applies the pending records with UPSERTs in a single
+    transaction every flush_interval seconds, or as soon as max_pending records are waiting, so a crash loses
+    at most the records of the last flush_interval seconds (max_pending records).
+    The records of a failed transaction are kept for the next one; while the writes fail, put() blocks once
+    max_buffered records are waiting and then raises the error, as flush() does.
+    The database is switched to WAL, readers on other connections are not blocked by the writer.
+    """
+
+    def __init__(self, db_filename: str, table: str, key: str, columns: tuple, insert_defaults: dict = None,
+                 flush_interval: float = 1.0, max_pending: int = 1000, max_buffered: int = 10000):
+        """
+        :param table: table to update, it must exist
+        :param key: primary key column
+        :param columns: other columns put() may set
+        :param insert_defaults: column -> SQL value of the new rows for which put() gave no value
+        :param flush_interval: seconds between two transactions
+        :param max_pending: records waiting before a transaction is started early
+        :param max_buffered: records waiting before put() blocks
+        """
+        self.table = table
+        self.key = key
+        self.columns = tuple(columns)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_buffered = max(max_buffered, max_pending)
+        self.logger = logging.getLogger('DBWriterMan')
+
+        self.db_conn = sqlite3.connect(db_filename, check_same_thread=False)
+        self.db_conn.execute('PRAGMA journal_mode=WAL')
+        # WAL commits are not synced one by one, the database stays consistent on power loss
+        self.db_conn.execute('PRAGMA synchronous=NORMAL')
+
+        # None keeps the value of an existing row (the previous behaviour of the update functions)
+        insert_defaults = {} if insert_defaults is None else insert_defaults
+        values_lst = ['?1'] + [f'COALESCE(?{i + 2}, {insert_defaults[c]})' if c in insert_defaults else f'?{i + 2}'
+                               for i, c in enumerate(self.columns)]
+        self.upsert_sql = f'INSERT INTO {table} ({key}, {", ".join(self.columns)}) ' \
+                          f'VALUES ({", ".join(values_lst)}) ' \
+                          f'ON CONFLICT({key}) DO UPDATE SET ' + \
+                          ', '.join([f'{c}=COALESCE(?{i + 2}, {c})' for i, c in enumerate(self.columns)])
+
+        self.pending = {}    # key -> merged record, not written yet
+        # exception of the last transaction, None if it succeeded
+        self.write_error = None
+        self.pending_cond = Condition()
+        self.write_lock = Lock()
+        self.closed = False
+        self.n_records = 0
+        self.n_transactions = 0
+
+        self.writer_thread = Thread(target=self.write_loop, daemon=True)
+        self.writer_thread.start()
+
+    def put(self, key, **values):
+        """
+        Insert or update the row of key, a None value leaves the column unchanged
+        """
+        assert(not self.closed)
+        with self.pending_cond:
+            while len(self.pending) >= self.max_buffered and key not in self.pending:
+                if self.write_error is not None:
+                    raise self.write_error
+                self.pending_cond.notify_all()
+                self.pending_cond.wait()
+            record = self.pending.setdefault(key, {})
+            record.update({c: v for c, v in values.items() if v is not None})
+            if len(self.pending) >= self.max_pending:
+                self.pending_cond.notify()
+
+    def write_pending(self):
+        """
+        Write the pending records in one transaction
+        :raise sqlite3.Error: if the transaction failed, its records are pending again
+        """
+        with self.write_lock:
+            with self.pending_cond:
+                if len(self.pending) == 0:
+                    return
+                records, self.pending = self.pending, {}
+                # room for put()
+                self.pending_cond.notify_all()
+
+            ts_start = time.time()
+            try:
+                with self.db_conn:
+                    self.db_conn.executemany(self.upsert_sql,
+                                             [(key, *[record.get(c) for c in self.columns])
+                                              for key, record in records.items()])
+            except sqlite3.Error as exp:
+                with self.pending_cond:
+                    # the values put() meanwhile are newer
+                    for key, record in records.items():
+                        record.update(self.pending.get(key, {}))
+                        self.pending[key] = record
+                    self.write_error = exp
+                    self.pending_cond.notify_all()
+                raise
+
+            self.n_records += len(records)
+            self.n_transactions += 1
+            self.logger.debug(f'{self.table}: {len(records)} records in {time.time() - ts_start:.3f}s')
+            with self.pending_cond:
+                self.write_error = None
+
+    def write_loop(self):
+        while True:
+            with self.pending_cond:
+                if self.closed:
+                    break
+                if len(self.pending) < self.max_pending:
+                    self.pending_cond.wait(timeout=self.flush_interval)
+            try:
+                self.write_pending()
+            except sqlite3.Error as exp:
+                # retried on the next flush_interval, keep the writer alive
+                self.logger.error(f'{self.table}: write failed with {exp}')
+                with self.pending_cond:
+                    if not self.closed:
+                        self.pending_cond.wait(timeout=self.flush_interval)
+
+    def flush(self):
+        """
+        Write the pending records now
+        :raise sqlite3.Error: if the transaction failed
+        """
+        self.write_pending()
+
+    def close(self):
+        """Write the pending records and stop the writer thread"""
+        with self.pending_cond:
+            self.closed = True
+            self.pending_cond.notify()
+        self.writer_thread.join()
+        self.write_pending()
+        self.db_conn.close()
+        self.logger.info(f'{self.table}: {self.n_records} records in {self.n_transactions} transactions')
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+import sys
+import re
+from os.path import isfile, isdir
+from array import array
+import numpy as np
+from BitstreamMan import cache_entry_dir, save_cache_entry, load_cache_entry
+
+"""
+Logic Location (.ll) files, as columns of numpy arrays
+"""
+
+
+class LogicLocationMan:
+    """
+    Helper (Man) class for the bits of a Logic Location file.
+    Each bit is a row of the columns bit_offset, frame_addr, frame_b_offset and props_id (index in props),
+    in the order of the file. bit_offset is the bit offset used by BitstreamMan.get_bit/set_bit.
+
+    The bits can be selected by property (Block=SLICE_X12Y40, Latch=AQ, Net=..., Ram=...) with select()
+    and the results combined with numpy set algebra (np.intersect1d, np.union1d, np.setdiff1d).
+    """
+
+    def __init__(self, ll_filename: str, cache_dir: str = None):
+        """
+        :param ll_filename: Logic Location file (.ll)
+        :param cache_dir: keep the parsed file there, see BitstreamMan.cache_entry_dir
+        """
+        assert(isfile(ll_filename))
+        self.ll_filename = ll_filename
+        self.cache_dir = cache_dir
+        self._props_index = None
+        cache_entry = cache_entry_dir(cache_dir, 'll', ll_filename) if cache_dir is not None else None
+        if cache_entry is not None and isdir(cache_entry):
+            meta, arrays = load_cache_entry(cache_entry)
+            self.props = meta['props']
+            self.bit_offset = arrays['bit_offset']
+            self.frame_addr = arrays['frame_addr']
+            self.frame_b_offset = arrays['frame_b_offset']
+            self.props_id = arrays['props_id']
+        else:
+            self.read_ll_file()
+            if cache_entry is not None:
+                save_cache_entry(cache_entry,
+                                 {'props': self.props},
+                                 {'bit_offset': self.bit_offset,
+                                  'frame_addr': self.frame_addr,
+                                  'frame_b_offset': self.frame_b_offset,
+                                  'props_id': self.props_id})
+
+        # membership bitmap, bit b is set if b is in bit_offset
+        self.n_bits = int(self.bit_offset.max()) + 1 if len(self.bit_offset) != 0 else 0
+        bits = np.zeros(self.n_bits, dtype=bool)
+        bits[self.bit_offset] = True
+        self.bitmap = np.packbits(bits, bitorder='little')
+
+    def read_ll_file(self):
+        """Parse the file line by line into the columns, props strings are interned"""
+        bit_offset = array('q')
+        frame_addr = array('L')
+        frame_b_offset = array('L')
+        props_id = array('L')
+        props_ids = {}
+        with open(self.ll_filename, 'r') as f_ll:
+            for line in f_ll:
+                if not line.startswith("Bit "):
+                    continue
+                line_parts = line.split()
+                bit_offset.append(int(line_parts[1]))
+                frame_addr.append(int(line_parts[2], 16))
+                frame_b_offset.append(int(line_parts[3]))
+                props_id.append(props_ids.setdefault(','.join(line_parts[4:]), len(props_ids)))
+
+        self.props = list(props_ids.keys())
+        self.bit_offset = np.array(bit_offset, dtype=np.int64)
+        self.frame_addr = np.array(frame_addr, dtype=np.uint32)
+        self.frame_b_offset = np.array(frame_b_offset, dtype=np.uint32)
+        self.props_id = np.array(props_id, dtype=np.uint32)
+
+    def __len__(self):
+        return len(self.bit_offset)
+
+    def __contains__(self, bit_offset):
+        return 0 <= bit_offset < self.n_bits and bool((self.bitmap[bit_offset >> 3] >> (bit_offset & 7)) & 1)
+
+    def contains(self, bit_offsets):
+        """
+        :param bit_offsets: array of bit offsets
+        :return: bool array, True for the bit offsets in the file
+        """
+        bit_offsets = np.asarray(bit_offsets, dtype=np.int64)
+        in_range = (bit_offsets >= 0) & (bit_offsets < self.n_bits)
+        result = np.zeros(bit_offsets.shape, dtype=bool)
+        in_bits = bit_offsets[in_range]
+        result[in_range] = (self.bitmap[in_bits >> 3] >> (in_bits & 7).astype(np.uint8)) & 1 == 1
+        return result
+
+    @property
+    def props_index(self):
+        """
+        Inverted index of the properties: key -> value -> sorted array of bit offsets.
+        Built on first use, and kept in cache_dir. The arrays are read-only, shared with the select() results
+        """
+        if self._props_index is not None:
+            return self._props_index
+
+        cache_entry = cache_entry_dir(self.cache_dir, 'llprops', self.ll_filename) \
+            if self.cache_dir is not None else None
+        if cache_entry is not None and isdir(cache_entry):
+            meta, arrays = load_cache_entry(cache_entry)
+            self._props_index = {}
+            for key_i, (key, values) in enumerate(zip(meta['keys'], meta['values'])):
+                bits = arrays[f'bits_{key_i}']
+                ends = arrays[f'ends_{key_i}'].tolist()
+                bits.setflags(write=False)
+                self._props_index[key] = {value: bits[start:end]
+                                          for value, start, end in zip(values, [0] + ends[:-1], ends)}
+            return self._props_index
+
+        self._props_index = self.build_props_index()
+        for values in self._props_index.values():
+            for bits in values.values():
+                bits.setflags(write=False)
+        if cache_entry is not None:
+            keys = list(self._props_index.keys())
+            arrays = {}
+            for key_i, key in enumerate(keys):
+                value_bits = list(self._props_index[key].values())
+                arrays[f'bits_{key_i}'] = np.concatenate(value_bits)
+                arrays[f'ends_{key_i}'] = np.cumsum([len(x) for x in value_bits], dtype=np.int64)
+            save_cache_entry(cache_entry,
+                             {'keys': keys,
+                              'values': [list(self._props_index[key].keys()) for key in keys]},
+                             arrays)
+        return self._props_index
+
+    def build_props_index(self):
+        """
+        Parse the props (key=value, comma separated) of the file, each distinct props string only once
+        :return: key -> value -> sorted array of bit offsets
+        """
+        bits_by_props_order = np.argsort(self.props_id, kind='stable')
+        bits_by_props = self.bit_offset[bits_by_props_order]
+        props_bounds = np.searchsorted(self.props_id[bits_by_props_order], np.arange(len(self.props) + 1))
+
+        props_ids_index = {}
+        for props_id, props in enumerate(self.props):
+            for prop in props.split(','):
+                if prop == '':
+                    continue
+                key, _, value = prop.partition('=')
+                props_ids_index.setdefault(key, {}).setdefault(value, []).append(props_id)
+
+        return {key: {value: np.unique(np.concatenate([bits_by_props[props_bounds[props_id]:props_bounds[props_id + 1]]
+                                                     for props_id in props_ids]))
+                      for value, props_ids in values.items()}
+                for key, values in props_ids_index.items()}
+
+    def select(self, key: str, value: str = None, pattern: str = None):
+        """
+        Bits by property, e.g. select('Block', 'SLICE_X12Y40') or select('Block', pattern='RAMB36_X0Y0')
+        :param key: property key
+        :param value: property value, None for any value
+        :param pattern: regular expression the whole value must match (instead of value)
+        :return: sorted array of bit offsets, read-only (copy() it to modify)
+        """
+        values = self.props_index.get(key, {})
+        if value is not None:
+            return values.get(value, np.zeros(0, dtype=np.int64))
+        if pattern is not None:
+            pattern_re = re.compile(pattern)
+            values = {v: bits for v, bits in values.items() if pattern_re.fullmatch(v)}
+        if len(values) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(list(values.values())))
+
+    def select_all(self, **props):
+        """
+        Bits having all the properties, e.g. select_all(Block='RAMB36_X0Y0', Ram=None)
+        :param props: key=value, None for any value
+        :return: sorted array of bit offsets, read-only as select() for a single key=value
+        """
+        bits = None
+        for key, value in props.items():
+            key_bits = self.select(key, value)
+            bits = key_bits if bits is None else np.intersect1d(bits, key_bits, assume_unique=True)
+        return bits if bits is not None else np.unique(self.bit_offset)
+
+    def frame_fars(self, n_words_in_frame: int = 101):
+        """:return: frame logical address -> FAR, for the frames covered by the file"""
+        frame_l_addrs, first_bits = np.unique(self.bit_offset // (n_words_in_frame * 32), return_index=True)
+        return dict(zip(frame_l_addrs.tolist(), self.frame_addr[first_bits].tolist()))
+
+    def to_list(self):
+        """:return: list of dict (bit_offset, frame_addr, frame_b_offset, props), as load_ll_file"""
+        props = self.props
+        return [{"bit_offset": bit_offset,
+                 "frame_addr": frame_addr,
+                 "frame_b_offset": frame_b_offset,
+                 "props": props[props_id]}
+                for bit_offset, frame_addr, frame_b_offset, props_id in zip(self.bit_offset.tolist(),
+                                                                            self.frame_addr.tolist(),
+                                                                            self.frame_b_offset.tolist(),
+                                                                            self.props_id.tolist())]
+
+
+def load_ll_file(ll_filename: str, cache_dir: str = None):
+    """
+    :param ll_filename: Logic Location file (.ll)
+    :param cache_dir: keep the parsed file there, see BitstreamMan.cache_entry_dir
+    :return: list of dict (bit_offset, frame_addr, frame_b_offset, props)
+    """
+    return LogicLocationMan(ll_filename, cache_dir).to_list()
+
+
+if __name__ == '__main__':
+    # LogicLocationMan.py file.ll [key=value ...]
+    llman = LogicLocationMan(sys.argv[1])
+    print(f'{len(llman)} bits, {len(llman.props)} distinct props, {len(llman.frame_fars())} frames')
+    if len(sys.argv) > 2:
+        query = {}
+        for arg in sys.argv[2:]:
+            key, _, value = arg.partition('=')
+            query[key] = value if value != '' else None
+        print(f'{len(llman.select_all(**query))} bits with {query}')
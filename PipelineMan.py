@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import time
+from collections import deque
+from threading import Condition, Lock
+
+"""
+Bounded queues between the stages of the fault injection pipeline (generate -> upload -> collect)
+"""
+
+
+class QueueClosed(Exception):
+    """The queue is closed (and drained, for get)"""
+    pass
+
+
+class StageQueue:
+    """
+    Bounded blocking FIFO between two pipeline stages.
+    put() blocks while the queue is full, get() while it is empty, both are woken up by the other side or by
+    close()/abort(). The time spent blocked on each side (stall) and the depth are kept for stats().
+    """
+
+    def __init__(self, name: str, maxsize: int):
+        self.name = name
+        self.maxsize = maxsize
+        self.items = deque()
+        self.lock = Lock()
+        self.not_empty = Condition(self.lock)
+        self.not_full = Condition(self.lock)
+        self.closed = False
+        self.n_put = 0
+        self.n_get = 0
+        self.max_depth = 0
+        self.put_stall = 0.0  # producers waiting for room
+        self.get_stall = 0.0  # consumers waiting for items
+
+    def put(self, item):
+        """:raise QueueClosed: if the queue is closed"""
+        with self.not_full:
+            if len(self.items) >= self.maxsize and not self.closed:
+                ts_start = time.time()
+                try:
+                    while len(self.items) >= self.maxsize and not self.closed:
+                        self.not_full.wait()
+                finally:
+                    self.put_stall += time.time() - ts_start
+            if self.closed:
+                raise QueueClosed(self.name)
+            self.items.append(item)
+            self.n_put += 1
+            self.max_depth = max(self.max_depth, len(self.items))
+            self.not_empty.notify()
+
+    def get(self):
+        """:raise QueueClosed: if the queue is closed and all its items were taken"""
+        with self.not_empty:
+            if len(self.items) == 0 and not self.closed:
+                ts_start = time.time()
+                try:
+                    while len(self.items) == 0 and not self.closed:
+                        self.not_empty.wait()
+                finally:
+                    self.get_stall += time.time() - ts_start
+            if len(self.items) == 0:
+                raise QueueClosed(self.name)
+            item = self.items.popleft()
+            self.n_get += 1
+            self.not_full.notify()
+            return item
+
+    def close(self):
+        """No more put(), the consumers take the remaining items"""
+        with self.lock:
+            self.closed = True
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+
+    def abort(self):
+        """close() and drop the remaining items"""
+        with self.lock:
+            self.items.clear()
+        self.close()
+
+    def __len__(self):
+        return len(self.items)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'name': self.name,
+                'depth': len(self.items),
+                'maxsize': self.maxsize,
+                'max_depth': self.max_depth,
+                'n_put': self.n_put,
+                'n_get': self.n_get,
+                'put_stall': self.put_stall,
+                'get_stall': self.get_stall
+            }
+
+
+def stats_report(stage_queues):
+    """:return: one line per queue, depth and stall times"""
+    return '\n'.join([f'{s["name"]}: depth {s["depth"]}/{s["maxsize"]} (max {s["max_depth"]}), '
+                      f'{s["n_put"]} in, {s["n_get"]} out, '
+                      f'producers stalled {s["put_stall"]:.1f}s, consumers stalled {s["get_stall"]:.1f}s'
+                      for s in [q.stats() for q in stage_queues]])
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import logging
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from BitstreamMan import BitstreamMan, FRAME_MAP_UNKNOWN, BITSTREAM_CACHE_DIR
+from LogicLocationMan import LogicLocationMan
+from BNN_FaultDBMan import BNN_FaultDBMan
+
+"""
+Batch comparison of readbacks (see vivado_readback.tcl) with the golden bitstream and mask
+"""
+
+logger = logging.getLogger('ReadbackMan')
+
+# golden bitstream of the worker process, see init_readback_worker
+worker_bman = None
+
+
+def init_readback_worker(bitstream_file: str, mask_file: str):
+    global worker_bman
+    # mmap: the workers share the golden and mask pages through the page cache
+    worker_bman = BitstreamMan(bitstream_file, mask_file, use_mmap=True)
+
+
+def compare_readback_worker(rb_bin_fname: str):
+    return rb_bin_fname, worker_bman.compare_readback_binfile(rb_bin_fname)
+
+
+def list_readback_files(rb_dir: str):
+    return [os.path.join(rb_dir, fname) for fname in sorted(os.listdir(rb_dir)) if fname.endswith('.bin')]
+
+
+def readback_frame_map(bitstream_file: str, ll_filename: str = None, device_filename: str = None):
+    """
+    :return: FrameMap of the golden bitstream, the FARs of the frames covered by the Logic Location file known
+    """
+    bman = BitstreamMan(bitstream_file, use_mmap=True)
+    if ll_filename is not None:
+        bman.register_frame_addresses(LogicLocationMan(ll_filename, cache_dir=BITSTREAM_CACHE_DIR))
+    return bman.build_frame_map(device_filename)
+
+
+def compare_readbacks(bitstream_file: str, mask_file: str, rb_files, db_man: BNN_FaultDBMan, n_workers: int = None,
+                      ll_filename: str = None, device_filename: str = None):
+    """
+    Compare readbacks with the golden bitstream in a process pool and record their upsets in the fault database.
+    Readbacks already recorded are skipped, so an interrupted batch can be run again.
+    A readback that cannot be compared (short, still being written) is logged and left for the next batch.
+    :param rb_files: directory of .bin readbacks, or iterable of readback files (consumed as it goes)
+    :param db_man: fault database, written by the calling process only
+    :param n_workers: number of processes, os.cpu_count() by default
+    :param ll_filename, device_filename: FARs of the frames (see readback_frame_map), the frame_addr of the upsets
+                                         in frames of unknown FAR is NULL
+    :return: number of readbacks processed (failed ones excluded)
+    """
+    if isinstance(rb_files, str):
+        rb_files = list_readback_files(rb_files)
+
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    n_frame_bits = BitstreamMan.N_WORDS_IN_FRAME * 32
+    frame_map = readback_frame_map(bitstream_file, ll_filename, device_filename)
+    processed = db_man.get_processed_readbacks()
+    n_processed = 0
+
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             initializer=init_readback_worker,
+                             initargs=(bitstream_file, mask_file)) as executor:
+        # future -> readback file
+        pending = {}
+
+        def record_done(done):
+            nonlocal n_processed
+            for future in done:
+                rb_file = pending.pop(future)
+                try:
+                    rb_file, bit_offsets = future.result()
+                except Exception as exp:
+                    logger.error(f'{rb_file}: {exp}')
+                    continue
+                fars = frame_map.frame_to_far(bit_offsets // n_frame_bits)
+                db_man.add_readback_upsets(rb_file, bit_offsets,
+                                           [None if far == FRAME_MAP_UNKNOWN else far for far in fars.tolist()],
+                                           bit_offsets % n_frame_bits)
+                n_processed += 1
+                logger.info(f'{rb_file}: {len(bit_offsets)} upsets')
+
+        for rb_file in rb_files:
+            rb_file = os.path.realpath(rb_file)
+            if rb_file in processed:
+                continue
+            processed.add(rb_file)
+
+            # Bounded number of readbacks in flight, rb_files can be an endless stream
+            if len(pending) >= 2 * n_workers:
+                done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+                record_done(done)
+            pending[executor.submit(compare_readback_worker, rb_file)] = rb_file
+
+        done, not_done = wait(pending)
+        record_done(done)
+
+    return n_processed
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(name)s:[%(levelname)s]: %(message)s')
+    # ReadbackMan.py golden.bit mask.msk readback_dir [db [golden.ll [device.json]]]
+    db_man = BNN_FaultDBMan(sys.argv[4] if len(sys.argv) > 4 else 'bnn_readbacks.db')
+    n = compare_readbacks(sys.argv[1], sys.argv[2], sys.argv[3], db_man,
+                          ll_filename=sys.argv[5] if len(sys.argv) > 5 else None,
+                          device_filename=sys.argv[6] if len(sys.argv) > 6 else None)
+    print(f'{n} readbacks processed')
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import random
+import struct
+import pytest
+
+"""
+Synthetic bitstreams and Logic Location files for the tests: the sync/IDCODE preamble of a 7z020 bitstream,
+the frames in one FDRI burst (two with a FAR write in between if split), then the usual trailer
+"""
+
+N_WORDS_IN_FRAME = 101
+IDCODE = 0x0372_7093
+# FAR of the frame 0 in the Logic Location files
+FIRST_FAR = 0x400
+
+
+def write_bitstream(bs_filename: str, n_frames: int, seed: int = 1, split: bool = False,
+                    frame_words: list = None, crc: bool = True):
+    """
+    :param frame_words: the words of the frames, random (from seed) by default
+    :param crc: False: NOPs instead of the CRC write, as BitstreamMan.dump_bitstream writes it
+    :return: the frame words, as written
+    """
+    rnd = random.Random(seed)
+    words = [0xFFFF_FFFF] * 8 + [
+        0x0000_00BB, 0x1122_0044, 0xFFFF_FFFF, 0xFFFF_FFFF,
+        0xAA99_5566, 0x2000_0000,  # SYNC, NOP
+        0x3002_2001, 0x0000_0000, 0x3002_0001, 0x0000_0000,
+        0x3000_8001, 0x0000_0007, 0x2000_0000, 0x2000_0000,  # CMD RCRC
+        0x3001_8001, IDCODE,
+        0x3000_8001, 0x0000_0009, 0x2000_0000, 0x3000_C001, 0x0000_0401,
+        0x3000_2001, 0x0000_0000,  # FAR
+        0x3000_8001, 0x0000_0001, 0x2000_0000,  # CMD WCFG
+    ]
+    if frame_words is None:
+        frame_words = [rnd.getrandbits(32) if rnd.random() < 0.3 else 0 for _ in range(n_frames * N_WORDS_IN_FRAME)]
+    if split:
+        n_words = (n_frames // 2) * N_WORDS_IN_FRAME
+        words += [0x3000_4000, 0x5000_0000 | n_words] + frame_words[:n_words]
+        words += [0x3000_2001, 0x0042_0000,
+                  0x3000_4000, 0x5000_0000 | (len(frame_words) - n_words)] + frame_words[n_words:]
+    else:
+        words += [0x3000_4000, 0x5000_0000 | len(frame_words)] + frame_words
+    # CRC
+    words += [0x3000_0001, 0xDEAD_BEEF] if crc else [0x2000_0000, 0x2000_0000]
+    words += [0x3000_8001, 0x0000_000A, 0x2000_0000, 0x3000_8001, 0x0000_0003] + [0x2000_0000] * 20
+    words += [0x3000_8001, 0x0000_0005, 0x2000_0000, 0x3000_2001, 0x03BE_0000,
+              0x3000_C001, 0x0000_0501, 0x3000_8001, 0x0000_000D] + [0x2000_0000] * 4
+
+    payload = b''.join(struct.pack('>I', word) for word in words)
+    header = struct.pack('>H', 9) + bytes.fromhex('0ff00ff00ff00ff000') + struct.pack('>H', 1)
+    for field, value in ((0x61, 'design;UserID=0XFFFFFFFF\0'), (0x62, '7z020clg400\0'),
+                         (0x63, '2020/01/01\0'), (0x64, '12:00:00\0')):
+        header += bytes([field]) + struct.pack('>H', len(value)) + value.encode()
+    header += bytes([0x65]) + struct.pack('>I', len(payload))
+    with open(bs_filename, 'wb') as f_bs:
+        f_bs.write(header + payload)
+    return frame_words
+
+
+def write_ll_file(ll_filename: str, frame_l_addrs, n_frame_bits: int = 20, seed: int = 1):
+    """Logic Location file with n_frame_bits bits in each of frame_l_addrs, the FAR of frame i is FIRST_FAR + i"""
+    rnd = random.Random(seed)
+    frame_bits = N_WORDS_IN_FRAME * 32
+    with open(ll_filename, 'w') as f_ll:
+        f_ll.write('Revision 3\n; Created by bitgen\n')
+        for frame_l_addr in frame_l_addrs:
+            for frame_b_offset in sorted(rnd.sample(range(frame_bits), n_frame_bits)):
+                if rnd.random() < 0.7:
+                    props = f'Block=SLICE_X{rnd.randrange(20)}Y{rnd.randrange(50)} ' \
+                            f'Latch={rnd.choice("ABCD")}Q Net=n{rnd.randrange(500)}'
+                else:
+                    props = f'Block=RAMB36_X{rnd.randrange(3)}Y{rnd.randrange(10)} Ram=B:BIT{rnd.randrange(32768)}'
+                f_ll.write(f'Bit {frame_l_addr * frame_bits + frame_b_offset:8d} '
+                           f'0x{FIRST_FAR + frame_l_addr:08x} {frame_b_offset:5d} {props}\n')
+
+
+@pytest.fixture
+def golden_bitstream(tmp_path):
+    """200 frames golden bitstream"""
+    bs_filename = str(tmp_path / 'golden.bit')
+    write_bitstream(bs_filename, 200)
+    return bs_filename
+
+
+@pytest.fixture
+def golden_ll(tmp_path):
+    """Logic Location file of golden_bitstream, the last 10 frames are not in it"""
+    ll_filename = str(tmp_path / 'golden.ll')
+    write_ll_file(ll_filename, range(190))
+    return ll_filename
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+from BNN_FaultDBMan import BNN_FaultDBMan, pack_fault_bits
+from BNN_CampaignMan import BNN_CampaignMan
+
+"""
+Tests of BNN_CampaignMan: a campaign resumed after a crash plans the same faults as an uninterrupted one
+"""
+
+N_BITS = 1 << 16
+
+
+def plan_faults(campaign: BNN_CampaignMan, n_faults: int = None):
+    """Plans random single-bit faults until the campaign is done, or n_faults are planned"""
+    while not campaign.is_done() and (n_faults is None or campaign.n_planned < n_faults):
+        campaign.plan([campaign.random.randrange(N_BITS)], props='RANDOM')
+
+
+def planned_faults(db_man: BNN_FaultDBMan):
+    return sorted(pack_fault_bits(fault['bits']) for fault in db_man.get_all_faults())
+
+
+def test_campaign_resume(tmp_path):
+    # uninterrupted campaign
+    db_man = BNN_FaultDBMan(str(tmp_path / 'faults.db'))
+    campaign = BNN_CampaignMan(db_man, str(tmp_path / 'campaign.json'), 50, seed=7)
+    plan_faults(campaign)
+    campaign.close()
+    expected = planned_faults(db_man)
+    db_man.close()
+    assert len(expected) == 50
+
+    # the coordinator dies after the checkpoint of the 10th fault, with 20 faults in the database
+    db_filename = str(tmp_path / 'resumed_faults.db')
+    checkpoint_filename = str(tmp_path / 'resumed_campaign.json')
+    db_man = BNN_FaultDBMan(db_filename)
+    campaign = BNN_CampaignMan(db_man, checkpoint_filename, 50, seed=7, checkpoint_interval=3600)
+    plan_faults(campaign, 10)
+    campaign.checkpoint()
+    plan_faults(campaign, 20)
+    unexecuted = db_man.get_unexecuted_fault_bits()
+    for bits in unexecuted[:5]:
+        campaign.complete(bits, class_index=1, class_duration=0.1)
+    for bits in unexecuted[5:8]:
+        campaign.lease(bits)
+    db_man.close()
+
+    db_man = BNN_FaultDBMan(db_filename)
+    campaign = BNN_CampaignMan(db_man, checkpoint_filename, 50, seed=123)
+    assert campaign.seed == 7
+    assert campaign.n_planned == 20
+    # the leased faults are re-queued too
+    assert campaign.pending_faults() == unexecuted[5:]
+    plan_faults(campaign)
+    campaign.close()
+    assert planned_faults(db_man) == expected
+    db_man.close()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import random
+import sqlite3
+import pytest
+from BitstreamMan import BitstreamMan
+from BNN_FaultDBMan import BNN_FaultDBMan, BNN_FaultInjMan, FaultSet, pack_fault_bits
+from BNN_FaultDBMan import FAULT_PENDING, FAULT_EXECUTED, FAULT_LEASED
+
+"""
+Tests of BNN_FaultDBMan and of the fault generation of BNN_FaultInjMan, on the synthetic bitstreams of conftest.py
+"""
+
+
+def fault_set_state(fault_set: FaultSet):
+    """:return: comparable content of fault_set, trailing empty bitmap bytes ignored"""
+    return fault_set.bitmap.tobytes().rstrip(b'\0'), sorted(fault_set.multi_bits)
+
+
+def test_fault_set():
+    fault_set = FaultSet()
+    for bits in ([3], [1 << 20], [5, 2], [2, 5, 9]):
+        fault_set.add(pack_fault_bits(bits))
+    assert len(fault_set) == 4
+    assert pack_fault_bits([1 << 20]) in fault_set
+    assert pack_fault_bits('5-2') in fault_set
+    assert pack_fault_bits([4]) not in fault_set
+    assert pack_fault_bits([1 << 30]) not in fault_set
+    fault_set.discard(pack_fault_bits([3]))
+    fault_set.discard(pack_fault_bits([2, 5]))
+    assert pack_fault_bits([3]) not in fault_set
+    assert pack_fault_bits([2, 5]) not in fault_set
+    assert len(fault_set) == 2
+
+    reloaded = FaultSet.from_arrays(fault_set.to_arrays('faults'), 'faults')
+    assert fault_set_state(reloaded) == fault_set_state(fault_set)
+
+
+def test_legacy_import(tmp_path):
+    legacy_db_filenames = []
+    # faults (bits TEXT, status) of the previous BNN_FaultDBMan
+    legacy_db_filenames.append(str(tmp_path / 'faults_bits.db'))
+    with sqlite3.connect(legacy_db_filenames[-1]) as legacy_conn:
+        legacy_conn.execute('CREATE TABLE faults (bits TEXT PRIMARY KEY, status VARCHAR(1), frame_addr INT, '
+                            'frame_b_offset INT, props TEXT, class_index INT, class_duration REAL)')
+        legacy_conn.execute("INSERT INTO faults VALUES ('30-10', 'E', 0, 10, 'RANDOM', 3, 0.5)")
+    # faults (bit_offset INT, executed 'Y'/'N') of BNN_FI_TestMan/BNN_FI_Man, frame_addr as hex string
+    legacy_db_filenames.append(str(tmp_path / 'faults_inj_res.db'))
+    with sqlite3.connect(legacy_db_filenames[-1]) as legacy_conn:
+        legacy_conn.execute('CREATE TABLE faults (bit_offset INT PRIMARY KEY, executed VARCHAR(1), frame_addr INT, '
+                            'frame_b_offset INT, props TEXT, class_index INT, class_name TEXT, class_duration INT)')
+        legacy_conn.execute("INSERT INTO faults VALUES (4000, 'Y', '0x1', 768, 'Block=SLICE_X0Y0', 7, 'cat', 2)")
+        legacy_conn.execute("INSERT INTO faults VALUES (5000, 'N', 1, 1768, 'RANDOM', NULL, NULL, NULL)")
+    # semu_faults (bits TEXT, executed 'Y'/'N') of BNN_FI_SEMUTestMan
+    legacy_db_filenames.append(str(tmp_path / 'faults_inj_res_semu.db'))
+    with sqlite3.connect(legacy_db_filenames[-1]) as legacy_conn:
+        legacy_conn.execute('CREATE TABLE semu_faults (bits TEXT PRIMARY KEY, executed VARCHAR(1), frame_addr INT, '
+                            'frame_b_offset INT, props TEXT, class_index INT, class_name TEXT, class_duration INT)')
+        legacy_conn.execute("INSERT INTO semu_faults VALUES ('7-8', 'Y', 0, 7, 'SEMU', 1, 'dog', 1)")
+
+    db_man = BNN_FaultDBMan(str(tmp_path / 'faults.db'))
+    assert [db_man.import_legacy_db(legacy_db_filename) for legacy_db_filename in legacy_db_filenames] == [1, 2, 1]
+
+    faults = {tuple(fault['bits']): fault for fault in db_man.get_all_faults()}
+    assert sorted(faults) == [(7, 8), (10, 30), (4000,), (5000,)]
+    assert faults[(10, 30)]['status'] == FAULT_EXECUTED
+    assert faults[(10, 30)]['props'] == 'RANDOM'
+    assert faults[(10, 30)]['class_name'] is None
+    assert faults[(4000,)]['frame_addr'] == 1
+    assert (faults[(4000,)]['props'], faults[(4000,)]['class_index'], faults[(4000,)]['class_name']) == \
+        ('Block=SLICE_X0Y0', 7, 'cat')
+    assert faults[(5000,)]['status'] == FAULT_PENDING
+    assert faults[(7, 8)]['status'] == FAULT_EXECUTED
+    assert db_man.is_fault_executed('8-7') and db_man.is_fault_executed([4000])
+    assert not db_man.is_fault_executed([5000])
+    assert db_man.is_fault_scheduled([5000])
+    # props are shared
+    assert db_man.db_conn.execute('SELECT COUNT(*) FROM fault_props').fetchone()[0] == 3
+    db_man.close()
+
+
+def test_update_fault(tmp_path):
+    db_man = BNN_FaultDBMan(str(tmp_path / 'faults.db'))
+    db_man.update_fault([5, 3], status=FAULT_PENDING, frame_addr=0, frame_b_offset=3, props='RANDOM')
+    db_man.update_fault([3, 5], status=FAULT_LEASED)
+    assert db_man.get_unexecuted_fault_bits() == [[3, 5]]
+    db_man.update_fault('3-5', status='Y', class_index=2, class_name='bird', class_duration=0.25)
+    fault, = db_man.get_fault([5, 3])
+    assert (fault['status'], fault['frame_addr'], fault['frame_b_offset'], fault['props']) == \
+        (FAULT_EXECUTED, 0, 3, 'RANDOM')
+    assert (fault['class_index'], fault['class_name'], fault['class_duration']) == (2, 'bird', 0.25)
+    assert db_man.get_unexecuted_fault_bits() == []
+    db_man.close()
+
+
+def test_fault_sets_reload(tmp_path):
+    db_filename = str(tmp_path / 'faults.db')
+    db_man = BNN_FaultDBMan(db_filename)
+    rnd = random.Random(5)
+    for _ in range(500):
+        bits = rnd.sample(range(1 << 22), rnd.choice([1, 1, 1, 2, 3]))
+        db_man.update_fault(bits, status=rnd.choice([FAULT_PENDING, FAULT_EXECUTED, FAULT_LEASED]))
+    scheduled = fault_set_state(db_man.scheduled_faults)
+    executed = fault_set_state(db_man.executed_faults)
+    db_man.close()
+
+    # from the snapshot
+    db_man = BNN_FaultDBMan(db_filename)
+    assert fault_set_state(db_man.scheduled_faults) == scheduled
+    assert fault_set_state(db_man.executed_faults) == executed
+    db_man.close()
+
+    # the snapshot does not match the database anymore: from the database
+    with sqlite3.connect(db_filename) as db_conn:
+        db_conn.execute('INSERT INTO fault_results (bits, status) VALUES (?, ?)',
+                        (pack_fault_bits([123]), FAULT_EXECUTED))
+    db_man = BNN_FaultDBMan(db_filename)
+    assert db_man.is_fault_executed([123])
+    db_man.executed_faults.discard(pack_fault_bits([123]))
+    assert fault_set_state(db_man.executed_faults) == executed
+    db_man.close()
+
+
+@pytest.fixture
+def partial_fault_inj_man(golden_bitstream, golden_ll, tmp_path, monkeypatch):
+    # bnn_faults.db and fault_inj.log in the working directory
+    monkeypatch.chdir(tmp_path)
+    fault_inj_man = BNN_FaultInjMan(golden_bitstream, golden_ll, cache_dir=str(tmp_path / 'cache'),
+                                    partial_bitstreams=True)
+    yield fault_inj_man
+    fault_inj_man.close()
+
+
+def test_partial_fault(partial_fault_inj_man, tmp_path):
+    bman = partial_fault_inj_man.bman
+    bit = bman.frame_bit_addr_to_bit_offset(3, 10, 0)
+    fault = partial_fault_inj_man.partial_fault([bit])
+
+    (tmp_path / 'partial.bit').write_bytes(fault['faulty_bitstream'])
+    partial_bman = BitstreamMan(str(tmp_path / 'partial.bit'))
+    assert partial_bman.get_frame_far(0) == bman.get_frame_far(3)
+    assert partial_bman.get_bit(10 * 32) != bman.get_bit(bit)
+
+    (tmp_path / 'repair.bit').write_bytes(fault['repair_bitstream'])
+    repair_bman = BitstreamMan(str(tmp_path / 'repair.bit'))
+    assert (repair_bman.frame_words[0] == bman.frame_words[3]).all()
+
+
+def test_partial_fault_unknown_far(partial_fault_inj_man):
+    bman = partial_fault_inj_man.bman
+    # not in the Logic Location file: full faulty bitstream
+    bit = bman.frame_bit_addr_to_bit_offset(bman.n_frames - 1, 10, 0)
+    fault = partial_fault_inj_man.partial_fault([bit])
+    assert 'repair_bitstream' not in fault
+    assert fault['faulty_bitstream'].tobytes() == bytes(bman.generate_faulty_bitstream([bit]))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import random
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from BitstreamMan import BitstreamMan
+from LogicLocationMan import LogicLocationMan
+from conftest import write_bitstream, N_WORDS_IN_FRAME, FIRST_FAR
+
+"""
+Tests of BitstreamMan, on the synthetic bitstreams of conftest.py
+"""
+
+FRAME_BITS = N_WORDS_IN_FRAME * 32
+FAULTS = [
+    [12345],
+    # same word, next word
+    [12345, 12346, 12377],
+    # first and last bit of frame 0, first bit of frame 1
+    [0, FRAME_BITS - 1, FRAME_BITS],
+    # both FDRI bursts of a split bitstream, unsorted
+    [FRAME_BITS * 150 + 7, FRAME_BITS * 60 + 31],
+]
+
+
+def expected_faulty_bitstream(bs_filename, n_frames, split, frame_words, bits):
+    """:return: the golden bitstream written with bits flipped in its frames, as dumped (no CRC write)"""
+    faulty_frame_words = list(frame_words)
+    for bit in bits:
+        faulty_frame_words[bit // 32] ^= 1 << (bit % 32)
+    write_bitstream(bs_filename, n_frames, split=split, frame_words=faulty_frame_words, crc=False)
+    with open(bs_filename, 'rb') as f_bs:
+        return f_bs.read()
+
+
+@pytest.mark.parametrize('split', [False, True])
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_faulty_bitstream_byte_identical(tmp_path, split, use_mmap):
+    golden_bs_filename = str(tmp_path / 'golden.bit')
+    faulty_bs_filename = str(tmp_path / 'faulty.bit')
+    frame_words = write_bitstream(golden_bs_filename, 200, split=split)
+    bman = BitstreamMan(golden_bs_filename, use_mmap=use_mmap)
+
+    for bits in FAULTS:
+        expected = expected_faulty_bitstream(str(tmp_path / 'expected.bit'), 200, split, frame_words, bits)
+        # template patching
+        assert bman.faulty_variant(bits).tobytes() == expected
+        assert bytes(bman.generate_faulty_bitstream(bits)) == expected
+        bman.dump_faulty_bitstream(bits, faulty_bs_filename)
+        with open(faulty_bs_filename, 'rb') as f_bs:
+            assert f_bs.read() == expected
+
+        # set_bit, dump_bitstream and set_bit back
+        golden_bits = [bman.get_bit(bit) for bit in bits]
+        for bit, golden_bit in zip(bits, golden_bits):
+            bman.set_bit(bit, 1 - golden_bit)
+        bman.dump_bitstream(faulty_bs_filename)
+        for bit, golden_bit in zip(bits, golden_bits):
+            bman.set_bit(bit, golden_bit)
+        with open(faulty_bs_filename, 'rb') as f_bs:
+            assert f_bs.read() == expected
+
+
+def test_faulty_variants_share_the_golden_bitstream(tmp_path):
+    golden_bs_filename = str(tmp_path / 'golden.bit')
+    frame_words = write_bitstream(golden_bs_filename, 200)
+    bman = BitstreamMan(golden_bs_filename)
+    golden_frame_words = bman.frame_words.copy()
+    rnd = random.Random(3)
+    faults = [rnd.sample(range(bman.n_frames * FRAME_BITS), rnd.randint(1, 4)) for _ in range(100)]
+
+    with ThreadPoolExecutor(8) as pool:
+        variants = list(pool.map(bman.faulty_variant, faults))
+
+    expected_bs_filename = str(tmp_path / 'expected.bit')
+    for bits, variant in zip(faults, variants):
+        assert variant.bit_offsets == tuple(bits)
+        assert variant.template is variants[0].template
+        assert variant.tobytes() == expected_faulty_bitstream(expected_bs_filename, 200, False, frame_words, bits)
+    # the golden frames are never modified
+    assert (bman.frame_words == golden_frame_words).all()
+    golden = expected_faulty_bitstream(expected_bs_filename, 200, False, frame_words, [])
+    assert bytes(bman.generate_faulty_bitstream([])) == golden
+
+
+def test_single_frame_partial_bitstream(golden_bitstream, golden_ll, tmp_path):
+    bman = BitstreamMan(golden_bitstream)
+    bman.register_frame_addresses(LogicLocationMan(golden_ll))
+    frame_l_addr = 7
+    bit = bman.frame_bit_addr_to_bit_offset(frame_l_addr, 30, 5)
+    partial_bs_filename = str(tmp_path / 'partial.bit')
+    bman.dump_partial_bitstream([bit], partial_bs_filename)
+
+    partial_bman = BitstreamMan(partial_bs_filename)
+    assert partial_bman.idcode == bman.idcode
+    # the frame, then the pad frame flushing the frame buffer
+    assert partial_bman.n_frames == 2
+    assert partial_bman.get_frame_far(0) == FIRST_FAR + frame_l_addr
+    faulty_frame = [int(word) for word in bman.frame_words[frame_l_addr]]
+    faulty_frame[30] ^= 1 << 5
+    assert [int(word) for word in partial_bman.frame_words[0]] == faulty_frame
+    assert not partial_bman.frame_words[1].any()
+
+
+def test_repair_partial_bitstream(golden_bitstream, golden_ll, tmp_path):
+    bman = BitstreamMan(golden_bitstream)
+    bman.register_frame_addresses(LogicLocationMan(golden_ll))
+    repair_bs_filename = str(tmp_path / 'repair.bit')
+    bman.dump_partial_bitstream([], repair_bs_filename, frame_l_addrs=[42])
+
+    repair_bman = BitstreamMan(repair_bs_filename)
+    assert repair_bman.get_frame_far(0) == FIRST_FAR + 42
+    assert (repair_bman.frame_words[0] == bman.frame_words[42]).all()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import re
+import numpy as np
+from LogicLocationMan import LogicLocationMan, load_ll_file
+from conftest import N_WORDS_IN_FRAME, FIRST_FAR
+
+"""
+Tests of LogicLocationMan, against the list parser it replaced (re.split of each line)
+"""
+
+
+def baseline_load_ll_file(ll_filename: str):
+    """:return: list of dict (bit_offset, frame_addr, frame_b_offset, props), as parsed before LogicLocationMan"""
+    ll_lst = []
+    with open(ll_filename, 'r') as f_ll:
+        for line in f_ll:
+            if not line.startswith("Bit "):
+                continue
+            line_parts = [x for x in re.split(" |\t|\n", line) if x != '']
+            ll_lst.append({
+                "bit_offset": int(line_parts[1]),
+                "frame_addr": int(line_parts[2], 16),
+                "frame_b_offset": int(line_parts[3]),
+                "props": ','.join(line_parts[4:])
+            })
+    return ll_lst
+
+
+def test_load_ll_file(golden_ll, tmp_path):
+    expected = baseline_load_ll_file(golden_ll)
+    assert load_ll_file(golden_ll) == expected
+    cache_dir = str(tmp_path / 'cache')
+    # parsed and cached, then from the cache
+    assert load_ll_file(golden_ll, cache_dir) == expected
+    assert load_ll_file(golden_ll, cache_dir) == expected
+
+
+def test_load_ll_file_spacing(tmp_path):
+    ll_filename = str(tmp_path / 'spacing.ll')
+    with open(ll_filename, 'w') as f_ll:
+        f_ll.write('Revision 3\n'
+                   '; Created by bitgen\n'
+                   'Info   0x00000000\n'
+                   'Bit      140891 0x0000042b  1915 Block=SLICE_X2Y16 Latch=AQ Net=n253\n'
+                   '\n'
+                   'Bit\t29724\t0x00000409\t636\tBlock=RAMB36_X1Y6  Ram=B:BIT138 \n'
+                   'Bit 3 0x00000400 3 Block=SLICE_X0Y0\n'
+                   'Bit 7 0x00000400 7')
+    assert load_ll_file(ll_filename) == baseline_load_ll_file(ll_filename)
+
+
+def test_membership_and_select(golden_ll):
+    ll_lst = baseline_load_ll_file(golden_ll)
+    llman = LogicLocationMan(golden_ll)
+    ll_bit_offsets = set(x['bit_offset'] for x in ll_lst)
+    assert len(llman) == len(ll_lst)
+    for bit_offset in range(0, 190 * N_WORDS_IN_FRAME * 32, 97):
+        assert (bit_offset in llman) == (bit_offset in ll_bit_offsets)
+    assert llman.contains(np.array(sorted(ll_bit_offsets))).all()
+
+    block = ll_lst[0]['props'].split(',')[0].split('=')[1]
+    assert llman.select('Block', block).tolist() == \
+        sorted(set(x['bit_offset'] for x in ll_lst if f'Block={block}' in x['props'].split(',')))
+    assert llman.frame_fars(N_WORDS_IN_FRAME) == {frame_l_addr: FIRST_FAR + frame_l_addr
+                                                  for frame_l_addr in range(190)}